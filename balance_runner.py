@@ -0,0 +1,167 @@
+""" 关卡平衡的蒙特卡洛批量模拟
+
+不开窗口，用固定种子的脚本玩家把每个关卡各跑几千局，分到多个进程并行，
+按关卡汇总胜率、通关用时、掉命数和备弹收支，输出JSON报告（逐关表格打印到标准错误）。
+单个进程每秒约模拟1.5万到3.5万步，全部40关各跑20局要1到3分钟，默认每关200局共8000局约0.2到0.5 CPU小时：
+
+    python balance_runner.py --runs 2000 --output balance.json
+    python balance_runner.py --mode battle --levels 1-3 --player bot
+    python balance_runner.py --mode classic --shop-cost life=15 --shop-cost turret=40
+"""
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import integrated_game as game
+
+# 每局汇报的字段，子进程只回传这些数，不回传GameSession对象
+FIELDS = ("status", "ticks", "lives_lost", "ammo_earned", "ammo_spent", "ammo_wasted", "matches", "killed")
+
+
+def scripted_player(kind, seed, shop=True, reserve=10):
+    """ 三消用随机交换或MatchBot（深度1、不限时，结果可复现）；shop为True时每秒看一次商店：
+    剩两条命以下买命，攒够就买炮台，备弹多于reserve时把自定义子弹打向最靠前僵尸所在的路线 """
+    swap = game.MatchBot(depth=1, budget_ms=0) if kind == "bot" else game.random_swap_player(seed)
+    def player(session):
+        swap(session)
+        if not shop or session.ticks % game.TICK_RATE: return
+        zombie_game = session.zombie_game
+        if zombie_game.lives <= 2 and session.buy_life(): return
+        if not session.turret_purchased and session.bullet_storage >= session.shop_cost('turret') and session.buy_turret(): return
+        if session.can_fire_custom_bullet() and session.bullet_storage - session.shop_cost('custom_bullet') >= reserve:
+            zombies, _ = zombie_game.snapshot()
+            if zombies: session.fire_custom_bullet(zombie_game.zombie_rows[min(zombies, key=lambda z: z[1])[0]])
+    return player
+
+
+def init_worker(settings):
+    game.headless_init()
+    game.game_settings.update(settings)
+
+
+def simulate(mode, level, seeds, player, shop, max_ticks):
+    """ 在子进程里跑一批种子，返回每局的FIELDS元组 """
+    levels = game.BATTLE_LEVELS if mode == 'battle' else game.LEVELS
+    results = []
+    for seed in seeds:
+        session = game.GameSession(mode, dict(levels[level - 1]), seed=seed, lives=15 if mode == 'battle' else None)
+        zombie_game = session.zombie_game; start_lives = zombie_game.lives
+        status = game.run_simulation(session, max_ticks, scripted_player(player, seed, shop))
+        results.append((status.name, session.ticks, start_lives + session.lives_purchased - max(zombie_game.lives, 0),
+                        session.ammo_earned, session.ammo_spent, session.ammo_wasted, session.matches_made, zombie_game.zombies_killed))
+    return mode, level, results
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))] if sorted_values else None
+
+
+def mean(values): return sum(values) / len(values) if values else None
+
+
+def summarize(level_data, runs):
+    """ 一个关卡所有局的汇总；通关用时只统计通关的局，单位秒 """
+    columns = dict(zip(FIELDS, zip(*runs)))
+    wins = sorted(ticks / game.TICK_RATE for status, ticks, *_ in runs if status == "LEVEL_COMPLETE")
+    minutes = sum(columns["ticks"]) / game.TICK_RATE / 60
+    return {
+        "level_data": {key: value for key, value in level_data.items() if value != float('inf')},
+        "runs": len(runs),
+        "win_rate": len(wins) / len(runs),
+        "game_over_rate": columns["status"].count("GAME_OVER") / len(runs),
+        "timeout_rate": columns["status"].count("PLAYING") / len(runs),
+        "time_to_complete_s": {"mean": mean(wins), "p50": percentile(wins, 0.50), "p90": percentile(wins, 0.90)},
+        "lives_lost": mean(columns["lives_lost"]),
+        "ammo": {
+            "earned_per_min": sum(columns["ammo_earned"]) / minutes if minutes else 0.0,
+            "earned": mean(columns["ammo_earned"]), "spent": mean(columns["ammo_spent"]), "wasted": mean(columns["ammo_wasted"]),
+        },
+        "matches": mean(columns["matches"]),
+        "killed": mean(columns["killed"]),
+    }
+
+
+def parse_levels(text, count):
+    """ "1-5,8" 形式的关卡列表；为空时返回全部关卡 """
+    if not text: return list(range(1, count + 1))
+    levels = []
+    for part in text.split(","):
+        first, _, last = part.partition("-")
+        levels.extend(range(int(first), int(last or first) + 1))
+    return [level for level in levels if 1 <= level <= count]
+
+
+def parse_shop_costs(items):
+    costs = dict(game.game_settings["shop_costs"])
+    for item in items:
+        name, _, value = item.partition("=")
+        if name not in costs: raise SystemExit(f"未知商店物品: {name}（可选 {', '.join(costs)}）")
+        costs[name] = int(value)
+    return costs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="关卡平衡的蒙特卡洛批量模拟")
+    parser.add_argument("--mode", choices=["classic", "battle", "all"], default="all")
+    parser.add_argument("--levels", default="", help="只模拟这些关卡，如 1-5,8（默认全部）")
+    parser.add_argument("--runs", type=int, default=200, help="每个关卡模拟的局数（全部40关时，每100局约需0.1到0.25 CPU小时）")
+    parser.add_argument("--seed", type=int, default=0, help="第i局用种子 seed+i，各关卡用同一组种子")
+    parser.add_argument("--player", choices=["random", "bot"], default="random", help="三消用随机交换还是MatchBot")
+    parser.add_argument("--no-shop", action="store_true", help="脚本玩家不使用商店")
+    parser.add_argument("--ticks", type=int, default=20 * 60 * game.TICK_RATE, help="每局最多模拟的步数，超过记为超时")
+    parser.add_argument("--shop-cost", action="append", default=[], metavar="ITEM=N", help="覆盖 game_settings 的商店价格，可重复")
+    parser.add_argument("--spawn-modifier", type=float, default=1.0, help="出怪速度倍率（zombie_spawn_rate_modifier）")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="并行进程数")
+    parser.add_argument("--chunk", type=int, default=50, help="每个任务包含的局数")
+    parser.add_argument("--output", help="把报告写入JSON文件（默认输出到标准输出）")
+    args = parser.parse_args()
+
+    settings = {"shop_costs": parse_shop_costs(args.shop_cost), "zombie_spawn_rate_modifier": args.spawn_modifier, "entity_store": "objects"}
+    level_sets = {"classic": game.LEVELS, "battle": game.BATTLE_LEVELS}
+    modes = list(level_sets) if args.mode == "all" else [args.mode]
+    seeds = [args.seed + i for i in range(args.runs)]
+    # 任务切成小块并按关卡交错提交，进程之间负载均衡，较慢的高难度关卡不会都挤在最后
+    tasks = [(mode, level, seeds[i:i + args.chunk]) for i in range(0, args.runs, args.chunk)
+             for mode in modes for level in parse_levels(args.levels, len(level_sets[mode]))]
+    collected = {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.jobs, initializer=init_worker, initargs=(settings,)) as executor:
+        futures = [executor.submit(simulate, mode, level, chunk, args.player, not args.no_shop, args.ticks) for mode, level, chunk in tasks]
+        for done, future in enumerate(as_completed(futures), 1):
+            mode, level, results = future.result()
+            collected.setdefault((mode, level), []).extend(results)
+            print(f"\r{done}/{len(futures)} 批 {time.perf_counter() - start:.0f}s", end="", file=sys.stderr)
+    elapsed = time.perf_counter() - start
+    print(file=sys.stderr)
+
+    report = {
+        "meta": {"python": platform.python_version(), "platform": platform.platform(), "timestamp": time.time(), "jobs": args.jobs,
+                 "elapsed_s": elapsed, "runs_per_level": args.runs, "seed": args.seed, "player": args.player, "shop": not args.no_shop,
+                 "max_ticks": args.ticks, "settings": settings,
+                 "ticks_per_s": sum(run[1] for runs in collected.values() for run in runs) / elapsed},
+        "levels": {mode: {} for mode in modes},
+    }
+    for (mode, level), runs in sorted(collected.items()):
+        summary = report["levels"][mode][str(level)] = summarize(level_sets[mode][level - 1], runs)
+        time_to_complete = summary["time_to_complete_s"]["p50"]
+        print(f"{mode:8s} {level:3d}  胜率 {summary['win_rate']:6.1%}  超时 {summary['timeout_rate']:6.1%}  "
+              f"通关p50 {'-' if time_to_complete is None else f'{time_to_complete:6.1f}s':>7s}  掉命 {summary['lives_lost']:5.2f}  "
+              f"备弹 +{summary['ammo']['earned']:6.1f} -{summary['ammo']['spent']:6.1f} 溢出 {summary['ammo']['wasted']:6.1f}", file=sys.stderr)
+    print(f"{sum(len(runs) for runs in collected.values())} 局，{elapsed:.1f}s，{report['meta']['ticks_per_s']:.0f} 模拟步/秒（{args.jobs} 进程）", file=sys.stderr)
+    text = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w") as f: f.write(text)
+    else: print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
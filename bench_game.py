@@ -0,0 +1,241 @@
+""" 三消和僵尸路线热点路径的基准测试
+
+在SDL dummy视频驱动下运行，固定随机种子，输出JSON格式结果（每秒调用次数、单次调用p50/p99延迟），
+并可以与保存的基线文件比较：
+
+    python bench_game.py --output bench.json
+    python bench_game.py --save-baseline bench_baseline.json
+    python bench_game.py --baseline bench_baseline.json --threshold 0.15
+"""
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+import integrated_game as game
+
+
+def make_board(seed, with_matches=False, grid_size=None, num_types=3):
+    """ 固定种子的8x8盘面；with_matches为True时随机放入若干三连；指定grid_size时用位棋盘实现 """
+    if grid_size: triple_match = game.BitboardMatchGame(rng=random.Random(seed), grid_size=grid_size, num_types=num_types)
+    else: triple_match = game.TripleMatchGame(rng=random.Random(seed))
+    if with_matches:
+        rng = random.Random(seed + 1)
+        for _ in range(6):
+            r, c = rng.randrange(triple_match.grid_size), rng.randrange(triple_match.grid_size - 2)
+            value = rng.randint(0, 2)
+            for i in range(3): triple_match.grid[r][c + i] = value
+        if grid_size: triple_match.rebuild_masks()
+    return triple_match
+
+
+def make_holes(triple_match, seed, holes):
+    rng = random.Random(seed)
+    size = triple_match.grid_size
+    for r, c in rng.sample([(r, c) for r in range(size) for c in range(size)], holes): triple_match.grid[r][c] = -1
+
+
+def make_zombie_game(seed, zombies, projectiles, store="objects", apart=False):
+    """ 在五条路线上随机摆放zombies个僵尸和projectiles发子弹；出怪间隔设为很大，只测移动和碰撞。
+    apart为True时僵尸都在最右边300像素内、子弹都在三消区右边100像素内，相向而行30多步后才开始相撞 """
+    rng = random.Random(seed)
+    zombie_game_class = game.ArrayZombieGame if store == "array" else game.ZombieGame
+    zombie_game = zombie_game_class({"zombies": 0, "spawn_rate": 10 ** 9}, rng=random.Random(seed))
+    zombie_game.lives = 10 ** 9
+    zombie_left, projectile_right = (game.SCREEN_WIDTH - 300, game.TRIPLE_MATCH_WIDTH + 100) if apart else (game.TRIPLE_MATCH_WIDTH + 100, game.SCREEN_WIDTH - 100)
+    for _ in range(zombies):
+        zombie_game.add_zombie(game.Zombie(rng.randint(zombie_left, game.SCREEN_WIDTH), rng.choice(zombie_game.zombie_rows) - 40))
+    for _ in range(projectiles):
+        zombie_game.add_projectile(game.Projectile(rng.randint(game.TRIPLE_MATCH_WIDTH, projectile_right), rng.choice(zombie_game.zombie_rows)))
+    return zombie_game
+
+
+def bench_find_matches(board, grid_size=None, num_types=3):
+    triple_match = make_board(1, with_matches=board == "matches", grid_size=grid_size, num_types=num_types)
+    return None, triple_match.find_matches
+
+
+def bench_would_match(grid_size=None, num_types=3):
+    """ 盘面上所有相邻交换各判断一次，对应点击时的无效交换检测 """
+    triple_match = make_board(8, grid_size=grid_size, num_types=num_types)
+    size = triple_match.grid_size
+    swaps = [(r, c, r, c + 1) for r in range(size) for c in range(size - 1)] + [(r, c, r + 1, c) for r in range(size - 1) for c in range(size)]
+    return None, lambda: [triple_match.would_match(*swap) for swap in swaps]
+
+
+def bench_apply_gravity(holes, grid_size=None, num_types=3):
+    triple_match = make_board(2, grid_size=grid_size, num_types=num_types)
+    snapshot = [row[:] for row in triple_match.grid]
+    def setup():
+        triple_match.grid = [row[:] for row in snapshot]
+        make_holes(triple_match, 3, holes)
+        if grid_size: triple_match.rebuild_masks()
+    return setup, triple_match.apply_gravity
+
+
+def bench_initialize_grid(grid_size=None, num_types=3):
+    triple_match = make_board(4, grid_size=grid_size, num_types=num_types)
+    return None, triple_match.initialize_grid
+
+
+def bench_zombie_update(zombies, projectiles, store="objects", warmup=3, reset_every=20):
+    """ 测稳态的每步更新：僵尸和子弹分开摆放，每局先空跑warmup步（数组存储第一次更新时排序），
+    之后连续计时reset_every步再换一局新的，两边还没相撞，计时的每一步实体数量都不变 """
+    state = {"calls": 0}
+    def setup():
+        if state["calls"] % reset_every == 0:
+            state['game'] = make_zombie_game(5, zombies, projectiles, store, apart=True)
+            for _ in range(warmup): state['game'].update()
+        state["calls"] += 1
+    return setup, lambda: state['game'].update()
+
+
+def bench_frame_draw(zombies, projectiles, store="objects"):
+    zombie_game = make_zombie_game(6, zombies, projectiles, store)
+    triple_match = make_board(7)
+    def frame():
+        game.screen.fill(game.LIGHT_GREEN)
+        triple_match.draw(game.screen)
+        zombie_game.draw(game.screen)
+    return None, frame
+
+
+def bench_frame_present(zombies, projectiles, layered):
+    """ 整帧绘制并提交到窗口：layered为True时用LayeredRenderer只更新脏矩形，否则整窗重画后flip """
+    triple_match = make_board(7)
+    def draw_hud(surface): surface.blit(game.text_cache.render(game.font_small, f"生命: {renderer.zombie_game.lives}", True, game.BLACK), (20, 80))
+    renderer = game.LayeredRenderer(triple_match, make_zombie_game(6, zombies, projectiles), draw_hud)
+    state = {"frames": 0}
+    def setup():
+        # 每300帧换一局新的，让屏幕上的实体数量大致不变
+        state["frames"] += 1
+        if state["frames"] % 300 == 0: renderer.zombie_game = make_zombie_game(6, zombies, projectiles)
+        renderer.zombie_game.update()
+    def frame():
+        if layered: renderer.render(game.screen, (renderer.zombie_game.lives,))
+        else:
+            game.screen.fill(game.LIGHT_GREEN)
+            triple_match.draw(game.screen); renderer.zombie_game.draw(game.screen); draw_hud(game.screen)
+            pygame.display.flip()
+    return setup, frame
+
+
+def bench_bot_choose(depth):
+    """ 机器人在新盘面上选一步（不限时），对应开启代打后每隔interval步的一次思考 """
+    session = game.GameSession('classic', {"zombies": 0, "spawn_rate": 10 ** 9}, seed=9)
+    state = {}
+    def setup(): state['bot'] = game.MatchBot(depth=depth, budget_ms=0)
+    return setup, lambda: state['bot'].choose(session.triple_match)
+
+
+BENCHMARKS = [
+    ("find_matches[board=stable]", bench_find_matches, {"board": "stable"}),
+    ("find_matches[board=matches]", bench_find_matches, {"board": "matches"}),
+    ("would_match[all_swaps]", bench_would_match, {}),
+    ("apply_gravity[holes=8]", bench_apply_gravity, {"holes": 8}),
+    ("apply_gravity[holes=24]", bench_apply_gravity, {"holes": 24}),
+    ("initialize_grid", bench_initialize_grid, {}),
+    ("find_matches[bitboard,grid=64,types=6]", bench_find_matches, {"board": "stable", "grid_size": 64, "num_types": 6}),
+    ("would_match[bitboard,grid=64,types=6]", bench_would_match, {"grid_size": 64, "num_types": 6}),
+    ("apply_gravity[bitboard,grid=64,holes=256]", bench_apply_gravity, {"holes": 256, "grid_size": 64, "num_types": 6}),
+    ("initialize_grid[bitboard,grid=64,types=6]", bench_initialize_grid, {"grid_size": 64, "num_types": 6}),
+    ("zombie_update[zombies=10,projectiles=10]", bench_zombie_update, {"zombies": 10, "projectiles": 10}),
+    ("zombie_update[zombies=100,projectiles=50]", bench_zombie_update, {"zombies": 100, "projectiles": 50}),
+    ("zombie_update[zombies=300,projectiles=200]", bench_zombie_update, {"zombies": 300, "projectiles": 200}),
+    ("zombie_update[zombies=3000,projectiles=1500]", bench_zombie_update, {"zombies": 3000, "projectiles": 1500}),
+    ("zombie_update[store=array,zombies=300,projectiles=200]", bench_zombie_update, {"zombies": 300, "projectiles": 200, "store": "array"}),
+    ("zombie_update[store=array,zombies=3000,projectiles=1500]", bench_zombie_update, {"zombies": 3000, "projectiles": 1500, "store": "array"}),
+    ("bot_choose[depth=1]", bench_bot_choose, {"depth": 1}),
+    ("bot_choose[depth=2]", bench_bot_choose, {"depth": 2}),
+    ("frame_draw[zombies=20,projectiles=20]", bench_frame_draw, {"zombies": 20, "projectiles": 20}),
+    ("frame_draw[zombies=200,projectiles=100]", bench_frame_draw, {"zombies": 200, "projectiles": 100}),
+    ("frame_draw[store=array,zombies=200,projectiles=100]", bench_frame_draw, {"zombies": 200, "projectiles": 100, "store": "array"}),
+    ("frame_present[flip,zombies=20,projectiles=20]", bench_frame_present, {"zombies": 20, "projectiles": 20, "layered": False}),
+    ("frame_present[layered,zombies=20,projectiles=20]", bench_frame_present, {"zombies": 20, "projectiles": 20, "layered": True}),
+]
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def run_benchmark(factory, params, min_time, min_calls=20):
+    """ 反复调用直到累计至少min_time秒；setup不计入耗时 """
+    setup, call = factory(**params)
+    for _ in range(3):
+        if setup: setup()
+        call()
+    durations = []
+    total = 0.0
+    while total < min_time or len(durations) < min_calls:
+        if setup: setup()
+        start = time.perf_counter()
+        call()
+        elapsed = time.perf_counter() - start
+        durations.append(elapsed); total += elapsed
+    durations.sort()
+    return {
+        "calls": len(durations),
+        "ops_per_sec": len(durations) / total,
+        "mean_us": total / len(durations) * 1e6,
+        "p50_us": percentile(durations, 0.50) * 1e6,
+        "p99_us": percentile(durations, 0.99) * 1e6,
+    }
+
+
+def compare(results, baseline, threshold):
+    """ 按p50比较，变慢超过threshold的记为回归 """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base: continue
+        change = result["p50_us"] / base["p50_us"] - 1 if base["p50_us"] else 0.0
+        result["baseline_p50_us"] = base["p50_us"]; result["change"] = change
+        if change > threshold: regressions.append((name, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="三消和僵尸路线热点路径基准测试")
+    parser.add_argument("--filter", default="", help="只运行名称包含该字符串的基准")
+    parser.add_argument("--min-time", type=float, default=0.5, help="每个基准至少运行的秒数")
+    parser.add_argument("--output", help="把结果写入JSON文件（默认输出到标准输出）")
+    parser.add_argument("--baseline", help="与之比较的基线JSON文件")
+    parser.add_argument("--save-baseline", help="把本次结果保存为基线文件")
+    parser.add_argument("--threshold", type=float, default=0.15, help="p50变慢超过该比例视为回归")
+    args = parser.parse_args()
+
+    game.init_display()
+    results = {}
+    for name, factory, params in BENCHMARKS:
+        if args.filter not in name: continue
+        results[name] = run_benchmark(factory, params, args.min_time)
+        print(f"{name:48s} {results[name]['ops_per_sec']:12.1f} ops/s  p50 {results[name]['p50_us']:10.1f}us  p99 {results[name]['p99_us']:10.1f}us", file=sys.stderr)
+    report = {
+        "meta": {"python": platform.python_version(), "pygame": pygame.version.ver, "platform": platform.platform(), "timestamp": time.time()},
+        "results": results,
+    }
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r") as f: regressions = compare(results, json.load(f), args.threshold)
+        report["regressions"] = [{"name": name, "change": change} for name, change in regressions]
+        for name, change in regressions: print(f"回归: {name} 变慢 {change:.1%}", file=sys.stderr)
+    text = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w") as f: f.write(text)
+    else: print(text)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f: f.write(text)
+    pygame.quit()
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,28 +1,75 @@
+import time
+STARTUP_BEGIN = time.perf_counter()
 import sys
 import os
 import pygame
 import random
+import io
 import json
-import time
+import queue
+import hashlib
+import bisect
+import gc
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
-# 尝试导入OpenCV库用于视频播放
-try:
-    import cv2
-    OPENCV_AVAILABLE = True
-except ImportError:
-    OPENCV_AVAILABLE = False
+# OpenCV和MoviePy只在无尽模式失败播放视频时用到，第一次用到时才导入，不拖慢启动。
+# 导入之前 *_AVAILABLE 为 None
+cv2 = None
+OPENCV_AVAILABLE = None
+VideoFileClip = None
+MOVIEPY_AVAILABLE = None
+
+def load_opencv():
+    """ 尝试导入OpenCV库用于视频播放 """
+    global cv2, OPENCV_AVAILABLE
+    if OPENCV_AVAILABLE is None:
+        try:
+            import cv2 as cv2_module
+            cv2 = cv2_module; OPENCV_AVAILABLE = True
+        except ImportError:
+            OPENCV_AVAILABLE = False
+    return OPENCV_AVAILABLE
+
+def load_moviepy():
+    """ 尝试导入MoviePy库用于视频播放 """
+    global VideoFileClip, MOVIEPY_AVAILABLE
+    if MOVIEPY_AVAILABLE is None:
+        try:
+            from moviepy.video.io.VideoFileClip import VideoFileClip as clip_class
+            VideoFileClip = clip_class; MOVIEPY_AVAILABLE = True
+        except ImportError:
+            try:
+                from moviepy.editor import VideoFileClip as clip_class
+                VideoFileClip = clip_class; MOVIEPY_AVAILABLE = True
+            except ImportError:
+                MOVIEPY_AVAILABLE = False
+    return MOVIEPY_AVAILABLE
 
-# 尝试导入MoviePy库用于视频播放
+# NumPy只有可选的数组化实体存储和视频播放用到（OpenCV本身也依赖它），同样第一次用到时才导入
+np = None
+NUMPY_AVAILABLE = None
+
+def load_numpy():
+    """ 尝试导入NumPy """
+    global np, NUMPY_AVAILABLE
+    if NUMPY_AVAILABLE is None:
+        try:
+            import numpy as numpy_module
+            np = numpy_module; NUMPY_AVAILABLE = True
+        except ImportError:
+            NUMPY_AVAILABLE = False
+    return NUMPY_AVAILABLE
+
+# SQLite用于可选的历史记录和排行榜（个别精简的Python发行版不带sqlite3）
 try:
-    from moviepy.video.io.VideoFileClip import VideoFileClip
-    MOVIEPY_AVAILABLE = True
+    import sqlite3
+    SQLITE_AVAILABLE = True
 except ImportError:
-    try:
-        from moviepy.editor import VideoFileClip
-        MOVIEPY_AVAILABLE = True
-    except ImportError:
-        MOVIEPY_AVAILABLE = False
-        VideoFileClip = None
+    sqlite3 = None
+    SQLITE_AVAILABLE = False
 
 from enum import Enum, auto
 
@@ -31,7 +78,29 @@ from enum import Enum, auto
 game_settings = {
     "music_volume": 0.5,
     "zombie_spawn_rate_modifier": 1.0,
-    "bullet_storage": 0,
+    # "array" 时僵尸和子弹存放在NumPy结构数组里（ArrayZombieGame），用于上千实体的压力测试配置
+    "entity_store": "objects",
+    # 渲染帧率上限；interpolate 为 True 时按两次模拟步之间的进度插值绘制僵尸和子弹，帧率高于 TICK_RATE 时画面更平滑
+    "fps": 60,
+    "interpolate": False,
+    # 每局游戏的历史记录数据库（SQLite），设为 None 时不记录，排行榜也不可用
+    "run_history_db": "game_history.db",
+    # 音效通道池大小；同一音效在 sound_coalesce_ms 毫秒内重复触发只播一次，同时最多 sound_max_voices 个声部
+    "sound_channels": 8,
+    "sound_coalesce_ms": 50,
+    "sound_max_voices": 3,
+    # 第一次进入经典无尽模式时在后台把复活视频转成屏幕分辨率的MJPG缓存，之后播放几乎不用缩放和解码开销
+    "video_transcode": True,
+    "video_cache_dir": "video_cache",
+    # 帧分析：环形缓冲保留最近多少帧；F9抓取的cProfile数据和F10导出的帧数据写到这个目录
+    "profiler_frames": 600,
+    "profiler_dir": "profiles",
+    # 每局的输入录像（种子+按模拟步记录的操作）保存目录，只保留最近 replay_keep 个；设为 None 时不录
+    "replay_dir": "replays",
+    "replay_keep": 20,
+    # 游戏中按B键让三消机器人代打：向后看几步、每步最多想多少毫秒
+    "bot_depth": 2,
+    "bot_budget_ms": 8,
     "shop_costs": {
         "life": 10,
         "custom_bullet": 2,
@@ -49,9 +118,6 @@ def resource_path(relative_path):
         base_path = os.path.abspath(".")
     return os.path.join(base_path, relative_path)
 
-# 初始化pygame
-pygame.init()
-
 # 游戏状态
 class GameState(Enum):
     SPLASH_SCREEN = auto()
@@ -69,6 +135,7 @@ class GameState(Enum):
     ENDLESS_PLAYING = auto()
     BATTLE_MODE_ENDLESS_PLAYING = auto()
     ENDLESS_GAMEOVER = auto()
+    LEADERBOARD = auto()
     QUIT = auto()
 
 # 游戏常量
@@ -78,17 +145,20 @@ TRIPLE_MATCH_WIDTH = 400
 TRIPLE_MATCH_HEIGHT = 400
 ZOMBIE_AREA_WIDTH = 800
 ZOMBIE_AREA_HEIGHT = 400
+# 模拟固定每秒60步，所有计时（出怪、炮台、商店冷却）都以步为单位，与渲染帧率无关
+TICK_RATE = 60
 
-# 加载音效
-sounds = {}
-try:
-    sounds['eliminate'] = pygame.mixer.Sound(resource_path('ogg/vi.mp3'))
-except:
-    sounds['eliminate'] = None
-try:
-    sounds['life_lost'] = pygame.mixer.Sound(resource_path('ogg/de.mp3'))
-except:
-    sounds['life_lost'] = None
+# 音效由后台资源加载器（或 init_display(preload=True)）装入；无界面模拟时保持为None，规则代码照常运行但不发声
+SOUND_FILES = {'eliminate': 'ogg/vi.mp3', 'life_lost': 'ogg/de.mp3'}
+MUSIC_FILE = 'ogg/bjyy.mp3'
+sounds = {'eliminate': None, 'life_lost': None}
+
+def load_sounds():
+    for name, path in SOUND_FILES.items():
+        try:
+            sounds[name] = pygame.mixer.Sound(resource_path(path))
+        except:
+            sounds[name] = None
 
 # 颜色定义
 WHITE = (255, 255, 255)
@@ -102,14 +172,27 @@ DARK_GREEN = (0, 100, 0)
 LIGHT_BLUE = (173, 216, 230)
 LIGHT_GREEN = (144, 238, 144)
 
-# 设置屏幕
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("一哈基三米")
-
-# 初始化字体
-pygame.font.init()
+# 窗口、字体和三消元素图片都在 init_display() 中创建，导入模块本身不会打开窗口
+screen = None
+font_small = font_medium = font_large = None
 font_path = None
 font_name = None
+elements = []
+
+class StartupTimer:
+    """ 记录启动各阶段的耗时，第一帧显示后定下来，用来盯住单文件打包版的启动速度；结果在F3浮层和F10导出里查看 """
+    def __init__(self, start):
+        self.start = self.last = start; self.phases = []; self.finished = False
+    def mark(self, phase):
+        now = time.perf_counter(); self.phases.append((phase, now - self.last)); self.last = now
+    def finish(self):
+        self.finished = True
+    def stats(self):
+        """ 首帧之前返回None """
+        if not self.finished: return None
+        return {'first_frame_ms': (self.last - self.start) * 1000, 'phases_ms': {phase: seconds * 1000 for phase, seconds in self.phases}}
+
+startup_timer = StartupTimer(STARTUP_BEGIN)
 
 def find_font():
     global font_path, font_name
@@ -124,52 +207,480 @@ def find_font():
             font_path = path
             return
 
-find_font()
-
-if font_path:
-    font_small = pygame.font.Font(font_path, 24)
-    font_medium = pygame.font.Font(font_path, 36)
-    font_large = pygame.font.Font(font_path, 48)
-elif font_name:
-    font_small = pygame.font.SysFont(font_name, 24)
-    font_medium = pygame.font.SysFont(font_name, 36)
-    font_large = pygame.font.SysFont(font_name, 48)
-else:
-    font_small = pygame.font.SysFont('sans', 24)
-    font_medium = pygame.font.SysFont('sans', 36)
-    font_large = pygame.font.SysFont('sans', 48)
-
-# 加载三消元素图片并调整大小
-try:
-    cell_size = TRIPLE_MATCH_WIDTH // 8
-    element1 = pygame.image.load(resource_path("imgs/tree/1.png")).convert_alpha()
-    element1 = pygame.transform.scale(element1, (cell_size, cell_size))
-    element2 = pygame.image.load(resource_path("imgs/tree/2.png")).convert_alpha()
-    element2 = pygame.transform.scale(element2, (cell_size, cell_size))
-    element3 = pygame.image.load(resource_path("imgs/tree/3.png")).convert_alpha()
-    element3 = pygame.transform.scale(element3, (cell_size, cell_size))
-    elements = [element1, element2, element3]
-except Exception as e:
-    print(f"加载图片失败: {e}")
-    cell_size = TRIPLE_MATCH_WIDTH // 8
-    element1 = pygame.Surface((cell_size, cell_size)); element1.fill(RED)
-    element2 = pygame.Surface((cell_size, cell_size)); element2.fill(GREEN)
-    element3 = pygame.Surface((cell_size, cell_size)); element3.fill(BLUE)
-    elements = [element1, element2, element3]
+# 上次找到的字体文件路径和修改时间；文件没变就直接用，不用再扫描系统字体
+FONT_CACHE_FILE = "font_cache.json"
+
+def load_cached_font():
+    """ 缓存的字体文件仍然存在且修改时间一致时设置 font_path 并返回True """
+    global font_path
+    try:
+        with open(FONT_CACHE_FILE, "r") as f: cached = json.load(f)
+        if cached.get("path") and os.path.getmtime(cached["path"]) == cached.get("mtime"):
+            font_path = cached["path"]
+            return True
+    except (OSError, ValueError): pass
+    return False
+
+def save_font_cache():
+    """ 把 find_font() 的结果解析成字体文件路径写入缓存 """
+    path = font_path or (pygame.font.match_font(font_name) if font_name else None)
+    if not path: return
+    try: write_file_atomic(FONT_CACHE_FILE, json.dumps({"path": path, "mtime": os.path.getmtime(path)}))
+    except OSError as e: print(f"保存字体缓存失败: {e}")
+
+def load_fonts():
+    global font_small, font_medium, font_large
+    pygame.font.init()
+    if not load_cached_font():
+        find_font(); save_font_cache()
+    if font_path:
+        font_small = pygame.font.Font(font_path, 24)
+        font_medium = pygame.font.Font(font_path, 36)
+        font_large = pygame.font.Font(font_path, 48)
+    elif font_name:
+        font_small = pygame.font.SysFont(font_name, 24)
+        font_medium = pygame.font.SysFont(font_name, 36)
+        font_large = pygame.font.SysFont(font_name, 48)
+    else:
+        font_small = pygame.font.SysFont('sans', 24)
+        font_medium = pygame.font.SysFont('sans', 36)
+        font_large = pygame.font.SysFont('sans', 48)
+
+# 第4种及以后的元素用前三种图片乘上这些颜色得到
+TILE_TINTS = [(255, 220, 0), (200, 80, 255), (0, 230, 230), (255, 140, 180), (120, 120, 120), (255, 150, 40)]
+# 每种元素颜色都不同时最多支持的种类数
+MAX_TILE_TYPES = 3 + len(TILE_TINTS)
+# 盘面边长的范围：至少3格才能凑成三连；最多64格，格子还有6像素。边长不整除三消区宽度时右边和下边留出不到一格的空白
+MAX_GRID_SIZE = 64
+_tile_sets = {}
+
+def tile_surfaces(num_types, size):
+    """ num_types种元素在size大小下的图片；前三种是imgs/tree下的图片（失败时用纯色方块），多出的种类着色生成 """
+    key = (num_types, size)
+    if key not in _tile_sets:
+        base = [sprite_cache.get(f"imgs/tree/{i}.png", (size, size)) for i in (1, 2, 3)]
+        if None in base: base = [sprite_cache.solid((size, size), color) for color in (RED, GREEN, BLUE)]
+        tiles = base[:num_types]
+        for k in range(3, num_types):
+            tile = base[k % 3].copy(); tile.fill(TILE_TINTS[(k - 3) % len(TILE_TINTS)], special_flags=pygame.BLEND_RGB_MULT)
+            tiles.append(tile)
+        _tile_sets[key] = tiles
+    return _tile_sets[key]
+
+def load_elements():
+    """ 加载三消元素图片并调整大小，失败时用纯色方块代替 """
+    _tile_sets.clear()
+    elements[:] = tile_surfaces(3, TRIPLE_MATCH_WIDTH // 8)
+
+def init_display(preload=True):
+    """ 初始化pygame、创建窗口并加载字体；preload为True时同步加载元素图片和音效，
+    游戏本体传False，改由 AssetLoader 在开屏页期间后台加载 """
+    global screen
+    pygame.init(); startup_timer.mark("pygame.init")
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    pygame.display.set_caption("一哈基三米"); startup_timer.mark("window")
+    load_fonts(); startup_timer.mark("fonts")
+    if preload:
+        load_sounds(); startup_timer.mark("sounds")
+        load_elements(); startup_timer.mark("elements")
+
+def headless_init():
+    """ 无界面模式：不创建窗口、不打开混音器，只准备规则计算需要的图片尺寸（子弹碰撞框取自图片大小） """
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    load_elements()
+
+# 共享贴图缓存：同一(路径, 尺寸)的图片只解码、转换、缩放一次，所有实体共用同一个Surface
+class SpriteCache:
+    def __init__(self):
+        self._surfaces = {}
+        self.hits = 0
+        self.misses = 0
+    def get(self, relative_path, size=None):
+        """ 返回缩放到size的共享图片，加载失败时返回None（失败结果同样缓存，只报错一次） """
+        key = (relative_path, size)
+        if key in self._surfaces:
+            self.hits += 1
+            return self._surfaces[key]
+        self.misses += 1
+        try:
+            image = pygame.image.load(resource_path(relative_path))
+            image = image.convert_alpha() if pygame.display.get_surface() else image
+            if size: image = pygame.transform.scale(image, size)
+        except Exception as e:
+            print(f"加载图片 '{relative_path}' 失败: {e}")
+            image = None
+        self._surfaces[key] = image
+        return image
+    def put(self, relative_path, size, image):
+        """ 放入已在别处加载好的图片（后台资源加载器在主线程转换格式后调用） """
+        self._surfaces[(relative_path, size)] = image
+    def solid(self, size, color):
+        """ 图片缺失时使用的纯色替代图，同样只创建一次 """
+        key = ('solid', size, color)
+        if key not in self._surfaces:
+            self._surfaces[key] = pygame.Surface(size); self._surfaces[key].fill(color)
+        return self._surfaces[key]
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._surfaces)}
+
+sprite_cache = SpriteCache()
+# 实体用到的贴图，进入游戏前预加载，避免第一只僵尸/第一发子弹出现时卡顿
+ENTITY_SPRITES = [("imgs/zombie.png", (60, 80)), ("imgs/zd.png", (30, 30)), ("imgs/peashooter.png", (50, 50))]
+
+# 后台资源加载：工作线程读取、解码并缩放图片和音效，把背景音乐整个读进内存；
+# convert_alpha 和播放音乐要碰窗口和混音器，留给主线程在 install() 里做
+class AssetLoader:
+    def __init__(self, images, sound_files, music_file=None):
+        self.images = list(images)
+        self.sound_files = dict(sound_files)
+        self.music_file = music_file
+        self.total = len(self.images) + len(self.sound_files) + (1 if music_file else 0)
+        self.completed = 0
+        self.lock = threading.Lock()
+        self.loaded_images = {}; self.loaded_sounds = {}; self.music_data = None
+        self.music_ready = threading.Event(); self.music_started = False
+        self.thread = None; self.installed = False
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="asset-loader", daemon=True)
+        self.thread.start()
+        return self
+    def _step(self):
+        with self.lock: self.completed += 1
+    def _run(self):
+        # 背景音乐只是读文件，最先做，开屏页面一出来就能开始播放
+        if self.music_file:
+            try:
+                with open(resource_path(self.music_file), 'rb') as f: self.music_data = f.read()
+            except OSError as e: print(f"加载背景音乐失败: {e}")
+            self._step()
+        self.music_ready.set()
+        for relative_path, size in self.images:
+            try:
+                image = pygame.image.load(resource_path(relative_path))
+                if size: image = pygame.transform.scale(image, size)
+            except Exception as e:
+                print(f"加载图片 '{relative_path}' 失败: {e}")
+                image = None
+            self.loaded_images[(relative_path, size)] = image; self._step()
+        for name, path in self.sound_files.items():
+            try: self.loaded_sounds[name] = pygame.mixer.Sound(resource_path(path))
+            except Exception: self.loaded_sounds[name] = None
+            self._step()
+    def progress(self):
+        """ 已完成的比例，0.0 ~ 1.0 """
+        with self.lock: return self.completed / self.total if self.total else 1.0
+    def done(self):
+        return self.thread is None or not self.thread.is_alive()
+    def start_music(self):
+        """ 主线程调用：背景音乐读好后开始播放，开屏和版本页面每帧调用一次，只会播放一次 """
+        if self.music_started or not self.music_ready.is_set(): return
+        self.music_started = True
+        play_background_music()
+    def install(self):
+        """ 主线程调用：等工作线程结束，把图片转换成显示格式放进 sprite_cache，装好音效；背景音乐还没开始时开始播放 """
+        if self.installed: return
+        if self.thread: self.thread.join()
+        display = pygame.display.get_surface() is not None
+        for (relative_path, size), image in self.loaded_images.items():
+            sprite_cache.put(relative_path, size, image.convert_alpha() if image and display else image)
+        sounds.update(self.loaded_sounds)
+        load_elements()
+        self.start_music()
+        self.installed = True
+
+def startup_assets():
+    """ 进入游戏前必须就绪的资源：三消元素图片、实体贴图、音效和背景音乐 """
+    cell = TRIPLE_MATCH_WIDTH // 8
+    tiles = [(f"imgs/tree/{i}.png", (cell, cell)) for i in (1, 2, 3)]
+    return AssetLoader(tiles + ENTITY_SPRITES, SOUND_FILES, MUSIC_FILE)
+
+asset_loader = None
+
+def play_background_music(start=0.0):
+    """ 从start秒处开始循环播放背景音乐；资源加载器已读进内存时直接从内存解码，不再读盘 """
+    try:
+        if asset_loader and asset_loader.music_data:
+            pygame.mixer.music.load(io.BytesIO(asset_loader.music_data), os.path.splitext(MUSIC_FILE)[1][1:])
+        else: pygame.mixer.music.load(resource_path(MUSIC_FILE))
+        pygame.mixer.music.set_volume(game_settings["music_volume"])
+        pygame.mixer.music.play(-1, start=start); audio.music_start = start
+    except (pygame.error, OSError) as e: print(f"加载背景音乐失败: {e}")
+
+# 音效统一从这里播放：固定大小的通道池，通道占满或同一音效声部超限时抢占最早开始的那个，
+# 同一音效在很短时间内重复触发（连锁三消、一次射出多发子弹）合并成一次。
+# 视频配音这类长音轨不走通道池，和背景音乐一样用 mixer.music 流式播放
+class AudioManager:
+    def __init__(self):
+        self.channels = []
+        self.voices = []
+        self.last_played = {}
+        self.music_paused = False
+        self.music_start = 0.0; self.music_resume_at = None; self.track_playing = False
+        self.played = 0; self.coalesced = 0; self.stolen = 0
+    def setup(self, num_channels=None, coalesce_ms=None, max_voices=None):
+        """ 混音器初始化之后调用；没调用（无界面模拟）时所有播放都是空操作 """
+        num_channels = num_channels or game_settings["sound_channels"]
+        self.coalesce_ms = game_settings["sound_coalesce_ms"] if coalesce_ms is None else coalesce_ms
+        self.max_voices = max_voices or game_settings["sound_max_voices"]
+        pygame.mixer.set_num_channels(num_channels)
+        self.channels = [pygame.mixer.Channel(i) for i in range(num_channels)]
+        self.voices = [None] * num_channels
+    def play(self, name):
+        """ 播放sounds里的音效name；被合并时返回False """
+        sound = sounds.get(name)
+        if sound is None or not self.channels: return False
+        now = pygame.time.get_ticks()
+        last = self.last_played.get(name)
+        if last is not None and now - last < self.coalesce_ms: self.coalesced += 1; return False
+        self.last_played[name] = now
+        busy = [i for i, channel in enumerate(self.channels) if channel.get_busy()]
+        same = [i for i in busy if self.voices[i] and self.voices[i][0] == name]
+        started = lambda i: self.voices[i][1] if self.voices[i] else 0
+        if len(same) >= self.max_voices: index = min(same, key=started); self.stolen += 1
+        elif len(busy) < len(self.channels): index = next(i for i, channel in enumerate(self.channels) if not channel.get_busy())
+        else: index = min(busy, key=started); self.stolen += 1
+        self.channels[index].play(sound)
+        self.voices[index] = (name, now); self.played += 1
+        return True
+    def music_position(self):
+        """ 背景音乐播放到的秒数，按混音器实际混出的时长计算；没在播放时返回None """
+        position = pygame.mixer.music.get_pos()
+        return None if position < 0 else self.music_start + position / 1000
+    def play_track(self, path):
+        """ 记下背景音乐的位置，改用 mixer.music 流式播放一段音轨（视频配音），不把整段解码进内存 """
+        if not self.channels: return
+        self.music_resume_at = self.music_position()
+        pygame.mixer.music.load(path)
+        pygame.mixer.music.set_volume(game_settings["music_volume"])
+        pygame.mixer.music.play(); self.track_playing = True
+    def track_time(self):
+        """ 音轨实际播放到的秒数，用作视频画面的时钟；混音器晚开始时也不会漂移。没有在播放时返回None """
+        if not self.track_playing or not pygame.mixer.music.get_busy(): return None
+        return pygame.mixer.music.get_pos() / 1000
+    def end_track(self):
+        """ 停止音轨，背景音乐从play_track时记下的位置继续 """
+        if not self.track_playing: return
+        pygame.mixer.music.stop(); self.track_playing = False
+        play_background_music(self.music_resume_at or 0.0)
+    def pause_music(self):
+        pygame.mixer.music.pause(); self.music_paused = True
+    def resume_music(self):
+        """ 从暂停的位置继续播放背景音乐；之前没在播放时从头开始 """
+        if self.music_paused: pygame.mixer.music.unpause(); self.music_paused = False
+        else: play_background_music()
+    def stats(self):
+        return {'played': self.played, 'coalesced': self.coalesced, 'stolen': self.stolen}
+
+audio = AudioManager()
+
+def draw_loading_bar(surface, progress, y):
+    """ 在y处画资源加载进度条 """
+    bar = pygame.Rect(SCREEN_WIDTH // 2 - 200, y, 400, 16)
+    pygame.draw.rect(surface, LIGHT_BLUE, (bar.x, bar.y, int(bar.width * progress), bar.height))
+    pygame.draw.rect(surface, GRAY, bar, 2)
+    label = text_cache.render(font_small, f"加载资源 {int(progress * 100)}%", True, GRAY)
+    surface.blit(label, (SCREEN_WIDTH // 2 - label.get_width() // 2, y + 22))
+
+def loading_screen():
+    """ 资源还没加载完时显示进度，加载完后在主线程安装资源；点关闭返回False """
+    clock = pygame.time.Clock()
+    while not asset_loader.done():
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT: return False
+        asset_loader.start_music()
+        screen.fill(WHITE)
+        draw_loading_bar(screen, asset_loader.progress(), SCREEN_HEIGHT // 2)
+        pygame.display.flip()
+        clock.tick(30)
+    asset_loader.install()
+    # 启动时创建的图片、字体和缓存会一直存在，移出分代回收，之后的完整回收不必每次再扫描它们
+    gc.collect(); gc.freeze()
+    return True
+
+# 文字渲染缓存：HUD、按钮和菜单的文字大多每帧不变，中文字形栅格化很贵，按(字体, 文本, 抗锯齿, 颜色)缓存渲染结果
+class TextCache:
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    def render(self, font, text, antialias, color):
+        """ 与font.render参数相同；超出容量时淘汰最久未使用的条目，不断变化的分数不会让缓存无限增长 """
+        key = (font, text, antialias, color)
+        surface = self._surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self._surfaces.move_to_end(key)
+            return surface
+        self.misses += 1
+        surface = font.render(text, antialias, color)
+        self._surfaces[key] = surface
+        while len(self._surfaces) > self.max_entries: self._surfaces.popitem(last=False)
+        return surface
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._surfaces), 'hit_rate': self.hits / total if total else 0.0}
+
+text_cache = TextCache()
 
 # 用户数据文件
 USER_DATA_FILE = "user_data.json"
 
-def load_user_data():
-    if not os.path.exists(USER_DATA_FILE): return {}
+def load_user_data(path=USER_DATA_FILE):
+    if not os.path.exists(path): return {}
     try:
-        with open(USER_DATA_FILE, "r") as f:
+        with open(path, "r") as f:
             data = json.load(f)
             return data
     except json.JSONDecodeError: return {}
 
-def save_user_data(data):
-    with open(USER_DATA_FILE, "w") as f: json.dump(data, f, indent=4)
+def write_file_atomic(path, text):
+    """ 先写同目录下的临时文件再用 os.replace 替换，写到一半崩溃时原文件保持完整 """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f: f.write(text); f.flush(); os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path): os.remove(temp_path)
+        raise
+
+def save_user_data(data, path=USER_DATA_FILE): write_file_atomic(path, json.dumps(data, indent=4))
+
+class ProfileStore:
+    """ 用户数据的内存缓存：第一次用到时读一次 user_data.json，之后读写都在内存里。
+    修改后由后台线程在 delay 秒内没有新修改时整体写盘（原子替换）；退出前调用 flush() 立即写完 """
+    def __init__(self, path=USER_DATA_FILE, delay=0.5):
+        self.path = path; self.delay = delay
+        self.data = None; self.version = 0; self._users = None
+        self.pending = False; self.last_change = 0.0; self.thread = None
+        self.condition = threading.Condition(); self.write_lock = threading.Lock()
+    def _load(self):
+        if self.data is None: self.data = load_user_data(self.path)
+        return self.data
+    def users(self):
+        """ 所有用户名（按创建顺序），列表在用户增减时才重建 """
+        with self.condition:
+            if self._users is None: self._users = list(self._load().keys())
+            return self._users
+    def get(self, username):
+        with self.condition: return dict(self._load().get(username, {}))
+    def create(self, username):
+        with self.condition:
+            if not username or username in self._load(): return False
+            self.data[username] = {"level": 1}; self._users = None; self._changed()
+            return True
+    def update(self, username, **fields):
+        with self.condition:
+            self._load().setdefault(username, {"level": 1}).update(fields); self._changed()
+    def _changed(self):
+        self.version += 1; self.pending = True; self.last_change = time.monotonic()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="profile-writer", daemon=True); self.thread.start()
+        self.condition.notify()
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending: self.condition.wait()
+                # 去抖：等到最后一次修改后 delay 秒内都没有新修改再写
+                while (remaining := self.last_change + self.delay - time.monotonic()) > 0: self.condition.wait(remaining)
+            self._write()
+    def _write(self):
+        # write_lock 保证快照按顺序落盘，后台写和 flush 同时发生时也不会用旧数据覆盖新数据
+        with self.write_lock:
+            with self.condition:
+                if not self.pending: return
+                text = json.dumps(self.data, indent=4); self.pending = False
+            try: write_file_atomic(self.path, text)
+            except OSError as e: print(f"保存用户数据失败: {e}")
+    def flush(self): self._write()
+
+profile_store = ProfileStore()
+
+class RunHistory:
+    """ 每局游戏的历史记录（SQLite）。所有数据库操作都在同一个后台线程里按提交顺序执行：
+    record() 只把一行放进待写列表，积攒的多行在一个事务里批量插入；查询返回 Future，界面每帧检查是否完成，不卡画面 """
+    SCHEMA_VERSION = 2
+    COLUMNS = ("username", "mode", "level", "endless", "outcome", "score", "elapsed_time", "zombies_killed", "matches_made", "played_at")
+    def __init__(self, path, legacy_profiles=None, legacy_path=None):
+        self.path = path; self.legacy_profiles = legacy_profiles; self.legacy_path = legacy_path; self.connection = None
+        self.lock = threading.Lock(); self.pending = []; self.insert_scheduled = False
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="run-history")
+        self.ready = self.executor.submit(self._open)
+    def _open(self):
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self._migrate()
+    def _migrate(self):
+        """ 按 PRAGMA user_version 逐步升级：1 建表和索引，2 导入 user_data.json 里的无尽模式最高分 """
+        connection = self.connection
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            with connection:
+                connection.execute("""CREATE TABLE IF NOT EXISTS runs (
+                    id INTEGER PRIMARY KEY, username TEXT NOT NULL, mode TEXT NOT NULL, level INTEGER, endless INTEGER NOT NULL,
+                    outcome TEXT NOT NULL, score INTEGER NOT NULL DEFAULT 0, elapsed_time INTEGER, zombies_killed INTEGER,
+                    matches_made INTEGER, played_at REAL NOT NULL)""")
+                # 无尽排行：(mode, endless) 过滤后按用户取最高分，索引覆盖整个查询
+                connection.execute("CREATE INDEX IF NOT EXISTS runs_endless_score ON runs (mode, endless, username, score)")
+                # 各关最快通关
+                connection.execute("CREATE INDEX IF NOT EXISTS runs_level_time ON runs (mode, outcome, level, elapsed_time)")
+                # 单个用户的最近记录和成绩走势
+                connection.execute("CREATE INDEX IF NOT EXISTS runs_user_time ON runs (username, played_at)")
+                connection.execute("PRAGMA user_version = 1")
+        if version < 2:
+            profiles = self.legacy_profiles() if self.legacy_profiles else {}
+            migrated_at = os.path.getmtime(self.legacy_path) if self.legacy_path and os.path.exists(self.legacy_path) else time.time()
+            rows = [(username, 'classic', None, 1, 'migrated', profile["best_score"], None, None, None, migrated_at)
+                    for username, profile in profiles.items() if profile.get("best_score", 0) > 0]
+            with connection:
+                connection.executemany(self._insert_sql(), rows)
+                connection.execute("PRAGMA user_version = 2")
+    def _insert_sql(self):
+        return f"INSERT INTO runs ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})"
+    def record(self, username, mode, level, endless, outcome, score=0, elapsed_time=None, zombies_killed=None, matches_made=None):
+        row = (username, mode, level, int(bool(endless)), outcome, score, elapsed_time, zombies_killed, matches_made, time.time())
+        with self.lock:
+            self.pending.append(row)
+            if self.insert_scheduled: return
+            self.insert_scheduled = True
+        self.executor.submit(self._insert_pending)
+    def _insert_pending(self):
+        with self.lock: rows = self.pending; self.pending = []; self.insert_scheduled = False
+        if not rows or self.connection is None: return
+        try:
+            with self.connection: self.connection.executemany(self._insert_sql(), rows)
+        except sqlite3.Error as e: print(f"保存游戏记录失败: {e}")
+    def query(self, sql, params=()):
+        """ 在后台线程执行查询，返回 Future（结果是行列表） """
+        return self.executor.submit(self._fetch, sql, params)
+    def _fetch(self, sql, params): return self.connection.execute(sql, params).fetchall()
+    def top_endless_scores(self, mode, limit=10):
+        return self.query("SELECT username, MAX(score) AS best FROM runs WHERE mode = ? AND endless = 1 GROUP BY username ORDER BY best DESC LIMIT ?", (mode, limit))
+    def best_level_times(self, mode):
+        # SQLite 中与 MIN() 同一查询的裸列取自最小值所在的那一行
+        return self.query("SELECT level, username, MIN(elapsed_time) FROM runs WHERE mode = ? AND outcome = 'complete' AND level IS NOT NULL GROUP BY level ORDER BY level", (mode,))
+    def recent_runs(self, username, limit=10):
+        return self.query("SELECT mode, level, endless, outcome, score, elapsed_time, played_at FROM runs WHERE username = ? ORDER BY played_at DESC LIMIT ?", (username, limit))
+    def close(self):
+        """ 写完所有待写记录后关闭数据库 """
+        self.executor.shutdown(wait=True)
+        if self.connection is not None: self.connection.close(); self.connection = None
+
+run_history = None
+
+def open_run_history():
+    global run_history
+    if run_history is None and SQLITE_AVAILABLE and game_settings["run_history_db"]:
+        run_history = RunHistory(game_settings["run_history_db"], legacy_profiles=lambda: {user: profile_store.get(user) for user in profile_store.users()},
+                                 legacy_path=profile_store.path)
+    return run_history
+
+def record_run(username, session, level, outcome, elapsed_time=None):
+    """ 一局结束（通关、失败或中途退出）时写一条历史记录；没有启用记录时什么都不做 """
+    if run_history is None: return
+    run_history.record(username, session.mode, level, session.endless, outcome, session.zombie_game.score,
+                       elapsed_time, session.zombie_game.zombies_killed, session.matches_made)
 
 class Button:
     def __init__(self, x, y, width, height, text, color, text_color=BLACK):
@@ -179,7 +690,7 @@ class Button:
         self.text_color = text_color
     def draw(self, surface):
         pygame.draw.rect(surface, self.color, self.rect)
-        text_surf = font_medium.render(self.text, True, self.text_color)
+        text_surf = text_cache.render(font_medium, self.text, True, self.text_color)
         text_rect = text_surf.get_rect(center=self.rect.center)
         surface.blit(text_surf, text_rect)
     def is_clicked(self, pos): return self.rect.collidepoint(pos)
@@ -188,45 +699,61 @@ class Button:
 def splash_screen():
     """开屏页面 - 显示3秒或按任意键跳过"""
     start_time = pygame.time.get_ticks()
+    title_font = pygame.font.Font(font_path, 72) if font_path else pygame.font.SysFont(font_name or 'sans', 72)
+    dirty = True; shown_progress = None
     while True:
-        current_time = pygame.time.get_ticks()
-        elapsed_time = (current_time - start_time) // 1000
+        remaining = 3 - (pygame.time.get_ticks() - start_time) / 1000
         
         # 如果超过3秒，自动进入下一个页面
-        if elapsed_time >= 3:
+        if remaining <= 0:
             return GameState.VERSION_INFO
         
-        for event in pygame.event.get():
+        profiler.begin("splash")
+        # 资源还在后台加载时每50毫秒醒一次刷新进度条，否则一直睡到3秒结束或有输入
+        loading = asset_loader and not asset_loader.installed and not asset_loader.done()
+        for event in wait_for_events(0 if dirty else min(remaining, 0.05) if loading else remaining):
+            if profiler.handle_event(event): dirty = True; continue
             if event.type == pygame.QUIT:
                 return GameState.QUIT
             elif event.type == pygame.KEYDOWN or event.type == pygame.MOUSEBUTTONDOWN:
                 # 按任意键或点击鼠标跳过
                 return GameState.VERSION_INFO
+            elif event.type == pygame.VIDEOEXPOSE: dirty = True
+        profiler.mark("events")
+        if asset_loader: asset_loader.start_music()
+        progress = asset_loader.progress() if asset_loader and not asset_loader.installed else None
+        if not (dirty or progress != shown_progress or profiler.overlay): continue
+        dirty = False; shown_progress = progress
         
         screen.fill(WHITE)
         
         # 显示版本号
-        version_text = font_medium.render("版本 3.2beta-0809", True, BLACK)
+        version_text = text_cache.render(font_medium, "版本 3.2beta-0809", True, BLACK)
         screen.blit(version_text, (SCREEN_WIDTH // 2 - version_text.get_width() // 2, SCREEN_HEIGHT // 2 + 50))
         
         # 显示大字游戏名称
-        title_font = pygame.font.Font(font_path, 72) if font_path else pygame.font.SysFont(font_name or 'sans', 72)
-        title_text = title_font.render("一哈基三米", True, BLACK)
+        title_text = text_cache.render(title_font, "一哈基三米", True, BLACK)
         screen.blit(title_text, (SCREEN_WIDTH // 2 - title_text.get_width() // 2, SCREEN_HEIGHT // 2 - 100))
         
         # 显示开发者信息
-        developer_text = font_medium.render("哔哩哔哩  我就是仁菜  开发", True, BLACK)
+        developer_text = text_cache.render(font_medium, "哔哩哔哩  我就是仁菜  开发", True, BLACK)
         screen.blit(developer_text, (SCREEN_WIDTH // 2 - developer_text.get_width() // 2, SCREEN_HEIGHT // 2 + 100))
+        if progress is not None: draw_loading_bar(screen, progress, SCREEN_HEIGHT - 100)
         
-        pygame.display.flip()
+        present()
+        if not startup_timer.finished: startup_timer.mark("first_frame"); startup_timer.finish()
 
 
 def version_info_screen():
     """版本信息页面 - 显示更新介绍"""
     back_button = Button(SCREEN_WIDTH // 2 - 100, SCREEN_HEIGHT - 100, 200, 50, "进入游戏", GREEN)
-    
+    dirty = True; shown_progress = None
     while True:
-        for event in pygame.event.get():
+        profiler.begin("version_info")
+        loading = asset_loader and not asset_loader.installed and not asset_loader.done()
+        for event in wait_for_events(0 if dirty else 0.05 if loading else None):
+            if profiler.handle_event(event): dirty = True; continue
+            if event.type == pygame.VIDEOEXPOSE: dirty = True
             if event.type == pygame.QUIT:
                 return GameState.QUIT
             elif event.type == pygame.MOUSEBUTTONDOWN:
@@ -235,15 +762,20 @@ def version_info_screen():
             elif event.type == pygame.KEYDOWN:
                 # 按任意键也可以进入游戏
                 return GameState.ACCOUNT_SELECTION
+        profiler.mark("events")
+        if asset_loader: asset_loader.start_music()
+        progress = asset_loader.progress() if asset_loader and not asset_loader.installed else None
+        if not (dirty or progress != shown_progress or profiler.overlay): continue
+        dirty = False; shown_progress = progress
         
         screen.fill(WHITE)
         
         # 显示版本号
-        version_text = font_large.render("版本 3.2beta-0809", True, BLACK)
+        version_text = text_cache.render(font_large, "版本 3.2beta-0809", True, BLACK)
         screen.blit(version_text, (SCREEN_WIDTH // 2 - version_text.get_width() // 2, 100))
         
         # 显示更新介绍标题
-        update_title = font_medium.render("更新介绍", True, BLACK)
+        update_title = text_cache.render(font_medium, "更新介绍", True, BLACK)
         screen.blit(update_title, (SCREEN_WIDTH // 2 - update_title.get_width() // 2, 200))
         
         # 显示更新内容
@@ -254,192 +786,229 @@ def version_info_screen():
         
         y_offset = 280
         for line in update_content:
-            content_text = font_small.render(line, True, BLACK)
+            content_text = text_cache.render(font_small, line, True, BLACK)
             screen.blit(content_text, (SCREEN_WIDTH // 2 - content_text.get_width() // 2, y_offset))
             y_offset += 40
         
         back_button.draw(screen)
-        pygame.display.flip()
+        if progress is not None: draw_loading_bar(screen, progress, SCREEN_HEIGHT - 170)
+        present()
+
 
+# 账号列表一屏最多显示的行数，更多的账号用鼠标滚轮翻看
+ACCOUNT_LIST_ROWS = 8
 
 def account_selection_screen():
-    user_data = load_user_data()
     creating_user = False
     new_username = ""
+    scroll = 0; layout_key = None; dirty = True
     while True:
-        buttons = []
-        users = list(load_user_data().keys())
-        y_offset = 150
-        for i, user in enumerate(users): buttons.append(Button(SCREEN_WIDTH // 2 - 150, y_offset + i * 60, 300, 50, user, LIGHT_BLUE))
-        new_user_button = Button(SCREEN_WIDTH // 2 - 150, y_offset + len(users) * 60, 300, 50, "创建新账号", GREEN)
-        input_box_y = y_offset + (len(users) + 1) * 60
-        input_box = pygame.Rect(SCREEN_WIDTH // 2 - 150, input_box_y, 300, 50)
-        confirm_button = Button(SCREEN_WIDTH // 2 - 150, input_box_y + 60, 140, 50, "确认", GREEN)
-        cancel_button = Button(SCREEN_WIDTH // 2 + 10, input_box_y + 60, 140, 50, "取消", RED)
-        for event in pygame.event.get():
+        users = profile_store.users()
+        max_scroll = max(0, len(users) - ACCOUNT_LIST_ROWS); scroll = min(scroll, max_scroll)
+        if layout_key != (profile_store.version, scroll):
+            # 只为可见的几行建按钮，且只在账号增减或滚动时重建
+            layout_key = (profile_store.version, scroll)
+            visible_users = users[scroll:scroll + ACCOUNT_LIST_ROWS]
+            y_offset = 150
+            buttons = [Button(SCREEN_WIDTH // 2 - 150, y_offset + i * 60, 300, 50, user, LIGHT_BLUE) for i, user in enumerate(visible_users)]
+            new_user_button = Button(SCREEN_WIDTH // 2 - 150, y_offset + len(visible_users) * 60, 300, 50, "创建新账号", GREEN)
+            input_box_y = y_offset + (len(visible_users) + 1) * 60
+            input_box = pygame.Rect(SCREEN_WIDTH // 2 - 150, input_box_y, 300, 50)
+            confirm_button = Button(SCREEN_WIDTH // 2 - 150, input_box_y + 60, 140, 50, "确认", GREEN)
+            cancel_button = Button(SCREEN_WIDTH // 2 + 10, input_box_y + 60, 140, 50, "取消", RED)
+            dirty = True
+        profiler.begin("account_selection")
+        for event in wait_for_events(0 if dirty else None):
+            if profiler.handle_event(event): dirty = True; continue
             if event.type == pygame.QUIT: return None, GameState.QUIT
-            if event.type == pygame.MOUSEBUTTONDOWN:
+            # 只有滚轮、点击、按键会改变页面内容，鼠标移动不重画
+            if event.type in (pygame.MOUSEWHEEL, pygame.MOUSEBUTTONDOWN, pygame.KEYDOWN, pygame.VIDEOEXPOSE): dirty = True
+            if event.type == pygame.MOUSEWHEEL and not creating_user: scroll = max(0, min(max_scroll, scroll - event.y))
+            if event.type == pygame.MOUSEBUTTONDOWN and event.button in (1, 2, 3):
                 if not creating_user:
                     if new_user_button.is_clicked(event.pos): creating_user = True; new_username = ""
                     for i, button in enumerate(buttons):
-                        if button.is_clicked(event.pos): return users[i], GameState.MAIN_MENU
+                        if button.is_clicked(event.pos): return visible_users[i], GameState.MAIN_MENU
                 else:
                     if confirm_button.is_clicked(event.pos):
-                        if new_username and new_username not in user_data:
-                            user_data[new_username] = {"level": 1}; save_user_data(user_data); return new_username, GameState.MAIN_MENU
+                        if profile_store.create(new_username): return new_username, GameState.MAIN_MENU
                     if cancel_button.is_clicked(event.pos): creating_user = False; new_username = ""
             if event.type == pygame.KEYDOWN and creating_user:
                 if event.key == pygame.K_RETURN:
-                    if new_username and new_username not in user_data:
-                        user_data[new_username] = {"level": 1}; save_user_data(user_data); return new_username, GameState.MAIN_MENU
+                    if profile_store.create(new_username): return new_username, GameState.MAIN_MENU
                 elif event.key == pygame.K_BACKSPACE: new_username = new_username[:-1]
                 elif event.unicode.isprintable(): new_username += event.unicode
+        profiler.mark("events")
+        if not (dirty or profiler.overlay): continue
+        dirty = False
         screen.fill(WHITE)
-        title_text = font_large.render("选择账号", True, BLACK)
+        title_text = text_cache.render(font_large, "选择账号", True, BLACK)
         screen.blit(title_text, (SCREEN_WIDTH // 2 - title_text.get_width() // 2, 50))
         if not creating_user:
             for button in buttons: button.draw(screen)
             new_user_button.draw(screen)
+            if max_scroll:
+                page_text = text_cache.render(font_small, f"第 {scroll + 1}-{scroll + len(visible_users)} 个，共 {len(users)} 个（滚轮翻看）", True, GRAY)
+                screen.blit(page_text, (SCREEN_WIDTH // 2 - page_text.get_width() // 2, 110))
         else:
-            create_text = font_medium.render("输入新用户名:", True, BLACK)
+            create_text = text_cache.render(font_medium, "输入新用户名:", True, BLACK)
             screen.blit(create_text, (input_box.x, input_box.y - 40))
-            lang_tip_text = font_small.render("仅支持英文输入", True, GRAY)
+            lang_tip_text = text_cache.render(font_small, "仅支持英文输入", True, GRAY)
             screen.blit(lang_tip_text, (input_box.x, input_box.y + 55))
             pygame.draw.rect(screen, LIGHT_BLUE, input_box, 2)
-            input_text_surf = font_medium.render(new_username, True, BLACK)
+            input_text_surf = text_cache.render(font_medium, new_username, True, BLACK)
             screen.blit(input_text_surf, (input_box.x + 5, input_box.y + 5))
             confirm_button.draw(screen)
             cancel_button.draw(screen)
-        pygame.display.flip()
+        present()
 
-def main_menu_screen(username, current_level):
-    switch_button = Button(50, SCREEN_HEIGHT - 180, 200, 50, "切换账号", LIGHT_BLUE)
-    quit_button = Button(50, SCREEN_HEIGHT - 110, 200, 50, "退出游戏", RED)
-    classic_mode_button = Button(SCREEN_WIDTH - 250, SCREEN_HEIGHT - 180, 200, 50, "经典玩法", GREEN)
-    battle_mode_button = Button(SCREEN_WIDTH - 250, SCREEN_HEIGHT - 110, 200, 50, "战斗模式", GREEN)
-    volume_slider = pygame.Rect(SCREEN_WIDTH // 2 - 150, 300, 300, 20)
-    spawn_rate_slider = pygame.Rect(SCREEN_WIDTH // 2 - 150, 400, 300, 20)
-    dragging_volume = False
-    dragging_spawn_rate = False
-    while True:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT: return GameState.QUIT, current_level, None
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                if event.button == 1:
-                    if switch_button.is_clicked(event.pos): return GameState.ACCOUNT_SELECTION, 1, None
-                    if quit_button.is_clicked(event.pos): return GameState.QUIT, current_level, None
-                    if classic_mode_button.is_clicked(event.pos): return GameState.CLASSIC_MODE_SELECTION, current_level, None
-                    if battle_mode_button.is_clicked(event.pos): return GameState.BATTLE_MODE_SELECTION, current_level, None
-                    if volume_slider.collidepoint(event.pos): dragging_volume = True
-                    if spawn_rate_slider.collidepoint(event.pos): dragging_spawn_rate = True
-            if event.type == pygame.MOUSEBUTTONUP:
-                if event.button == 1: dragging_volume = False; dragging_spawn_rate = False
-            if event.type == pygame.MOUSEMOTION:
-                if dragging_volume:
-                    pos_x = event.pos[0]
-                    game_settings["music_volume"] = max(0.0, min(1.0, (pos_x - volume_slider.x) / volume_slider.width))
-                    pygame.mixer.music.set_volume(game_settings["music_volume"])
-                if dragging_spawn_rate:
-                    pos_x = event.pos[0]
-                    game_settings["zombie_spawn_rate_modifier"] = max(0.5, min(4.0, ((pos_x - spawn_rate_slider.x) / spawn_rate_slider.width) * 3.5 + 0.5))
-        screen.fill(WHITE)
-        title_text = font_large.render(f"欢迎, {username}", True, BLACK)
-        screen.blit(title_text, (SCREEN_WIDTH // 2 - title_text.get_width() // 2, 100))
-        switch_button.draw(screen)
-        quit_button.draw(screen)
-        classic_mode_button.draw(screen)
-        battle_mode_button.draw(screen)
-        volume_text = font_medium.render(f"背景音量: {int(game_settings['music_volume'] * 100)}%", True, BLACK)
-        screen.blit(volume_text, (volume_slider.x, volume_slider.y - 40))
-        pygame.draw.rect(screen, GRAY, volume_slider)
+class Scene:
+    """ 长期存在的菜单页面：按钮在构造时建好，切换状态时不重建。标题、按钮和说明文字预先画在一张整屏的静态层上，
+    只有 static_key() 的返回值（用户名、已解锁关卡、音量等）变化时才重画；画面没有变化的帧不贴图也不 flip """
+    name = "scene"
+    def __init__(self): self.static = None; self.key = None
+    def enter(self): pass
+    def static_key(self): return None
+    def build(self, surface): pass
+    def handle_event(self, event): return None
+    def quit_result(self): return GameState.QUIT, None
+    def invalidate(self): self.static = None
+    def run(self, **context):
+        """ context 是页面的输入（如 username、current_level），设为同名属性后进入页面循环，返回页面的结果 """
+        for name, value in context.items(): setattr(self, name, value)
+        self.enter()
+        dirty = True
+        while True:
+            profiler.begin(self.name)
+            # 画完一帧后阻塞等输入，不再按帧率空转
+            for event in wait_for_events(0 if dirty else None):
+                if profiler.handle_event(event): dirty = True; continue
+                if event.type == pygame.QUIT: return self.quit_result()
+                if event.type == pygame.VIDEOEXPOSE: dirty = True
+                result = self.handle_event(event)
+                if result is not None: return result
+            profiler.mark("events")
+            key = self.static_key()
+            if self.static is None or key != self.key:
+                if self.static is None: self.static = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)).convert()
+                self.static.fill(WHITE); self.build(self.static); self.key = key; dirty = True
+            # 统计浮层开着时数字每帧在变，照常提交
+            if dirty or profiler.overlay: screen.blit(self.static, (0, 0)); present(); dirty = False
+
+class MainMenuScene(Scene):
+    name = "main_menu"
+    def __init__(self):
+        super().__init__()
+        self.switch_button = Button(50, SCREEN_HEIGHT - 180, 200, 50, "切换账号", LIGHT_BLUE)
+        self.quit_button = Button(50, SCREEN_HEIGHT - 110, 200, 50, "退出游戏", RED)
+        self.classic_mode_button = Button(SCREEN_WIDTH - 250, SCREEN_HEIGHT - 180, 200, 50, "经典玩法", GREEN)
+        self.battle_mode_button = Button(SCREEN_WIDTH - 250, SCREEN_HEIGHT - 110, 200, 50, "战斗模式", GREEN)
+        self.leaderboard_button = Button(SCREEN_WIDTH - 250, SCREEN_HEIGHT - 250, 200, 50, "排行榜", LIGHT_BLUE)
+        self.volume_slider = pygame.Rect(SCREEN_WIDTH // 2 - 150, 300, 300, 20)
+        self.spawn_rate_slider = pygame.Rect(SCREEN_WIDTH // 2 - 150, 400, 300, 20)
+        self.username = None; self.current_level = 1
+    def enter(self): self.dragging_volume = False; self.dragging_spawn_rate = False
+    def static_key(self): return (self.username, game_settings["music_volume"], game_settings["zombie_spawn_rate_modifier"])
+    def quit_result(self): return GameState.QUIT, self.current_level, None
+    def handle_event(self, event):
+        if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+            if self.switch_button.is_clicked(event.pos): return GameState.ACCOUNT_SELECTION, 1, None
+            if self.quit_button.is_clicked(event.pos): return GameState.QUIT, self.current_level, None
+            if self.classic_mode_button.is_clicked(event.pos): return GameState.CLASSIC_MODE_SELECTION, self.current_level, None
+            if self.battle_mode_button.is_clicked(event.pos): return GameState.BATTLE_MODE_SELECTION, self.current_level, None
+            if self.leaderboard_button.is_clicked(event.pos): return GameState.LEADERBOARD, self.current_level, None
+            if self.volume_slider.collidepoint(event.pos): self.dragging_volume = True
+            if self.spawn_rate_slider.collidepoint(event.pos): self.dragging_spawn_rate = True
+        if event.type == pygame.MOUSEBUTTONUP and event.button == 1: self.dragging_volume = False; self.dragging_spawn_rate = False
+        if event.type == pygame.MOUSEMOTION:
+            if self.dragging_volume:
+                game_settings["music_volume"] = max(0.0, min(1.0, (event.pos[0] - self.volume_slider.x) / self.volume_slider.width))
+                pygame.mixer.music.set_volume(game_settings["music_volume"])
+            if self.dragging_spawn_rate:
+                game_settings["zombie_spawn_rate_modifier"] = max(0.5, min(4.0, ((event.pos[0] - self.spawn_rate_slider.x) / self.spawn_rate_slider.width) * 3.5 + 0.5))
+        return None
+    def build(self, surface):
+        title_text = text_cache.render(font_large, f"欢迎, {self.username}", True, BLACK)
+        surface.blit(title_text, (SCREEN_WIDTH // 2 - title_text.get_width() // 2, 100))
+        for button in (self.switch_button, self.quit_button, self.classic_mode_button, self.battle_mode_button, self.leaderboard_button): button.draw(surface)
+        volume_slider = self.volume_slider; spawn_rate_slider = self.spawn_rate_slider
+        volume_text = text_cache.render(font_medium, f"背景音量: {int(game_settings['music_volume'] * 100)}%", True, BLACK)
+        surface.blit(volume_text, (volume_slider.x, volume_slider.y - 40))
+        pygame.draw.rect(surface, GRAY, volume_slider)
         volume_handle_pos = volume_slider.x + int(volume_slider.width * game_settings["music_volume"])
-        pygame.draw.rect(screen, BLUE, (volume_handle_pos - 5, volume_slider.y - 5, 10, 30))
-        spawn_rate_text = font_medium.render(f"僵尸速度: {game_settings['zombie_spawn_rate_modifier']:.2f}x", True, BLACK)
-        screen.blit(spawn_rate_text, (spawn_rate_slider.x, spawn_rate_slider.y - 40))
-        pygame.draw.rect(screen, GRAY, spawn_rate_slider)
+        pygame.draw.rect(surface, BLUE, (volume_handle_pos - 5, volume_slider.y - 5, 10, 30))
+        spawn_rate_text = text_cache.render(font_medium, f"僵尸速度: {game_settings['zombie_spawn_rate_modifier']:.2f}x", True, BLACK)
+        surface.blit(spawn_rate_text, (spawn_rate_slider.x, spawn_rate_slider.y - 40))
+        pygame.draw.rect(surface, GRAY, spawn_rate_slider)
         spawn_rate_handle_pos = spawn_rate_slider.x + int(spawn_rate_slider.width * (game_settings["zombie_spawn_rate_modifier"] - 0.5) / 3.5)
-        pygame.draw.rect(screen, BLUE, (spawn_rate_handle_pos - 5, spawn_rate_slider.y - 5, 10, 30))
-        pygame.display.flip()
+        pygame.draw.rect(surface, BLUE, (spawn_rate_handle_pos - 5, spawn_rate_slider.y - 5, 10, 30))
 
-def classic_mode_selection_screen(current_level):
-    adventure_button = Button(SCREEN_WIDTH // 2 - 150, 250, 300, 50, "冒险模式", GREEN)
-    endless_unlocked = current_level >= len(LEVELS)
-    endless_color = GREEN if endless_unlocked else GRAY
-    endless_button = Button(SCREEN_WIDTH // 2 - 150, 350, 300, 50, "无尽模式", endless_color)
-    back_button = Button(SCREEN_WIDTH // 2 - 150, 450, 300, 50, "返回", LIGHT_BLUE)
-    while True:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT: return GameState.QUIT, None
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                if adventure_button.is_clicked(event.pos): return GameState.LEVEL_SELECTION, None
-                if endless_unlocked and endless_button.is_clicked(event.pos): return GameState.ENDLESS_PLAYING, None
-                if back_button.is_clicked(event.pos): return GameState.MAIN_MENU, None
-        screen.fill(WHITE)
-        title_text = font_large.render("选择经典玩法", True, BLACK)
-        screen.blit(title_text, (SCREEN_WIDTH // 2 - title_text.get_width() // 2, 100))
-        adventure_button.draw(screen)
-        endless_button.draw(screen)
-        if not endless_unlocked:
-            lock_text = font_small.render("通关冒险模式解锁", True, BLACK)
-            screen.blit(lock_text, (endless_button.rect.x, endless_button.rect.y + 60))
-        back_button.draw(screen)
-        pygame.display.flip()
+class ModeSelectionScene(Scene):
+    """ 经典/战斗玩法的冒险、无尽选择页；通关全部关卡后解锁无尽模式 """
+    def __init__(self, name, title, levels, lock_tip, adventure_state, endless_state):
+        super().__init__()
+        self.name = name; self.title = title; self.levels = levels; self.lock_tip = lock_tip
+        self.adventure_state = adventure_state; self.endless_state = endless_state
+        self.adventure_button = Button(SCREEN_WIDTH // 2 - 150, 250, 300, 50, "冒险模式", GREEN)
+        self.endless_button = Button(SCREEN_WIDTH // 2 - 150, 350, 300, 50, "无尽模式", GRAY)
+        self.back_button = Button(SCREEN_WIDTH // 2 - 150, 450, 300, 50, "返回", LIGHT_BLUE)
+        self.current_level = 1
+    def endless_unlocked(self): return self.current_level >= len(self.levels)
+    def static_key(self): return self.endless_unlocked()
+    def handle_event(self, event):
+        if event.type != pygame.MOUSEBUTTONDOWN: return None
+        if self.adventure_button.is_clicked(event.pos): return self.adventure_state, None
+        if self.endless_unlocked() and self.endless_button.is_clicked(event.pos): return self.endless_state, None
+        if self.back_button.is_clicked(event.pos): return GameState.MAIN_MENU, None
+        return None
+    def build(self, surface):
+        title_text = text_cache.render(font_large, self.title, True, BLACK)
+        surface.blit(title_text, (SCREEN_WIDTH // 2 - title_text.get_width() // 2, 100))
+        self.endless_button.color = GREEN if self.endless_unlocked() else GRAY
+        self.adventure_button.draw(surface); self.endless_button.draw(surface)
+        if not self.endless_unlocked():
+            lock_text = text_cache.render(font_small, self.lock_tip, True, BLACK)
+            surface.blit(lock_text, (self.endless_button.rect.x, self.endless_button.rect.y + 60))
+        self.back_button.draw(surface)
 
-def battle_mode_selection_screen(current_level):
-    adventure_button = Button(SCREEN_WIDTH // 2 - 150, 250, 300, 50, "冒险模式", GREEN)
-    endless_unlocked = current_level >= len(BATTLE_LEVELS)
-    endless_color = GREEN if endless_unlocked else GRAY
-    endless_button = Button(SCREEN_WIDTH // 2 - 150, 350, 300, 50, "无尽模式", endless_color)
-    back_button = Button(SCREEN_WIDTH // 2 - 150, 450, 300, 50, "返回", LIGHT_BLUE)
-    while True:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT: return GameState.QUIT, None
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                if adventure_button.is_clicked(event.pos): return GameState.BATTLE_LEVEL_SELECTION, None
-                if endless_unlocked and endless_button.is_clicked(event.pos): return GameState.BATTLE_MODE_ENDLESS_PLAYING, None
-                if back_button.is_clicked(event.pos): return GameState.MAIN_MENU, None
-        screen.fill(WHITE)
-        title_text = font_large.render("选择战斗模式", True, BLACK)
-        screen.blit(title_text, (SCREEN_WIDTH // 2 - title_text.get_width() // 2, 100))
-        adventure_button.draw(screen)
-        endless_button.draw(screen)
-        if not endless_unlocked:
-            lock_text = font_small.render("通关战斗冒险模式解锁", True, BLACK)
-            screen.blit(lock_text, (endless_button.rect.x, endless_button.rect.y + 60))
-        back_button.draw(screen)
-        pygame.display.flip()
+class LevelSelectionScene(Scene):
+    """ 关卡网格：按钮位置只算一次，已解锁关卡变化时才重新着色、重画静态层 """
+    def __init__(self, name, title, levels, play_state, back_state):
+        super().__init__()
+        self.name = name; self.title = title; self.play_state = play_state; self.back_state = back_state
+        levels_per_row = 6
+        button_width = 150; button_height = 80; h_spacing = 40; v_spacing = 40
+        start_x = (SCREEN_WIDTH - (levels_per_row * button_width) - ((levels_per_row - 1) * h_spacing)) // 2
+        start_y = 150
+        self.buttons = []
+        for i in range(len(levels)):
+            row = i // levels_per_row; col = i % levels_per_row
+            x = start_x + col * (button_width + h_spacing)
+            y = start_y + row * (button_height + v_spacing)
+            self.buttons.append(Button(x, y, button_width, button_height, f"第 {i + 1} 关", GRAY))
+        self.back_button = Button(50, SCREEN_HEIGHT - 110, 200, 50, "返回", LIGHT_BLUE)
+        self.max_unlocked_level = 1
+    def static_key(self): return self.max_unlocked_level
+    def handle_event(self, event):
+        if event.type != pygame.MOUSEBUTTONDOWN: return None
+        if self.back_button.is_clicked(event.pos): return self.back_state, None
+        for i, button in enumerate(self.buttons[:self.max_unlocked_level]):
+            if button.is_clicked(event.pos): return self.play_state, i + 1
+        return None
+    def build(self, surface):
+        title_text = text_cache.render(font_large, self.title, True, BLACK)
+        surface.blit(title_text, (SCREEN_WIDTH // 2 - title_text.get_width() // 2, 50))
+        for i, button in enumerate(self.buttons):
+            button.color = GREEN if i + 1 <= self.max_unlocked_level else GRAY; button.draw(surface)
+        self.back_button.draw(surface)
 
-def level_selection_screen(max_unlocked_level, levels_data=None, mode_title="选择关卡", back_state=GameState.MAIN_MENU):
-    if levels_data is None: levels_data = LEVELS
-    buttons = []
-    levels_per_row = 6
-    button_width = 150; button_height = 80; h_spacing = 40; v_spacing = 40
-    start_x = (SCREEN_WIDTH - (levels_per_row * button_width) - ((levels_per_row - 1) * h_spacing)) // 2
-    start_y = 150
-    for i in range(len(levels_data)):
-        level_num = i + 1
-        row = i // levels_per_row; col = i % levels_per_row
-        x = start_x + col * (button_width + h_spacing)
-        y = start_y + row * (button_height + v_spacing)
-        color = GREEN if level_num <= max_unlocked_level else GRAY
-        buttons.append(Button(x, y, button_width, button_height, f"第 {level_num} 关", color))
-    back_button = Button(50, SCREEN_HEIGHT - 110, 200, 50, "返回", LIGHT_BLUE)
-    while True:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT: return GameState.QUIT, None
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                if back_button.is_clicked(event.pos): return back_state, None
-                for i, button in enumerate(buttons):
-                    level_num = i + 1
-                    if level_num <= max_unlocked_level and button.is_clicked(event.pos):
-                        if mode_title == "选择关卡": return GameState.PLAYING, level_num
-                        else: return GameState.BATTLE_MODE_PLAYING, level_num
-        screen.fill(WHITE)
-        title_text = font_large.render(mode_title, True, BLACK)
-        screen.blit(title_text, (SCREEN_WIDTH // 2 - title_text.get_width() // 2, 50))
-        for button in buttons: button.draw(screen)
-        back_button.draw(screen)
-        pygame.display.flip()
+class SceneManager:
+    """ 按GameState保存菜单页面的Scene实例，整个游戏过程中复用；切换状态时直接贴上次缓存的静态层 """
+    def __init__(self, scenes): self.scenes = scenes
+    def __contains__(self, state): return state in self.scenes
+    def run(self, state, **context): return self.scenes[state].run(**context)
+    def invalidate(self):
+        for scene in self.scenes.values(): scene.invalidate()
 
 LEVELS = []
 original_levels = [{"zombies": 10, "target_score": 15, "spawn_rate": 180}, {"zombies": 15, "target_score": 30, "spawn_rate": 150}, {"zombies": 20, "target_score": 45, "spawn_rate": 120}, {"zombies": 25, "target_score": 60, "spawn_rate": 100}, {"zombies": 30, "target_score": 75, "spawn_rate": 90}, {"zombies": 35, "target_score": 90, "spawn_rate": 80}, {"zombies": 40, "target_score": 105, "spawn_rate": 70}, {"zombies": 45, "target_score": 120, "spawn_rate": 60}, {"zombies": 50, "target_score": 135, "spawn_rate": 50}, {"zombies": 60, "target_score": 150, "spawn_rate": 40}]
@@ -451,55 +1020,139 @@ for target in match_targets: LEVELS.append({"type": "match", "target": target, "
 
 BATTLE_LEVELS = [{"type": "kill", "target": 5 + i * 5, "zombies": float('inf'), "spawn_rate": 120 - i * 5} for i in range(10)]
 
+menu_scenes = SceneManager({
+    GameState.MAIN_MENU: MainMenuScene(),
+    GameState.CLASSIC_MODE_SELECTION: ModeSelectionScene("classic_mode_selection", "选择经典玩法", LEVELS, "通关冒险模式解锁", GameState.LEVEL_SELECTION, GameState.ENDLESS_PLAYING),
+    GameState.BATTLE_MODE_SELECTION: ModeSelectionScene("battle_mode_selection", "选择战斗模式", BATTLE_LEVELS, "通关战斗冒险模式解锁", GameState.BATTLE_LEVEL_SELECTION, GameState.BATTLE_MODE_ENDLESS_PLAYING),
+    GameState.LEVEL_SELECTION: LevelSelectionScene("level_selection", "选择关卡", LEVELS, GameState.PLAYING, GameState.CLASSIC_MODE_SELECTION),
+    GameState.BATTLE_LEVEL_SELECTION: LevelSelectionScene("battle_level_selection", "选择战斗关卡", BATTLE_LEVELS, GameState.BATTLE_MODE_PLAYING, GameState.BATTLE_MODE_SELECTION),
+})
+
 class TripleMatchGame:
-    def __init__(self, mode='classic'):
-        self.grid_size = 8
+    def __init__(self, mode='classic', rng=None, grid_size=8, num_types=3):
+        self.rng = rng if rng is not None else random
+        self.grid_size = grid_size; self.num_types = num_types
         self.cell_size = TRIPLE_MATCH_WIDTH // self.grid_size
-        self.grid = [[random.randint(0, 2) for _ in range(self.grid_size)] for _ in range(self.grid_size)]
-        self.selected = None
+        self.grid = [[-1] * self.grid_size for _ in range(self.grid_size)]
+        self.selected = None; self.hinted = None
         self.mode = mode
+        self.version = 0  # 盘面每次变动加一，渲染时据此判断是否需要重画
+        # 所有能凑成三连的相邻交换 (r1, c1, r2, c2)，第二格在第一格右边或下边；格子变动后只更新附近的交换
+        self.valid_moves = set(); self.deadlock_reshuffles = 0
         self.initialize_grid()
     def initialize_grid(self):
-        # Regenerate the grid once, unconditionally.
+        """ 生成没有三连、至少有一步可走的新盘面（开局、洗牌和死局时调用） """
+        self.generate_grid()
+        self.rebuild_moves()
+        if not self.valid_moves: self.plant_move()
+    def generate_grid(self):
+        self.version += 1
+        # 一次遍历逐格生成：排除会和左边两格或上边两格凑成三连的种类，不需要整盘重抽
+        grid = self.grid
         for r in range(self.grid_size):
             for c in range(self.grid_size):
-                self.grid[r][c] = random.randint(0, 2)
-        # Then, keep regenerating until the new grid has no initial matches.
-        while self.find_matches():
-            for r in range(self.grid_size):
-                for c in range(self.grid_size): self.grid[r][c] = random.randint(0, 2)
+                banned = set()
+                if c >= 2 and grid[r][c - 1] == grid[r][c - 2]: banned.add(grid[r][c - 1])
+                if r >= 2 and grid[r - 1][c] == grid[r - 2][c]: banned.add(grid[r - 1][c])
+                grid[r][c] = self.rng.choice([t for t in range(self.num_types) if t not in banned])
+    def set_cell(self, r, c, value): self.grid[r][c] = value; self.version += 1
+    def plant_move(self):
+        """ 盘面没有可走的一步时改动一格，使某个交换能凑成三连，同时不产生现成的三连 """
+        cells = [(r, c) for r in range(self.grid_size) for c in range(self.grid_size)]
+        self.rng.shuffle(cells)
+        for r, c in cells:
+            original = self.grid[r][c]
+            for value in range(self.num_types):
+                if value == original: continue
+                self.set_cell(r, c, value)
+                if not self.find_matches_at([(r, c)]):
+                    self.refresh_moves([(r, c)])
+                    if self.valid_moves: return
+            self.set_cell(r, c, original)
+        self.refresh_moves(cells)
+    def all_swaps(self):
+        n = self.grid_size
+        return [(r, c, r, c + 1) for r in range(n) for c in range(n - 1)] + [(r, c, r + 1, c) for r in range(n - 1) for c in range(n)]
+    def rebuild_moves(self): self.valid_moves = {swap for swap in self.all_swaps() if self.would_match(*swap)}
+    def refresh_moves(self, changed):
+        """ changed中的格子变动后，重新判断受影响的交换：交换的结果只取决于两格横竖各两格以内的格子，
+        所以只有端点落在变动格子横竖两格以内的交换需要重算 """
+        n = self.grid_size; around = set(); swaps = set()
+        for r, c in changed:
+            for d in range(-2, 3):
+                if 0 <= r + d < n: around.add((r + d, c))
+                if 0 <= c + d < n: around.add((r, c + d))
+        for r, c in around:
+            if c + 1 < n: swaps.add((r, c, r, c + 1))
+            if c > 0: swaps.add((r, c - 1, r, c))
+            if r + 1 < n: swaps.add((r, c, r + 1, c))
+            if r > 0: swaps.add((r - 1, c, r, c))
+        for swap in swaps:
+            if self.would_match(*swap): self.valid_moves.add(swap)
+            else: self.valid_moves.discard(swap)
+    def scratch_copy(self, rng):
+        """ 复制当前盘面用于模拟（总是列表实现）：不重新生成、不建交换索引，补充的新元素由rng决定 """
+        board = TripleMatchGame.__new__(TripleMatchGame)
+        board.rng = rng; board.grid_size = self.grid_size; board.num_types = self.num_types; board.cell_size = self.cell_size
+        board.grid = [row[:] for row in self.grid]
+        board.selected = None; board.hinted = None; board.mode = self.mode; board.version = 0
+        board.valid_moves = set(); board.deadlock_reshuffles = 0
+        return board
+    def hint(self):
+        """ 返回一步能凑成三连的交换 (r1, c1, r2, c2)，没有时返回None；直接查索引，不扫描盘面 """
+        return min(self.valid_moves) if self.valid_moves else None
+    def show_hint(self): self.hinted = self.hint()
     def draw(self, surface):
+        self.draw_grid(surface)
+        self.draw_tiles(surface)
+    def draw_grid(self, surface):
+        """ 盘面底色和网格线，不随盘面内容变化 """
         game_area = pygame.Rect(0, SCREEN_HEIGHT - TRIPLE_MATCH_HEIGHT, TRIPLE_MATCH_WIDTH, TRIPLE_MATCH_HEIGHT)
         pygame.draw.rect(surface, GRAY, game_area)
+        span = self.grid_size * self.cell_size
         for i in range(self.grid_size + 1):
-            pygame.draw.line(surface, BLACK, (0, SCREEN_HEIGHT - TRIPLE_MATCH_HEIGHT + i * self.cell_size), (TRIPLE_MATCH_WIDTH, SCREEN_HEIGHT - TRIPLE_MATCH_HEIGHT + i * self.cell_size))
-            pygame.draw.line(surface, BLACK, (i * self.cell_size, SCREEN_HEIGHT - TRIPLE_MATCH_HEIGHT), (i * self.cell_size, SCREEN_HEIGHT))
+            pygame.draw.line(surface, BLACK, (0, SCREEN_HEIGHT - TRIPLE_MATCH_HEIGHT + i * self.cell_size), (span, SCREEN_HEIGHT - TRIPLE_MATCH_HEIGHT + i * self.cell_size))
+            pygame.draw.line(surface, BLACK, (i * self.cell_size, SCREEN_HEIGHT - TRIPLE_MATCH_HEIGHT), (i * self.cell_size, SCREEN_HEIGHT - TRIPLE_MATCH_HEIGHT + span))
+    def draw_tiles(self, surface):
+        tiles = tile_surfaces(self.num_types, self.cell_size)
         for row in range(self.grid_size):
             for col in range(self.grid_size):
-                if self.grid[row][col] != -1: surface.blit(elements[self.grid[row][col]], (col * self.cell_size, SCREEN_HEIGHT - TRIPLE_MATCH_HEIGHT + row * self.cell_size))
+                if self.grid[row][col] != -1: surface.blit(tiles[self.grid[row][col]], (col * self.cell_size, SCREEN_HEIGHT - TRIPLE_MATCH_HEIGHT + row * self.cell_size))
         if self.selected:
             row, col = self.selected
             pygame.draw.rect(surface, (255, 255, 0), (col * self.cell_size, SCREEN_HEIGHT - TRIPLE_MATCH_HEIGHT + row * self.cell_size, self.cell_size, self.cell_size), 3)
+        if self.hinted:
+            r1, c1, r2, c2 = self.hinted
+            for row, col in ((r1, c1), (r2, c2)):
+                pygame.draw.rect(surface, (0, 255, 255), (col * self.cell_size, SCREEN_HEIGHT - TRIPLE_MATCH_HEIGHT + row * self.cell_size, self.cell_size, self.cell_size), 3)
     def handle_click(self, pos):
         x, y = pos
         if not (x < TRIPLE_MATCH_WIDTH and y > SCREEN_HEIGHT - TRIPLE_MATCH_HEIGHT): self.selected = None; return None
         col = x // self.cell_size
         row = (y - (SCREEN_HEIGHT - TRIPLE_MATCH_HEIGHT)) // self.cell_size
+        return self.click_cell(row, col)
+    def click_cell(self, row, col):
+        """ 按格子坐标处理一次点击（与屏幕坐标无关，无界面模拟直接调用） """
         if not (0 <= row < self.grid_size and 0 <= col < self.grid_size): return None
+        self.hinted = None
         if self.selected is None: self.selected = (row, col); return None
         else:
             prev_row, prev_col = self.selected
             if abs(prev_row - row) + abs(prev_col - col) == 1:
                 self.swap_elements(prev_row, prev_col, row, col)
-                matches = self.find_matches()
+                # 交换前盘面没有三连，新三连一定经过交换的两格；下落后同理只需检查变动过的格子
+                matches = self.find_matches_at([(prev_row, prev_col), (row, col)])
                 if matches:
-                    all_matched_elements = []
+                    all_matched_elements = []; touched = {(prev_row, prev_col), (row, col)}
                     while matches:
                         for r, c in matches:
-                            all_matched_elements.append({'pos': (r, c), 'type': self.grid[r][c]})
+                            all_matched_elements.append((r, c, self.grid[r][c]))
                         self.remove_matches(matches)
-                        self.apply_gravity()
-                        matches = self.find_matches()
+                        changed = self.apply_gravity(); touched.update(changed)
+                        matches = self.find_matches_at(changed)
+                    self.refresh_moves(touched)
+                    # 死局时自动洗牌
+                    if not self.valid_moves: self.initialize_grid(); self.deadlock_reshuffles += 1
                     self.selected = None
                     if self.mode == 'classic':
                         bullets_to_fire = min(len(all_matched_elements), 3)
@@ -512,7 +1165,8 @@ class TripleMatchGame:
                 else: self.swap_elements(prev_row, prev_col, row, col)
             self.selected = None
         return None
-    def swap_elements(self, r1, c1, r2, c2): self.grid[r1][c1], self.grid[r2][c2] = self.grid[r2][c2], self.grid[r1][c1]
+    def swap_elements(self, r1, c1, r2, c2):
+        self.grid[r1][c1], self.grid[r2][c2] = self.grid[r2][c2], self.grid[r1][c1]; self.version += 1
     def find_matches(self):
         matches = set()
         for r in range(self.grid_size):
@@ -522,69 +1176,229 @@ class TripleMatchGame:
             for r in range(self.grid_size - 2):
                 if self.grid[r][c] == self.grid[r+1][c] == self.grid[r+2][c] != -1: matches.update([(r, c), (r+1, c), (r+2, c)])
         return list(matches)
+    def find_matches_at(self, cells):
+        """ 只检查经过cells中各格的横向、纵向三连窗口。
+        盘面在这些格子变动之前没有三连时（游戏中始终成立），结果与find_matches()完全相同 """
+        matches = set(); grid = self.grid; size = self.grid_size
+        for r, c in cells:
+            value = grid[r][c]
+            if value == -1: continue
+            row = grid[r]
+            for start in range(max(0, c - 2), min(c, size - 3) + 1):
+                if row[start] == row[start + 1] == row[start + 2] == value: matches.update([(r, start), (r, start + 1), (r, start + 2)])
+            for start in range(max(0, r - 2), min(r, size - 3) + 1):
+                if grid[start][c] == grid[start + 1][c] == grid[start + 2][c] == value: matches.update([(start, c), (start + 1, c), (start + 2, c)])
+        return list(matches)
+    def would_match(self, r1, c1, r2, c2):
+        """ 判断交换两格能否形成三连，只检查这两格所在的行列窗口，不扫描整个盘面 """
+        self.swap_elements(r1, c1, r2, c2)
+        result = bool(self.find_matches_at([(r1, c1), (r2, c2)]))
+        self.swap_elements(r1, c1, r2, c2)
+        return result
     def remove_matches(self, matches):
         for r, c in matches: self.grid[r][c] = -1
+        self.version += 1
     def apply_gravity(self):
+        """ 元素下落并补充新元素，返回可能发生变化的格子（有空位的列中最低空位及以上的部分） """
+        self.version += 1; changed = []
         for c in range(self.grid_size):
-            empty_slots = []
+            empty_slots = []; lowest_empty = -1
             for r in range(self.grid_size - 1, -1, -1):
-                if self.grid[r][c] == -1: empty_slots.append(r)
+                if self.grid[r][c] == -1:
+                    empty_slots.append(r)
+                    if lowest_empty < 0: lowest_empty = r
                 elif empty_slots:
                     new_r = empty_slots.pop(0)
                     self.grid[new_r][c] = self.grid[r][c]
                     self.grid[r][c] = -1
                     empty_slots.append(r)
-            for r in empty_slots: self.grid[r][c] = random.randint(0, 2)
+            for r in empty_slots: self.grid[r][c] = self.rng.randint(0, self.num_types - 1)
+            changed.extend((r, c) for r in range(lowest_empty + 1))
+        return changed
+
+class BitboardMatchGame(TripleMatchGame):
+    """ 位棋盘版三消盘面，用于大盘面和多种元素的自定义关卡。
+    每种元素一个整数位掩码，第r行第c列是第 r*stride+c 位；每行末尾留两位空位，横向移位不会跨行凑成三连。
+    self.grid 同步保留，点击、绘制和交换判断与父类共用 """
+    def __init__(self, mode='classic', rng=None, grid_size=8, num_types=3):
+        self.stride = grid_size + 2
+        self.column_masks = [sum(1 << (r * self.stride + c) for r in range(grid_size)) for c in range(grid_size)]
+        self.full_mask = 0
+        for column_mask in self.column_masks: self.full_mask |= column_mask
+        self.masks = [0] * num_types
+        super().__init__(mode, rng, grid_size, num_types)
+    def generate_grid(self):
+        super().generate_grid()
+        self.rebuild_masks()
+    def set_cell(self, r, c, value):
+        bit = self.bit(r, c); old = self.grid[r][c]
+        if old != -1: self.masks[old] &= ~bit
+        if value != -1: self.masks[value] |= bit
+        super().set_cell(r, c, value)
+    def rebuild_masks(self):
+        masks = [0] * self.num_types; stride = self.stride
+        for r, row in enumerate(self.grid):
+            for c, value in enumerate(row):
+                if value != -1: masks[value] |= 1 << (r * stride + c)
+        self.masks = masks
+    def bit(self, r, c): return 1 << (r * self.stride + c)
+    def cells_of(self, mask):
+        cells = []
+        while mask:
+            low = mask & -mask
+            cells.append(divmod(low.bit_length() - 1, self.stride)); mask ^= low
+        return cells
+    def match_mask(self):
+        """ 所有三连格子的位掩码：x & x>>1 & x>>2 得到横向三连的起点，按stride移位得到纵向三连的起点 """
+        stride = self.stride; result = 0
+        for m in self.masks:
+            h = m & (m >> 1) & (m >> 2)
+            v = m & (m >> stride) & (m >> 2 * stride)
+            result |= h | (h << 1) | (h << 2) | v | (v << stride) | (v << 2 * stride)
+        return result
+    def find_matches(self): return self.cells_of(self.match_mask())
+    def rebuild_moves(self):
+        """ 整盘重建可走交换的索引（开局、洗牌和死局时），用移位一次算出所有交换，不逐个调用would_match。
+        盘面上没有现成的三连，所以一步交换能消除，当且仅当换过去的某个元素在新位置上和同类凑成三连（不算它离开的那一格）：
+        向右移的元素只看右边两格和竖向三种组合，向左移的看左边两格和竖向，上下移动同理 """
+        stride = self.stride; full = self.full_mask
+        horizontal = vertical = 0
+        for m in self.masks:
+            left, right, up, down = m << 1 & m << 2, m >> 1 & m >> 2, m << stride & m << 2 * stride, m >> stride & m >> 2 * stride
+            across = left | (m << 1 & m >> 1) | right
+            along = up | (m << stride & m >> stride) | down
+            # 第p位表示 p 和 p+1（横向）或 p 和 p+stride（纵向）交换
+            horizontal |= m & (right | along) >> 1 | m >> 1 & (left | along)
+            vertical |= m & (down | across) >> stride | m >> stride & (up | across)
+        horizontal &= full & full >> 1; vertical &= full & full >> stride
+        self.valid_moves = {(r, c, r, c + 1) for r, c in self.cells_of(horizontal)} | {(r, c, r + 1, c) for r, c in self.cells_of(vertical)}
+    def find_matches_at(self, cells):
+        # 变动格子少时（交换）逐窗口检查更快；下落后变动格子多，整盘移位比逐格检查便宜
+        if len(cells) <= 8: return super().find_matches_at(cells)
+        return self.find_matches()
+    def swap_elements(self, r1, c1, r2, c2):
+        a, b = self.grid[r1][c1], self.grid[r2][c2]
+        super().swap_elements(r1, c1, r2, c2)
+        if a != b:
+            both = self.bit(r1, c1) | self.bit(r2, c2)
+            if a != -1: self.masks[a] ^= both
+            if b != -1: self.masks[b] ^= both
+    def remove_matches(self, matches):
+        cleared = 0
+        for r, c in matches: cleared |= self.bit(r, c)
+        super().remove_matches(matches)
+        self.masks = [m & ~cleared for m in self.masks]
+    def apply_gravity(self):
+        """ 与父类结果相同（包括补充新元素时随机数的使用顺序），但只处理位掩码中有空位的列 """
+        self.version += 1; occupied = 0
+        for m in self.masks: occupied |= m
+        holes = self.full_mask & ~occupied
+        grid = self.grid; masks = self.masks; stride = self.stride; changed = []
+        for c in range(self.grid_size):
+            column_holes = holes & self.column_masks[c]
+            if not column_holes: continue
+            lowest_empty = (column_holes.bit_length() - 1) // stride
+            # 最低空位及以上的部分整体压实：剩下的元素按原顺序落到底部，顶部自下而上补充新元素
+            kept = [grid[r][c] for r in range(lowest_empty, -1, -1) if grid[r][c] != -1]
+            column_bits = self.column_masks[c] & ((1 << ((lowest_empty + 1) * stride)) - 1)
+            for t in range(self.num_types): masks[t] &= ~column_bits
+            r = lowest_empty
+            for value in kept: grid[r][c] = value; masks[value] |= self.bit(r, c); r -= 1
+            for r in range(r, -1, -1):
+                value = self.rng.randint(0, self.num_types - 1); grid[r][c] = value; masks[value] |= self.bit(r, c)
+            changed.extend((row, c) for row in range(lowest_empty + 1))
+        return changed
+
+class EntityPool:
+    """ 实体对象池：僵尸死亡、子弹命中或飞出屏幕后放回空闲表，下次 acquire 时用 reset 重新初始化，
+    无尽模式长时间运行也不会持续分配新对象。空闲表最多保留limit个，多出来的交给垃圾回收 """
+    def __init__(self, cls, limit=1024):
+        self.cls = cls; self.limit = limit; self.free = []
+        self.created = 0; self.reused = 0; self.released = 0
+    def acquire(self, *args):
+        if self.free:
+            entity = self.free.pop(); entity.reset(*args); self.reused += 1
+            return entity
+        self.created += 1
+        return self.cls(*args)
+    def release(self, entity):
+        self.released += 1
+        if len(self.free) < self.limit: self.free.append(entity)
+    def stats(self):
+        acquired = self.created + self.reused
+        return {'created': self.created, 'reused': self.reused, 'released': self.released, 'free': len(self.free),
+                'reuse_rate': self.reused / acquired if acquired else 0.0}
 
 class Zombie:
-    def __init__(self, x, y):
+    __slots__ = ('x', 'y', 'width', 'height', 'speed', 'health', 'image')
+    def __init__(self, x, y): self.reset(x, y)
+    def reset(self, x, y):
         self.x = x; self.y = y; self.width = 60; self.height = 80; self.speed = 1; self.health = 1
-        try:
-            self.image = pygame.image.load(resource_path("imgs/zombie.png")).convert_alpha()
-            self.image = pygame.transform.scale(self.image, (self.width, self.height))
-        except: self.image = None
+        self.image = sprite_cache.get("imgs/zombie.png", (self.width, self.height))
     def move(self): self.x -= self.speed
-    def draw(self, surface):
-        if self.image: surface.blit(self.image, (self.x, self.y))
-        else: pygame.draw.rect(surface, DARK_GREEN, (self.x, self.y, self.width, self.height))
+    def draw(self, surface, alpha=1.0):
+        # alpha < 1 时画在上一步和这一步之间（僵尸向左走，上一步在右边 speed 像素处）
+        x = self.x + self.speed * (1 - alpha)
+        if self.image: return surface.blit(self.image, (x, self.y))
+        return pygame.draw.rect(surface, DARK_GREEN, (x, self.y, self.width, self.height))
     def hit(self): self.health -= 1; return self.health <= 0
 
 class AutoTurret:
     def __init__(self, x, y):
-        self.x = x; self.y = y; self.width = 50; self.height = 50; self.fire_rate = 1800; self.timer = 0
-        try:
-            self.image = pygame.image.load(resource_path("imgs/peashooter.png")).convert_alpha()
-            self.image = pygame.transform.scale(self.image, (self.width, self.height))
-        except Exception as e: print(f"加载炮台图片失败: {e}"); self.image = pygame.Surface((self.width, self.height)); self.image.fill(BROWN)
+        self.x = x; self.y = y; self.width = 50; self.height = 50; self.fire_rate = 30 * TICK_RATE; self.timer = 0
+        self.image = sprite_cache.get("imgs/peashooter.png", (self.width, self.height)) or sprite_cache.solid((self.width, self.height), BROWN)
     def update(self, zombie_game):
         self.timer += 1
         if self.timer >= self.fire_rate:
             self.timer = 0
-            for row_y in zombie_game.zombie_rows: zombie_game.projectiles.append(Projectile(self.x + self.width, row_y))
-    def draw(self, surface): surface.blit(self.image, (self.x, self.y))
+            for row_y in zombie_game.zombie_rows: zombie_game.add_projectile(projectile_pool.acquire(self.x + self.width, row_y))
+    def draw(self, surface): return surface.blit(self.image, (self.x, self.y))
 
 class Projectile:
+    __slots__ = ('x', 'y', 'speed', 'image', 'rect')
     def __init__(self, x, y, image=None):
+        self.rect = None; self.reset(x, y, image)
+    def reset(self, x, y, image=None):
         self.x = x; self.y = y; self.speed = 10
-        if image: self.image = image
-        else:
-            try:
-                self.image = pygame.image.load(resource_path("imgs/zd.png")).convert_alpha()
-                self.image = pygame.transform.scale(self.image, (30, 30))
-            except Exception as e: print(f"加载子弹图片 'imgs/zd.png' 失败: {e}"); self.image = pygame.Surface((20, 20)); self.image.fill(BLUE)
-        self.rect = self.image.get_rect(center=(x, y))
+        self.image = image or sprite_cache.get("imgs/zd.png", (30, 30)) or sprite_cache.solid((20, 20), BLUE)
+        # 复用对象时连同碰撞矩形一起复用
+        if self.rect is None: self.rect = self.image.get_rect(center=(x, y))
+        else: self.rect.size = self.image.get_size(); self.rect.center = (x, y)
     def move(self): self.rect.x += self.speed
-    def draw(self, surface): surface.blit(self.image, self.rect)
+    def draw(self, surface, alpha=1.0):
+        if alpha < 1: return surface.blit(self.image, self.rect.move(-round(self.speed * (1 - alpha)), 0))
+        return surface.blit(self.image, self.rect)
     def collide(self, zombie): return self.rect.colliderect(zombie.x, zombie.y, zombie.width, zombie.height)
 
+zombie_pool = EntityPool(Zombie)
+projectile_pool = EntityPool(Projectile)
+
+# 路线内排序和二分查找用的键，定义成模块级函数，避免每帧为每发子弹新建lambda
+def _zombie_x(zombie): return zombie.x
+def _zombie_right(zombie): return zombie.x + zombie.width
+def _projectile_x(projectile): return projectile.rect.x
+
 class ZombieGame:
-    def __init__(self, level_data):
-        self.zombies = []; self.projectiles = []; self.spawn_timer = 0; self.score = 0
+    def __init__(self, level_data, rng=None, shot_rng=None):
+        # rng 决定出怪的路线，shot_rng 决定三消奖励子弹打哪条路线
+        self.rng = rng if rng is not None else random
+        self.shot_rng = shot_rng if shot_rng is not None else self.rng
+        self.spawn_timer = 0; self.score = 0
         self.lives = 6; self.level_data = level_data; self.zombies_spawned = 0
         self.zombies_killed = 0
         self.zombie_rows = [SCREEN_HEIGHT - ZOMBIE_AREA_HEIGHT + 60 + i * 80 for i in range(5)]
+        # 僵尸和子弹都固定在五条路线上，按路线分桶并按x坐标升序排列，碰撞只需在同一路线内做一次扫描
+        self.zombie_lanes = [[] for _ in self.zombie_rows]
+        self.projectile_lanes = [[] for _ in self.zombie_rows]
         self.turrets = []
-    def update(self):
+    def lane_of(self, row_y):
+        return min(range(len(self.zombie_rows)), key=lambda i: abs(self.zombie_rows[i] - row_y))
+    def add_zombie(self, zombie):
+        bisect.insort(self.zombie_lanes[self.lane_of(zombie.y + zombie.height // 2)], zombie, key=_zombie_x)
+    def add_projectile(self, projectile):
+        bisect.insort(self.projectile_lanes[self.lane_of(projectile.rect.centery)], projectile, key=_projectile_x)
+    def spawn_due(self):
+        """ 推进出怪计时器，本帧应该出一只僵尸时返回True """
         self.spawn_timer += 1
         is_endless = self.level_data.get("zombies") == float('inf')
         is_kill_level = self.level_data.get('type') == 'kill'
@@ -597,43 +1411,76 @@ class ZombieGame:
         # Ensure spawn_rate is at least 1 to prevent division by zero or zero spawn rate
         spawn_rate = max(1, spawn_rate)
         if self.spawn_timer >= spawn_rate and can_spawn:
-            self.zombies.append(Zombie(SCREEN_WIDTH, random.choice(self.zombie_rows) - 40))
             if not is_endless: self.zombies_spawned += 1
             self.spawn_timer = 0
-        for zombie in self.zombies[:]:
-            zombie.move()
-            if zombie.x + zombie.width <= TRIPLE_MATCH_WIDTH:
-                self.lives -= 1
-                if sounds['life_lost']: sounds['life_lost'].play()
-                self.zombies.remove(zombie)
-                if self.lives <= 0: return GameState.GAME_OVER
-        for p in self.projectiles[:]:
-            p.move()
-            if p.rect.left > SCREEN_WIDTH: self.projectiles.remove(p)
-            for z in self.zombies[:]:
-                if p.collide(z):
-                    if z.hit(): self.zombies.remove(z); self.score += 3; self.zombies_killed += 1
-                    if p in self.projectiles: self.projectiles.remove(p)
-                    break
+            return True
+        return False
+    def update(self):
+        if self.spawn_due(): self.add_zombie(zombie_pool.acquire(SCREEN_WIDTH, self.rng.choice(self.zombie_rows) - 40))
+        for lane in self.zombie_lanes:
+            for zombie in lane: zombie.move()
+            # 同速前进，只有排在最前面的僵尸可能走进三消区
+            leaked = 0
+            while leaked < len(lane) and lane[leaked].x + lane[leaked].width <= TRIPLE_MATCH_WIDTH: leaked += 1
+            if leaked:
+                for i in range(leaked): zombie_pool.release(lane[i])
+                del lane[:leaked]
+                for _ in range(leaked):
+                    self.lives -= 1
+                    audio.play('life_lost')
+                    if self.lives <= 0: return GameState.GAME_OVER
+        for zombies, projectiles in zip(self.zombie_lanes, self.projectile_lanes):
+            # 同一路线内子弹能命中的只可能是右边缘越过它左边缘的第一只活僵尸，二分查找即可；
+            # 子弹从右往左处理（即先发射的先结算），被击杀的僵尸先标记，本帧结束时一次性移除。
+            # 留下的子弹从右往左原地写回列表尾部，不为每条路线每帧新建列表；用掉的子弹和死掉的僵尸放回对象池
+            kept = len(projectiles); killed = False
+            for i in range(len(projectiles) - 1, -1, -1):
+                p = projectiles[i]; p.move()
+                zi = bisect.bisect_right(zombies, p.rect.left, key=_zombie_right)
+                while zi < len(zombies) and zombies[zi].health <= 0: zi += 1
+                if zi < len(zombies) and zombies[zi].x < p.rect.right:
+                    if zombies[zi].hit(): killed = True; self.score += 3; self.zombies_killed += 1
+                    projectile_pool.release(p)
+                elif p.rect.left <= SCREEN_WIDTH: kept -= 1; projectiles[kept] = p
+                else: projectile_pool.release(p)
+            del projectiles[:kept]
+            if killed:
+                alive = 0
+                for z in zombies:
+                    if z.health > 0: zombies[alive] = z; alive += 1
+                    else: zombie_pool.release(z)
+                del zombies[alive:]
         for turret in self.turrets: turret.update(self)
         return GameState.PLAYING
-    def draw(self, surface):
+    def zombie_count(self): return sum(len(lane) for lane in self.zombie_lanes)
+    def projectile_count(self): return sum(len(lane) for lane in self.projectile_lanes)
+    def snapshot(self):
+        """ 僵尸(路线, x, 血量)和子弹(路线, x)的有序列表，用于比较两局的状态是否一致 """
+        zombies = sorted((i, z.x, z.health) for i, lane in enumerate(self.zombie_lanes) for z in lane)
+        return zombies, sorted((i, p.rect.x) for i, lane in enumerate(self.projectile_lanes) for p in lane)
+    def draw_lanes(self, surface):
         path_color = (139, 115, 85)
         for row_y in self.zombie_rows:
             path_rect = pygame.Rect(TRIPLE_MATCH_WIDTH, row_y - 40, ZOMBIE_AREA_WIDTH, 80)
             pygame.draw.rect(surface, path_color, path_rect)
             pygame.draw.rect(surface, DARK_GREEN, path_rect, 2)
-        for z in self.zombies: z.draw(surface)
-        for p in self.projectiles: p.draw(surface)
-        for turret in self.turrets: turret.draw(surface)
+    def draw(self, surface):
+        self.draw_lanes(surface)
+        self.draw_sprites(surface)
+    def draw_sprites(self, surface, alpha=1.0):
+        """ 画僵尸、子弹和炮台，返回画过的矩形（分层渲染据此计算脏矩形）；alpha是两次模拟步之间的插值进度 """
+        rects = [z.draw(surface, alpha) for lane in self.zombie_lanes for z in lane]
+        rects += [p.draw(surface, alpha) for lane in self.projectile_lanes for p in lane]
+        rects += [turret.draw(surface) for turret in self.turrets]
+        return rects
     def shoot_projectile(self):
-        if sounds['eliminate']: sounds['eliminate'].play()
-        y_pos = random.choice(self.zombie_rows)
-        self.projectiles.append(Projectile(TRIPLE_MATCH_WIDTH, y_pos))
+        audio.play('eliminate')
+        y_pos = self.shot_rng.choice(self.zombie_rows)
+        self.add_projectile(projectile_pool.acquire(TRIPLE_MATCH_WIDTH, y_pos))
     def shoot_custom_projectile(self, y_pos):
-        if sounds['eliminate']: sounds['eliminate'].play()
+        audio.play('eliminate')
         closest_row = min(self.zombie_rows, key=lambda row: abs(row - y_pos))
-        self.projectiles.append(Projectile(TRIPLE_MATCH_WIDTH, closest_row))
+        self.add_projectile(projectile_pool.acquire(TRIPLE_MATCH_WIDTH, closest_row))
     def is_level_complete(self, matches_made=0):
         level_type = self.level_data.get('type', 'score')
         if level_type == 'score': return self.score >= self.level_data['target']
@@ -641,301 +1488,1017 @@ class ZombieGame:
         elif level_type == 'match': return matches_made >= self.level_data['target']
         return False
 
+class EntityStore:
+    """ 结构数组形式的实体存储：x、路线、血量、速度和类型各占一段连续的NumPy数组，容量不足时成倍扩容。
+    store.x 等属性返回当前有效部分的视图，原地运算会直接写回存储 """
+    FIELDS = (('x', 'float64'), ('lane', 'int32'), ('health', 'int32'), ('speed', 'float64'), ('kind', 'int32'))
+    def __init__(self, capacity=256):
+        load_numpy()
+        self.count = 0
+        for name, dtype in self.FIELDS: setattr(self, '_' + name, np.zeros(capacity, dtype=dtype))
+    def __len__(self): return self.count
+    def add(self, x, lane, health, speed, kind):
+        if self.count == len(self._x):
+            for name, _ in self.FIELDS:
+                array = getattr(self, '_' + name); grown = np.zeros(len(array) * 2, dtype=array.dtype); grown[:self.count] = array[:self.count]
+                setattr(self, '_' + name, grown)
+        i = self.count
+        self._x[i] = x; self._lane[i] = lane; self._health[i] = health; self._speed[i] = speed; self._kind[i] = kind
+        self.count += 1
+    def reorder(self, permutation):
+        for name, _ in self.FIELDS:
+            array = getattr(self, '_' + name); array[:self.count] = array[:self.count][permutation]
+    def keep(self, mask):
+        """ 只保留mask为True的实体（保持原有顺序） """
+        n = int(np.count_nonzero(mask))
+        for name, _ in self.FIELDS:
+            array = getattr(self, '_' + name); array[:n] = array[:self.count][mask]
+        self.count = n
+
+def _entity_field(name):
+    def getter(self): return getattr(self, '_' + name)[:self.count]
+    def setter(self, value): getattr(self, '_' + name)[:self.count] = value
+    return property(getter, setter)
+
+for _name, _ in EntityStore.FIELDS: setattr(EntityStore, _name, _entity_field(_name))
+
+class ArrayZombieGame(ZombieGame):
+    """ 使用EntityStore的ZombieGame：移动、出界、走进三消区扣命和子弹命中都按整组数组一次完成，
+    用于成千上万个实体的压力测试配置。规则和出怪随机数的消耗与ZombieGame一致 """
+    ZOMBIE_WIDTH = 60
+    ZOMBIE_HEIGHT = 80
+    def __init__(self, level_data, rng=None, shot_rng=None):
+        super().__init__(level_data, rng, shot_rng)
+        self.zombie_store = EntityStore(); self.projectile_store = EntityStore()
+        # 僵尸按(路线, x)排好序存放；同速移动和删除都不改变顺序，只有新加入僵尸后才需要重排
+        self._zombies_sorted = True
+        # 子弹类型：kind是这张表的下标，表里记录图片和碰撞宽度
+        self.projectile_kinds = []; self._kind_index = {}
+    def zombie_count(self): return len(self.zombie_store)
+    def projectile_count(self): return len(self.projectile_store)
+    def snapshot(self):
+        zombies = sorted(zip(self.zombie_store.lane.tolist(), self.zombie_store.x.tolist(), self.zombie_store.health.tolist()))
+        return zombies, sorted(zip(self.projectile_store.lane.tolist(), self.projectile_store.x.tolist()))
+    def add_zombie(self, zombie):
+        self.zombie_store.add(zombie.x, self.lane_of(zombie.y + zombie.height // 2), zombie.health, zombie.speed, 0)
+        self._zombies_sorted = False
+        # 数据已经拷进数组，对象本身不再需要
+        zombie_pool.release(zombie)
+    def add_projectile(self, projectile):
+        key = id(projectile.image)
+        if key not in self._kind_index:
+            self._kind_index[key] = len(self.projectile_kinds); self.projectile_kinds.append((projectile.image, projectile.rect.width))
+        self.projectile_store.add(projectile.rect.x, self.lane_of(projectile.rect.centery), 1, projectile.speed, self._kind_index[key])
+        projectile_pool.release(projectile)
+    def update(self):
+        if self.spawn_due(): self.add_zombie(zombie_pool.acquire(SCREEN_WIDTH, self.rng.choice(self.zombie_rows) - 40))
+        zombies = self.zombie_store; projectiles = self.projectile_store
+        zombies.x -= zombies.speed
+        leaked = zombies.x + self.ZOMBIE_WIDTH <= TRIPLE_MATCH_WIDTH
+        leaked_count = int(np.count_nonzero(leaked))
+        if leaked_count:
+            zombies.keep(~leaked)
+            self.lives -= leaked_count
+            audio.play('life_lost')
+            if self.lives <= 0: return GameState.GAME_OVER
+        projectiles.x += projectiles.speed
+        if len(projectiles) and len(zombies): self._resolve_hits()
+        if len(projectiles):
+            on_screen = projectiles.x <= SCREEN_WIDTH
+            if not on_screen.all(): projectiles.keep(on_screen)
+        for turret in self.turrets: turret.update(self)
+        return GameState.PLAYING
+    def _resolve_hits(self):
+        """ 按(路线, 右边缘)排序僵尸后，每发子弹用searchsorted找到同路线第一只右边缘越过它左边缘的僵尸。
+        同一只僵尸被多发子弹选中时，按先发射（更靠右）的先结算，多余的子弹在下一轮继续找后面的僵尸 """
+        zombies = self.zombie_store; projectiles = self.projectile_store
+        lane_span = SCREEN_WIDTH * 4.0
+        if not self._zombies_sorted:
+            # 数据几乎有序，稳定排序（timsort）接近线性
+            zombies.reorder(np.argsort(zombies.lane * lane_span + zombies.x, kind='stable')); self._zombies_sorted = True
+        widths = np.array([width for _, width in self.projectile_kinds], dtype=np.float64)
+        p_left = projectiles.x; p_right = p_left + widths[projectiles.kind]; p_lane = projectiles.lane
+        consumed = np.zeros(len(projectiles), dtype=bool)
+        pending = np.arange(len(projectiles))
+        order = np.arange(len(zombies))
+        keys = zombies.lane * lane_span + zombies.x + self.ZOMBIE_WIDTH
+        while len(pending):
+            if not len(order): break
+            idx = np.searchsorted(keys, p_lane[pending] * lane_span + p_left[pending], side='right')
+            valid = idx < len(order)
+            target = order[np.minimum(idx, len(order) - 1)]
+            valid &= (zombies.lane[target] == p_lane[pending]) & (zombies.x[target] < p_right[pending])
+            pending = pending[valid]; target = target[valid]
+            if not len(pending): break
+            # 同一目标内按子弹x从大到小排名，前health发命中，其余留到下一轮
+            rank_order = np.lexsort((-p_left[pending], target))
+            pending = pending[rank_order]; target = target[rank_order]
+            first = np.r_[0, np.flatnonzero(np.diff(target)) + 1]
+            rank = np.arange(len(target)) - np.repeat(first, np.diff(np.r_[first, len(target)]))
+            hit = rank < zombies.health[target]
+            np.subtract.at(zombies.health, target[hit], 1)
+            consumed[pending[hit]] = True
+            pending = pending[~hit]
+            alive = zombies.health[order] > 0
+            order = order[alive]; keys = keys[alive]
+        dead = zombies.health <= 0
+        killed = int(np.count_nonzero(dead))
+        if killed:
+            self.score += 3 * killed; self.zombies_killed += killed
+            zombies.keep(~dead)
+        if consumed.any(): projectiles.keep(~consumed)
+    def draw_sprites(self, surface, alpha=1.0):
+        zombie_image = sprite_cache.get("imgs/zombie.png", (self.ZOMBIE_WIDTH, self.ZOMBIE_HEIGHT))
+        zombie_rows = self.zombie_rows
+        zombie_x = self.zombie_store.x if alpha >= 1 else self.zombie_store.x + self.zombie_store.speed * (1 - alpha)
+        projectile_x = self.projectile_store.x if alpha >= 1 else np.round(self.projectile_store.x - self.projectile_store.speed * (1 - alpha))
+        if zombie_image:
+            rects = surface.blits([(zombie_image, (x, zombie_rows[lane] - 40)) for x, lane in zip(zombie_x.tolist(), self.zombie_store.lane.tolist())])
+        else:
+            rects = [pygame.draw.rect(surface, DARK_GREEN, (x, zombie_rows[lane] - 40, self.ZOMBIE_WIDTH, self.ZOMBIE_HEIGHT)) for x, lane in zip(zombie_x.tolist(), self.zombie_store.lane.tolist())]
+        kinds = self.projectile_kinds
+        rects += surface.blits([(kinds[kind][0], kinds[kind][0].get_rect(midleft=(x, zombie_rows[lane])))
+                                for x, lane, kind in zip(projectile_x.tolist(), self.projectile_store.lane.tolist(), self.projectile_store.kind.tolist())])
+        rects += [turret.draw(surface) for turret in self.turrets]
+        return rects
+
+class GameSession:
+    """ 一局游戏的规则状态：三消盘面、僵尸、备弹和商店冷却。
+    不依赖窗口、字体和声音，界面循环和无界面模拟共用；每次 tick() 相当于原来的一帧 """
+    def __init__(self, mode, level_data, endless=False, seed=None, lives=None, score=0, record=False):
+        self.mode = mode  # 'classic' 或 'battle'
+        self.endless = endless
+        # 不指定种子时也随机选一个记下来，界面里玩的每一局都能录像重放
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        # 每类随机数各用一个独立的流：盘面生成和补充、出怪路线、奖励子弹路线，
+        # 玩家的操作只会消耗盘面和子弹的流，出怪顺序只由种子决定
+        self.board_rng = random.Random(f"{self.seed}/board")
+        self.spawn_rng = random.Random(f"{self.seed}/spawn")
+        self.shot_rng = random.Random(f"{self.seed}/shot")
+        self.level_data = level_data
+        self.initial = {'level_data': dict(level_data), 'lives': lives, 'score': score}
+        # 录像：[模拟步, 操作名, 参数...]，为None时不录
+        self.inputs = [] if record else None
+        # 关卡可以用grid_size和tile_types指定更大的盘面和更多种元素，此时改用位棋盘实现
+        grid_size = level_data.get("grid_size", 8); num_types = level_data.get("tile_types", 3)
+        match_game_class = TripleMatchGame if (grid_size, num_types) == (8, 3) else BitboardMatchGame
+        self.triple_match = match_game_class(mode=mode, rng=self.board_rng, grid_size=grid_size, num_types=num_types)
+        zombie_game_class = ArrayZombieGame if game_settings["entity_store"] == "array" and load_numpy() else ZombieGame
+        self.zombie_game = zombie_game_class(level_data, rng=self.spawn_rng, shot_rng=self.shot_rng)
+        if lives is not None: self.zombie_game.lives = lives
+        self.zombie_game.score = score
+        self.is_match_level = level_data.get('type') == 'match'
+        self.bullet_storage = 0; self.matches_made = 0; self.ticks = 0
+        # 备弹收支统计（不影响规则）：三消得到的、商店花掉的、备弹满50后溢出浪费的
+        self.ammo_earned = 0; self.ammo_spent = 0; self.ammo_wasted = 0
+        self.lives_purchased = 0; self.turret_purchased = False; self.spawn_rate_timer = 0
+        self.custom_bullet_cooldown = 0; self.life_purchase_cooldown = 0; self.shuffle_cooldown = 0
+    def log_input(self, action, *args):
+        if self.inputs is not None: self.inputs.append([self.ticks, action, *args])
+    def shop_cost(self, item):
+        # 战斗模式只有洗牌，价格固定为15
+        return 15 if self.mode == 'battle' else game_settings['shop_costs'][item]
+    def spend(self, item):
+        cost = self.shop_cost(item); self.bullet_storage -= cost; self.ammo_spent += cost
+    def buy_life(self):
+        self.log_input('buy_life')
+        if self.mode == 'battle' or self.is_match_level: return False
+        if self.bullet_storage >= self.shop_cost('life') and self.lives_purchased < 3 and self.life_purchase_cooldown == 0:
+            self.spend('life'); self.zombie_game.lives += 1; self.lives_purchased += 1; self.life_purchase_cooldown = 60 * TICK_RATE
+            return True
+        return False
+    def buy_turret(self):
+        self.log_input('buy_turret')
+        if self.mode == 'battle' or self.is_match_level: return False
+        if not self.turret_purchased and self.bullet_storage >= self.shop_cost('turret'):
+            self.spend('turret'); self.turret_purchased = True
+            self.zombie_game.turrets.append(AutoTurret(TRIPLE_MATCH_WIDTH + 50, SCREEN_HEIGHT // 2 - 25))
+            return True
+        return False
+    def can_fire_custom_bullet(self):
+        return self.mode != 'battle' and self.bullet_storage >= self.shop_cost('custom_bullet') and self.custom_bullet_cooldown == 0
+    def fire_custom_bullet(self, y_pos):
+        self.log_input('fire_custom_bullet', y_pos)
+        self.zombie_game.shoot_custom_projectile(y_pos)
+        self.spend('custom_bullet'); self.custom_bullet_cooldown = 45 * TICK_RATE
+    def shuffle(self):
+        self.log_input('shuffle')
+        if self.bullet_storage >= self.shop_cost('shuffle') and self.shuffle_cooldown == 0:
+            self.spend('shuffle'); self.shuffle_cooldown = 30 * TICK_RATE; self.triple_match.initialize_grid()
+            return True
+        return False
+    def click(self, pos):
+        """ 屏幕坐标的点击，点在三消区域外时取消选中 """
+        self.log_input('click', pos[0], pos[1])
+        return self.apply_match_result(self.triple_match.handle_click(pos))
+    def click_cell(self, row, col):
+        self.log_input('click_cell', row, col)
+        return self.apply_match_result(self.triple_match.click_cell(row, col))
+    def apply_match_result(self, result):
+        if not result: return result
+        self.matches_made += result.get('matches_made', 0)
+        ammo = result.get('ammo', 0); self.ammo_earned += ammo
+        self.ammo_wasted += max(0, self.bullet_storage + ammo - 50); self.bullet_storage = min(self.bullet_storage + ammo, 50)
+        if self.mode == 'classic':
+            for _ in range(result.get('bullets', 0)): self.zombie_game.shoot_projectile()
+        else:
+            audio.play('eliminate')
+            cell_size = self.triple_match.cell_size
+            for grid_r, grid_c, tile_type in result['projectiles']:
+                start_y = (SCREEN_HEIGHT - TRIPLE_MATCH_HEIGHT) + grid_r * cell_size + cell_size / 2
+                # Find which zombie row this corresponds to
+                target_y = min(self.zombie_game.zombie_rows, key=lambda r: abs(r - start_y))
+                # Create projectile starting from the right edge of the match grid, aligned with the row
+                self.zombie_game.add_projectile(projectile_pool.acquire(TRIPLE_MATCH_WIDTH, target_y, tile_surfaces(self.triple_match.num_types, TRIPLE_MATCH_WIDTH // 8)[tile_type]))
+        return result
+    def tick(self):
+        """ 推进一帧，返回 GameState.PLAYING / GAME_OVER / LEVEL_COMPLETE """
+        self.ticks += 1
+        if self.custom_bullet_cooldown > 0: self.custom_bullet_cooldown -= 1
+        if self.life_purchase_cooldown > 0: self.life_purchase_cooldown -= 1
+        if self.shuffle_cooldown > 0: self.shuffle_cooldown -= 1
+        if self.endless and self.mode == 'classic':
+            # 经典无尽模式每10秒加快一次出怪
+            self.spawn_rate_timer += 1
+            if self.spawn_rate_timer > 10 * TICK_RATE and self.zombie_game.level_data["spawn_rate"] > 45:
+                self.zombie_game.level_data["spawn_rate"] = max(45, self.zombie_game.level_data["spawn_rate"] - 5); self.spawn_rate_timer = 0
+        if self.zombie_game.update() == GameState.GAME_OVER: return GameState.GAME_OVER
+        if not self.endless and self.zombie_game.is_level_complete(self.matches_made): return GameState.LEVEL_COMPLETE
+        return GameState.PLAYING
+    def digest(self):
+        """ 规则状态的摘要：重放录像后与录像里记下的比较，一致说明完全复现 """
+        zombie_game = self.zombie_game
+        state = (self.ticks, self.triple_match.grid, zombie_game.snapshot(), zombie_game.lives, zombie_game.score, zombie_game.zombies_killed,
+                 self.matches_made, self.bullet_storage, self.lives_purchased, self.turret_purchased)
+        return hashlib.sha1(repr(state).encode()).hexdigest()
+
+# 影响规则结果的设置，录像时一并记下，重放时临时换上
+REPLAY_SETTINGS = ("zombie_spawn_rate_modifier", "entity_store", "shop_costs")
+# 录像里可以出现的操作，对应 GameSession 上同名的方法
+REPLAY_ACTIONS = {'click': lambda session, x, y: session.click((x, y)), 'click_cell': GameSession.click_cell, 'buy_life': GameSession.buy_life,
+                  'buy_turret': GameSession.buy_turret, 'fire_custom_bullet': GameSession.fire_custom_bullet, 'shuffle': GameSession.shuffle}
+
+def session_replay(session, level, outcome):
+    """ 把录了输入的一局整理成录像：种子、初始状态、相关设置、输入和结束时的状态摘要 """
+    return {'version': 1, 'mode': session.mode, 'endless': session.endless, 'level': level, 'seed': session.seed, **session.initial,
+            'settings': {key: game_settings[key] for key in REPLAY_SETTINGS}, 'inputs': session.inputs,
+            'outcome': outcome, 'ticks': session.ticks, 'digest': session.digest()}
+
+def save_replay(session, level, outcome):
+    """ 界面里每局结束时调用，写入 replay_dir 并删掉最旧的多余录像；返回文件路径 """
+    if not game_settings["replay_dir"] or session.inputs is None: return None
+    try:
+        os.makedirs(game_settings["replay_dir"], exist_ok=True)
+        name = f"{session.mode}_{'endless' if session.endless else level}_{time.strftime('%Y%m%d_%H%M%S')}_{session.seed}.json"
+        path = os.path.join(game_settings["replay_dir"], name)
+        write_file_atomic(path, json.dumps(session_replay(session, level, outcome), separators=(',', ':')))
+        replays = sorted((entry.path for entry in os.scandir(game_settings["replay_dir"]) if entry.name.endswith(".json")), key=os.path.getmtime)
+        for old_path in replays[:-game_settings["replay_keep"]]: os.remove(old_path)
+        return path
+    except OSError as e:
+        print(f"保存录像失败: {e}")
+        return None
+
+def replay_session(replay):
+    """ 按录像重建这一局并以最快速度重放，返回 (session, status)；
+    第t步之前执行时间戳为t的输入，与界面循环先处理事件再推进模拟的顺序相同 """
+    saved = {key: game_settings[key] for key in replay['settings']}
+    game_settings.update(replay['settings'])
+    try:
+        session = GameSession(replay['mode'], dict(replay['level_data']), endless=replay['endless'], seed=replay['seed'], lives=replay['lives'], score=replay['score'])
+        inputs = deque(replay['inputs']); status = GameState.PLAYING
+        while session.ticks < replay['ticks']:
+            while inputs and inputs[0][0] <= session.ticks:
+                _, action, *args = inputs.popleft(); REPLAY_ACTIONS[action](session, *args)
+            status = session.tick()
+            if status != GameState.PLAYING: break
+        # 最后一步之后的输入（例如退出前的点击）
+        while inputs:
+            _, action, *args = inputs.popleft(); REPLAY_ACTIONS[action](session, *args)
+    finally:
+        game_settings.update(saved)
+    return session, status
+
+def run_simulation(session, max_ticks, player=None):
+    """ 不渲染、不限帧地推进一局游戏；player(session) 每帧调用一次，用来模拟玩家输入 """
+    status = GameState.PLAYING
+    while session.ticks < max_ticks:
+        if player: player(session)
+        status = session.tick()
+        if status != GameState.PLAYING: break
+    return status
+
+def random_swap_player(seed=None, interval=30):
+    """ 每隔interval帧随机交换一对相邻元素的简单脚本玩家，用于压测和关卡验证 """
+    rng = random.Random(seed)
+    def player(session):
+        if session.ticks % interval: return
+        grid_size = session.triple_match.grid_size
+        row, col = rng.randrange(grid_size), rng.randrange(grid_size - 1)
+        if rng.random() < 0.5: session.click_cell(row, col); session.click_cell(row, col + 1)
+        else: session.click_cell(col, row); session.click_cell(col + 1, row)
+    return player
+
+class _UnknownTiles:
+    """ 机器人模拟连锁时代替随机数：补充进来的新元素事先不知道，一律当作空位（空位不参与三连） """
+    @staticmethod
+    def randint(a, b): return -1
+
+class _SearchTimeout(Exception): pass
+
+class MatchBot:
+    """ 自动三消玩家，用于无人值守的压测和性能跟踪。
+    候选步是盘面上能凑成三连的交换；每一步在盘面副本上模拟完整的连锁（find_matches_at → remove_matches → apply_gravity），
+    消掉的元素个数就是得分。向后看depth步（后续步的得分乘discount），每层只对当前得分最高的beam步往下搜；
+    迭代加深，超过每步 budget_ms 时用上一层的结果；置换表按(盘面, 剩余深度)缓存局面的最佳得分，不同走法到达同一盘面时不重复搜索。
+    实例可以直接当 run_simulation 的 player 用，每 interval 步走一步；通过 session.click_cell 操作，会照常进入录像 """
+    def __init__(self, depth=2, budget_ms=8.0, interval=30, discount=0.5, beam=6, table_size=50000):
+        self.depth = depth; self.budget_ms = budget_ms; self.interval = interval; self.discount = discount; self.beam = beam
+        self.table = {}; self.table_size = table_size
+        self.moves_made = 0; self.nodes = 0; self.table_hits = 0; self.timeouts = 0
+    def __call__(self, session):
+        if session.ticks % self.interval: return
+        move = self.choose(session.triple_match)
+        if move is None: return
+        # 玩家已经选中了一格时先点盘面外取消选中（同样会进入录像）
+        if session.triple_match.selected is not None: session.click((-1, -1))
+        r1, c1, r2, c2 = move
+        session.click_cell(r1, c1); session.click_cell(r2, c2)
+        self.moves_made += 1
+    def choose(self, triple_match):
+        """ 返回选中的交换 (r1, c1, r2, c2)，没有可走的步时返回None；得分相同时取坐标最小的，结果可复现 """
+        moves = sorted(triple_match.valid_moves)
+        if not moves: return None
+        deadline = time.perf_counter() + self.budget_ms / 1000 if self.budget_ms else None
+        board = triple_match.scratch_copy(_UnknownTiles)
+        best = moves[0]
+        for depth in range(1, self.depth + 1):
+            depth_best = None; depth_value = -1; values = {}
+            try:
+                for move in moves:
+                    if deadline and depth_best is not None and time.perf_counter() > deadline: raise _SearchTimeout
+                    values[move] = value = self._move_value(board, move, depth, deadline)
+                    if value > depth_value: depth_best, depth_value = move, value
+            except _SearchTimeout:
+                self.timeouts += 1
+                # 第一层没搜完也比不搜强
+                if depth == 1 and depth_best is not None: best = depth_best
+                break
+            best = depth_best
+            # 下一层只深入这一层得分最高的几步（排序稳定，同分保持坐标顺序）
+            moves = sorted(moves, key=lambda move: -values[move])[:self.beam]
+        return best
+    def _move_value(self, board, move, depth, deadline):
+        grid = [row[:] for row in board.grid]
+        r1, c1, r2, c2 = move
+        board.swap_elements(r1, c1, r2, c2)
+        matches = board.find_matches_at([(r1, c1), (r2, c2)]); value = 0
+        while matches:
+            value += len(matches)
+            board.remove_matches(matches)
+            matches = board.find_matches_at(board.apply_gravity())
+        if depth > 1 and value: value += self.discount * self._best_value(board, depth - 1, deadline)
+        board.grid = grid
+        return value
+    def _best_value(self, board, depth, deadline):
+        key = (bytes(value + 1 for row in board.grid for value in row), depth)
+        if key in self.table: self.table_hits += 1; return self.table[key]
+        if deadline and time.perf_counter() > deadline: raise _SearchTimeout
+        self.nodes += 1
+        grid = board.grid
+        moves = [move for move in board.all_swaps() if grid[move[0]][move[1]] != -1 and grid[move[2]][move[3]] != -1 and board.would_match(*move)]
+        if depth > 1 and len(moves) > self.beam:
+            immediate = {move: self._move_value(board, move, 1, deadline) for move in moves}
+            moves = sorted(moves, key=lambda move: -immediate[move])[:self.beam]
+        value = max((self._move_value(board, move, depth, deadline) for move in moves), default=0)
+        if len(self.table) >= self.table_size: self.table.clear()
+        self.table[key] = value
+        return value
+    def stats(self):
+        return {'moves': self.moves_made, 'nodes': self.nodes, 'table_hits': self.table_hits, 'timeouts': self.timeouts}
+
+def run_headless(mode='classic', level=1, endless=False, seed=0, max_ticks=100000, player_seed=None, grid_size=None, tile_types=None, bot=None):
+    """ 命令行无界面模拟入口，打印结果和每秒帧数 """
+    headless_init()
+    levels = BATTLE_LEVELS if mode == 'battle' else LEVELS
+    if endless: level_data = {"type": "kill", "target": float('inf'), "zombies": float('inf'), "spawn_rate": 120} if mode == 'battle' else {"zombies": float('inf'), "spawn_rate": 180}
+    else: level_data = dict(levels[level - 1])
+    if grid_size: level_data["grid_size"] = grid_size
+    if tile_types: level_data["tile_types"] = tile_types
+    session = GameSession(mode, level_data, endless=endless, seed=seed, lives=15 if (mode == 'battle' or endless) else None)
+    start = time.perf_counter()
+    status = run_simulation(session, max_ticks, bot or random_swap_player(seed if player_seed is None else player_seed))
+    elapsed = time.perf_counter() - start
+    print(f"{status.name}: ticks={session.ticks} score={session.zombie_game.score} killed={session.zombie_game.zombies_killed} "
+          f"lives={session.zombie_game.lives} matches={session.matches_made} ({session.ticks / max(elapsed, 1e-9):.0f} ticks/s)")
+    if bot: print(f"机器人: {bot.stats()}")
+    print(f"对象池: 僵尸 {zombie_pool.stats()} 子弹 {projectile_pool.stats()}")
+    return session, status
+
+def run_replay(path):
+    """ 命令行重放入口：打印结果、速度，以及状态是否与录像一致 """
+    headless_init()
+    with open(path, "r", encoding="utf-8") as f: replay = json.load(f)
+    start = time.perf_counter()
+    session, status = replay_session(replay)
+    elapsed = time.perf_counter() - start
+    matched = session.digest() == replay['digest']
+    print(f"{status.name}: ticks={session.ticks} inputs={len(replay['inputs'])} score={session.zombie_game.score} killed={session.zombie_game.zombies_killed} "
+          f"lives={session.zombie_game.lives} matches={session.matches_made} ({session.ticks / max(elapsed, 1e-9):.0f} ticks/s) "
+          f"{'状态与录像一致' if matched else '状态与录像不一致'}")
+    return session, matched
+
+class LayeredRenderer:
+    """ 游戏画面的分层渲染。背景、路线和盘面网格线预先合成一次；盘面只在版本号、选中格或提示变化时重画，
+    界面文字和按钮只在显示内容变化时重画，两者都画进合成层。僵尸、子弹和炮台每帧先用合成层盖掉上一帧的位置再画，
+    最后只把变化的矩形交给 pygame.display.update，而不是整窗 flip """
+    def __init__(self, triple_match, zombie_game, draw_hud):
+        self.triple_match = triple_match; self.zombie_game = zombie_game; self.draw_hud = draw_hud
+        self.background = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+        if pygame.display.get_surface(): self.background = self.background.convert()
+        self.background.fill(LIGHT_GREEN)
+        triple_match.draw_grid(self.background); zombie_game.draw_lanes(self.background)
+        self.composite = self.background.copy()
+        self.board_rect = pygame.Rect(0, SCREEN_HEIGHT - TRIPLE_MATCH_HEIGHT, TRIPLE_MATCH_WIDTH, TRIPLE_MATCH_HEIGHT)
+        # 文字和按钮都在盘面和路线上方的这一条区域里
+        self.hud_rect = pygame.Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT - TRIPLE_MATCH_HEIGHT)
+        self.board_signature = None; self.hud_signature = None
+        self.sprite_rects = []; self.full_redraw = True
+    def invalidate(self): self.full_redraw = True
+    def render(self, surface, hud_signature, alpha=1.0):
+        """ hud_signature 是界面上显示的所有数值，与上一帧相同时不重画界面；alpha 传给 draw_sprites 做插值 """
+        dirty = []
+        triple_match = self.triple_match
+        board_signature = (triple_match.version, triple_match.selected, triple_match.hinted)
+        if board_signature != self.board_signature:
+            self.board_signature = board_signature
+            self.composite.blit(self.background, self.board_rect, self.board_rect)
+            triple_match.draw_tiles(self.composite); dirty.append(self.board_rect)
+        if hud_signature != self.hud_signature:
+            self.hud_signature = hud_signature
+            self.composite.blit(self.background, self.hud_rect, self.hud_rect)
+            self.draw_hud(self.composite); dirty.append(self.hud_rect)
+        if self.full_redraw:
+            surface.blit(self.composite, (0, 0)); dirty = [surface.get_rect()]; self.full_redraw = False
+        else:
+            for rect in dirty + self.sprite_rects: surface.blit(self.composite, rect, rect)
+        sprite_rects = self.zombie_game.draw_sprites(surface, alpha)
+        # 统计浮层和精灵一样每帧重画，下一帧用合成层盖掉，关掉浮层后也不会留下残影
+        overlay_rect = profiler.draw_overlay(surface)
+        if overlay_rect: sprite_rects.append(overlay_rect)
+        profiler.mark("draw")
+        pygame.display.update(dirty + self.sprite_rects + sprite_rects)
+        profiler.mark("flip")
+        self.sprite_rects = sprite_rects
+
+class FixedTimestep:
+    """ 固定步长累加器：按真实经过的时间决定每帧推进几步模拟（每步 1/TICK_RATE 秒），
+    渲染慢时一帧补几步，渲染快时有的帧不推进，游戏速度都保持不变。
+    单帧最多补 max_steps 步，卡顿更久时丢弃多出的时间，避免越补越慢 """
+    def __init__(self, tick_rate=TICK_RATE, max_steps=5, clock=time.perf_counter):
+        self.step = 1.0 / tick_rate; self.max_steps = max_steps; self.clock = clock
+        self.accumulator = 0.0; self.last = None; self.dropped_steps = 0
+    def advance(self):
+        """ 返回本帧应推进的模拟步数；第一次调用推进一步 """
+        now = self.clock()
+        if self.last is None: self.last = now; self.accumulator = self.step
+        self.accumulator += now - self.last; self.last = now
+        steps = int(self.accumulator / self.step)
+        if steps > self.max_steps:
+            self.dropped_steps += steps - self.max_steps
+            steps = self.max_steps; self.accumulator %= self.step
+        else: self.accumulator -= steps * self.step
+        return steps
+    @property
+    def alpha(self):
+        """ 距离下一步的进度（0到1），用于插值绘制 """
+        return min(self.accumulator / self.step, 1.0)
+
+# 帧分析器：每帧按阶段（事件处理、模拟更新、三消结算、绘制、提交画面）计时，存进环形缓冲。
+# F3 开关右下角的统计浮层（FPS、p99帧时间、实体数量），F9 开始/停止对当前页面的 cProfile 抓取，
+# F10 把缓冲里的帧数据导出成JSON和CSV。计时本身只是几次 perf_counter，一直开着。
+# 菜单页面阻塞等输入的时间记为 idle_ms，不算进帧时间，大部分时间在等输入时浮层显示"等待输入"而不是FPS
+class FrameProfiler:
+    PHASES = ("events", "update", "match", "draw", "flip")
+    def __init__(self, capacity=None, clock=time.perf_counter):
+        self.frames = deque(maxlen=capacity or game_settings["profiler_frames"])
+        self.clock = clock
+        self.scene = None; self.zombie_game = None
+        self.frame_start = None; self.last = None; self.phases = {}; self.frame_idle = 0.0
+        self.overlay = False; self.overlay_surface = None; self.overlay_updated = 0.0
+        self.capture = None; self.capture_scene = None
+        # 垃圾回收耗时：回调记下每次回收的起止，累加到当前帧，用来确认卡顿是不是回收造成的
+        self.gc_started = None; self.frame_gc_ms = 0.0
+        gc.callbacks.append(self._on_gc)
+    def _on_gc(self, phase, info):
+        if phase == "start": self.gc_started = time.perf_counter()
+        elif self.gc_started is not None: self.frame_gc_ms += (time.perf_counter() - self.gc_started) * 1000; self.gc_started = None
+    def begin(self, scene, zombie_game=None):
+        """ 每帧开始时调用；上一帧在这里结束，所以帧时间包含 clock.tick 的等待。离开页面时自动停止该页面的 cProfile 抓取 """
+        now = self.clock()
+        if self.frame_start is not None: self._finish(now)
+        if self.capture and scene != self.capture_scene: self.stop_capture()
+        self.scene = scene; self.zombie_game = zombie_game
+        self.frame_start = self.last = now; self.phases = {}; self.frame_gc_ms = 0.0; self.frame_idle = 0.0
+    def mark(self, phase):
+        """ 把上一次 mark 以来的时间记到phase上，同一帧内可多次累加 """
+        if self.last is None: return  # 还没有 begin 过（基准测试直接调用渲染器）
+        now = self.clock()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last; self.last = now
+    def idle(self, seconds):
+        """ wait_for_events 阻塞等输入用掉的时间：从帧时间和当前阶段里扣掉，单独记下 """
+        if self.last is None: return
+        self.frame_idle += seconds; self.last += seconds
+    def _finish(self, now):
+        total = now - self.frame_start - self.frame_idle
+        phases = {name: self.phases.get(name, 0.0) * 1000 for name in self.PHASES}
+        phases['other'] = max(0.0, total * 1000 - sum(phases.values()))
+        zombies = self.zombie_game.zombie_count() if self.zombie_game else 0
+        projectiles = self.zombie_game.projectile_count() if self.zombie_game else 0
+        self.frames.append({'time': self.frame_start, 'scene': self.scene, 'frame_ms': total * 1000, **phases, 'idle_ms': self.frame_idle * 1000, 'gc_ms': self.frame_gc_ms, 'zombies': zombies, 'projectiles': projectiles})
+    def summary(self, frames=None):
+        """ 最近frames帧（默认整个缓冲）的FPS、p50/p99帧时间（不含等输入的时间）、各阶段平均耗时和等输入时间的占比 """
+        recent = list(self.frames)[-frames:] if frames else list(self.frames)
+        if not recent: return None
+        times = sorted(frame['frame_ms'] for frame in recent)
+        mean = sum(times) / len(times)
+        idle = sum(frame['idle_ms'] for frame in recent)
+        return {'frames': len(recent), 'fps': 1000 / mean if mean else 0.0, 'idle_share': idle / (idle + sum(times)) if idle else 0.0,
+                'p50_ms': times[len(times) // 2], 'p99_ms': times[min(len(times) - 1, int(len(times) * 0.99))],
+                'phases_ms': {name: sum(frame[name] for frame in recent) / len(recent) for name in self.PHASES + ('other',)},
+                'gc_max_ms': max(frame['gc_ms'] for frame in recent), 'zombies': recent[-1]['zombies'], 'projectiles': recent[-1]['projectiles'],
+                'pools': {'zombie': zombie_pool.stats(), 'projectile': projectile_pool.stats()},
+                'caches': {'sprite': sprite_cache.stats(), 'text': text_cache.stats()}, 'startup': startup_timer.stats()}
+    def handle_event(self, event):
+        """ 处理分析器热键，各页面的事件循环都先交给它 """
+        if event.type != pygame.KEYDOWN: return False
+        if event.key == pygame.K_F3: self.overlay = not self.overlay; self.overlay_surface = None
+        elif event.key == pygame.K_F9:
+            if self.capture: self.stop_capture()
+            else: self.start_capture()
+        elif event.key == pygame.K_F10: self.export()
+        else: return False
+        return True
+    def start_capture(self):
+        import cProfile
+        self.capture = cProfile.Profile(); self.capture_scene = self.scene
+        self.capture.enable()
+        print(f"开始抓取 {self.scene} 的性能数据")
+    def stop_capture(self):
+        """ 停止抓取，把数据存成 .prof 文件（可用 snakeviz / pstats 查看），累计耗时最高的几个函数写到同名的 .txt 文件 """
+        import pstats
+        self.capture.disable()
+        os.makedirs(game_settings["profiler_dir"], exist_ok=True)
+        path = os.path.join(game_settings["profiler_dir"], f"{self.capture_scene}_{time.strftime('%Y%m%d_%H%M%S')}.prof")
+        self.capture.dump_stats(path)
+        text = io.StringIO()
+        pstats.Stats(self.capture, stream=text).sort_stats("cumulative").print_stats(15)
+        write_file_atomic(os.path.splitext(path)[0] + ".txt", text.getvalue())
+        print(f"性能数据已保存到 {path}")
+        self.capture = None; self.capture_scene = None
+        return path
+    def export(self, base_path=None):
+        """ 把缓冲里的帧写成 base_path.json 和 base_path.csv，返回两个路径 """
+        import csv
+        if base_path is None:
+            os.makedirs(game_settings["profiler_dir"], exist_ok=True)
+            base_path = os.path.join(game_settings["profiler_dir"], f"frames_{time.strftime('%Y%m%d_%H%M%S')}")
+        frames = list(self.frames)
+        write_file_atomic(base_path + ".json", json.dumps({'summary': self.summary(), 'frames': frames}, ensure_ascii=False, indent=1))
+        text = io.StringIO()
+        writer = csv.DictWriter(text, fieldnames=['time', 'scene', 'frame_ms', *self.PHASES, 'other', 'idle_ms', 'gc_ms', 'zombies', 'projectiles'])
+        writer.writeheader(); writer.writerows(frames)
+        write_file_atomic(base_path + ".csv", text.getvalue())
+        print(f"帧数据已导出到 {base_path}.json / .csv")
+        return base_path + ".json", base_path + ".csv"
+    def draw_overlay(self, surface):
+        """ 画统计浮层，返回画过的矩形（没开时返回None）；文字每0.25秒才重新排一次，数字天天变，不进文字缓存 """
+        if not self.overlay: return None
+        now = self.clock()
+        if self.overlay_surface is None or now - self.overlay_updated >= 0.25:
+            stats = self.summary(TICK_RATE)
+            lines = ["F3 统计  F9 抓取  F10 导出"]
+            if stats:
+                # 菜单画完就睡，这时的"帧"只是被输入唤醒的次数，FPS没有意义
+                if stats['idle_share'] >= 0.5: lines.append(f"等待输入 空闲 {stats['idle_share']:.0%}  处理 p99 {stats['p99_ms']:.1f}ms")
+                else: lines.append(f"FPS {stats['fps']:.0f}  p99 {stats['p99_ms']:.1f}ms")
+                lines.append("  ".join(f"{name} {ms:.1f}" for name, ms in stats['phases_ms'].items() if ms >= 0.05))
+                lines.append(f"僵尸 {stats['zombies']}  子弹 {stats['projectiles']}")
+                pools = stats['pools']
+                lines.append(f"对象池复用 僵尸 {pools['zombie']['reuse_rate']:.0%}  子弹 {pools['projectile']['reuse_rate']:.0%}  GC最长 {stats['gc_max_ms']:.1f}ms")
+                caches = stats['caches']
+                lines.append(f"贴图缓存 命中 {caches['sprite']['hits']} 未命中 {caches['sprite']['misses']}  文字缓存命中率 {caches['text']['hit_rate']:.0%}")
+                if stats['startup']: lines.append(f"启动到首帧 {stats['startup']['first_frame_ms']:.0f}ms")
+            if self.capture: lines.append(f"正在抓取 {self.capture_scene}")
+            rendered = [font_small.render(line, True, WHITE) for line in lines]
+            self.overlay_surface = pygame.Surface((max(text.get_width() for text in rendered) + 16, len(rendered) * 26 + 8), pygame.SRCALPHA)
+            self.overlay_surface.fill((0, 0, 0, 170))
+            for i, text in enumerate(rendered): self.overlay_surface.blit(text, (8, 4 + i * 26))
+            self.overlay_updated = now
+        return surface.blit(self.overlay_surface, (SCREEN_WIDTH - self.overlay_surface.get_width() - 10, SCREEN_HEIGHT - self.overlay_surface.get_height() - 10))
+
+profiler = FrameProfiler()
+
+def present():
+    """ 菜单页面提交一帧：画统计浮层后整窗 flip """
+    profiler.mark("draw")
+    profiler.draw_overlay(screen)
+    pygame.display.flip()
+    profiler.mark("flip")
+
+def wait_for_events(timeout=None):
+    """ 菜单和静态页面取事件：队列为空时阻塞，直到来了事件或过了timeout秒（None为一直等，0为不等），返回这段时间的全部事件，
+    空闲时不占CPU。统计浮层开着时最多等0.25秒，让浮层上的数字照常刷新 """
+    if profiler.overlay: timeout = 0.25 if timeout is None else min(timeout, 0.25)
+    if timeout == 0 or pygame.event.peek(): return pygame.event.get()
+    start = profiler.clock()
+    event = pygame.event.wait() if timeout is None else pygame.event.wait(max(1, int(timeout * 1000)))
+    profiler.idle(profiler.clock() - start)
+    return ([] if event.type == pygame.NOEVENT else [event]) + pygame.event.get()
+
+def interpolation_alpha(timestep): return timestep.alpha if game_settings["interpolate"] else 1.0
+
+def cooldown_signature(frames):
+    """ 冷却只在大于0时显示，显示的是整秒数 """
+    return (frames > 0, frames // TICK_RATE)
+
 def game_loop(username, level_to_play):
     if level_to_play > len(LEVELS): all_levels_complete_screen(); return GameState.MAIN_MENU, level_to_play
-    game_settings["bullet_storage"] = 0
     level_data = LEVELS[level_to_play - 1]
-    triple_match = TripleMatchGame(mode='classic')
-    zombie_game = ZombieGame(level_data)
+    session = GameSession('classic', level_data, record=True)
+    triple_match = session.triple_match; zombie_game = session.zombie_game
     clock = pygame.time.Clock()
-    is_match_level = level_data.get('type') == 'match'
-    start_time = pygame.time.get_ticks(); matches_made = 0
+    is_match_level = session.is_match_level
+    start_time = pygame.time.get_ticks()
     back_button = Button(SCREEN_WIDTH - 160, 10, 150, 40, "返回菜单", LIGHT_BLUE)
     buy_life_button = Button(20, 170, 200, 40, f"买命({game_settings['shop_costs']['life']})", BLUE)
     custom_bullet_button = Button(20, 220, 200, 40, f"自定义({game_settings['shop_costs']['custom_bullet']})", BLUE)
     buy_turret_button = Button(20, 270, 200, 40, f"炮台({game_settings['shop_costs']['turret']})", BLUE)
     shuffle_button = Button(20, 320, 200, 40, f"洗牌({game_settings['shop_costs']['shuffle']})", BLUE)
-    selecting_custom_bullet_row = False; turret_purchased = False
-    custom_bullet_cooldown = 0; lives_purchased = 0; life_purchase_cooldown = 0; shuffle_cooldown = 0
+    selecting_custom_bullet_row = False
+    bot = None
+    def draw_hud(surface):
+        user_text = text_cache.render(font_small, f"用户: {username}", True, BLACK); surface.blit(user_text, (20, 20))
+        if bot: surface.blit(text_cache.render(font_small, "机器人代打中（B键关闭）", True, RED), (250, 20))
+        level_text = text_cache.render(font_small, f"关卡: {level_to_play}", True, BLACK); surface.blit(level_text, (20, 50))
+        lives_text = text_cache.render(font_small, f"生命: {zombie_game.lives}", True, BLACK); surface.blit(lives_text, (20, 80))
+        level_type = level_data.get('type', 'score')
+        if level_type == 'score': objective_text = f"得分: {zombie_game.score}/{level_data['target']}"
+        elif level_type == 'kill': objective_text = f"击杀: {zombie_game.zombies_killed}/{level_data['target']}"
+        elif level_type == 'match': objective_text = f"三消: {session.matches_made}/{level_data['target']}"
+        score_text = text_cache.render(font_small, objective_text, True, BLACK); surface.blit(score_text, (20, 110))
+        storage_text = text_cache.render(font_small, f"备弹: {session.bullet_storage}", True, BLACK); surface.blit(storage_text, (20, 140))
+        if not is_match_level:
+            buy_life_button.draw(surface)
+            if session.life_purchase_cooldown > 0:
+                cooldown_text = text_cache.render(font_small, f"冷却: {session.life_purchase_cooldown // TICK_RATE}s", True, RED)
+                surface.blit(cooldown_text, (buy_life_button.rect.right + 5, buy_life_button.rect.y + 10))
+            if session.lives_purchased >= 3:
+                limit_text = text_cache.render(font_small, "已达上限", True, RED)
+                surface.blit(limit_text, (buy_life_button.rect.right + 5, buy_life_button.rect.y + 10))
+            buy_turret_button.color = GRAY if session.turret_purchased else BLUE; buy_turret_button.draw(surface)
+        shuffle_button.draw(surface)
+        if session.shuffle_cooldown > 0:
+            cooldown_text = text_cache.render(font_small, f"冷却: {session.shuffle_cooldown // TICK_RATE}s", True, RED)
+            surface.blit(cooldown_text, (shuffle_button.rect.right + 5, shuffle_button.rect.y + 10))
+        custom_bullet_button.draw(surface)
+        if session.custom_bullet_cooldown > 0:
+            cooldown_text = text_cache.render(font_small, f"冷却: {session.custom_bullet_cooldown // TICK_RATE}s", True, RED)
+            surface.blit(cooldown_text, (custom_bullet_button.rect.right + 5, custom_bullet_button.rect.y + 10))
+        back_button.draw(surface)
+        if selecting_custom_bullet_row:
+            select_text = text_cache.render(font_medium, "点击僵尸区域选择发射行", True, RED)
+            surface.blit(select_text, (TRIPLE_MATCH_WIDTH + 50, 10))
+    def finish_run(outcome):
+        elapsed_time = (pygame.time.get_ticks() - start_time) // 1000
+        record_run(username, session, level_to_play, outcome, elapsed_time); save_replay(session, level_to_play, outcome)
+        return elapsed_time
+    renderer = LayeredRenderer(triple_match, zombie_game, draw_hud); timestep = FixedTimestep()
     while True:
-        if custom_bullet_cooldown > 0: custom_bullet_cooldown -= 1
-        if life_purchase_cooldown > 0: life_purchase_cooldown -= 1
-        if shuffle_cooldown > 0: shuffle_cooldown -= 1
+        profiler.begin("classic", zombie_game)
         for event in pygame.event.get():
-            if event.type == pygame.QUIT: return GameState.QUIT, level_to_play
+            if profiler.handle_event(event): continue
+            if event.type == pygame.QUIT: finish_run('abandoned'); return GameState.QUIT, level_to_play
             if event.type == pygame.MOUSEBUTTONDOWN:
-                if back_button.is_clicked(event.pos): return GameState.MAIN_MENU, level_to_play
+                if back_button.is_clicked(event.pos): finish_run('abandoned'); return GameState.MAIN_MENU, level_to_play
                 if selecting_custom_bullet_row:
-                    if event.pos[0] > TRIPLE_MATCH_WIDTH:
-                        zombie_game.shoot_custom_projectile(event.pos[1])
-                        game_settings["bullet_storage"] -= game_settings['shop_costs']['custom_bullet']
-                        custom_bullet_cooldown = 45 * 60; selecting_custom_bullet_row = False
-                    else: selecting_custom_bullet_row = False
+                    if event.pos[0] > TRIPLE_MATCH_WIDTH: session.fire_custom_bullet(event.pos[1])
+                    selecting_custom_bullet_row = False
                 else:
                     if not is_match_level:
-                        if buy_life_button.is_clicked(event.pos) and game_settings["bullet_storage"] >= game_settings['shop_costs']['life'] and lives_purchased < 3 and life_purchase_cooldown == 0:
-                            game_settings["bullet_storage"] -= game_settings['shop_costs']['life']; zombie_game.lives += 1; lives_purchased += 1; life_purchase_cooldown = 60 * 60
-                        elif buy_turret_button.is_clicked(event.pos) and not turret_purchased and game_settings["bullet_storage"] >= game_settings['shop_costs']['turret']:
-                            game_settings["bullet_storage"] -= game_settings['shop_costs']['turret']; turret_purchased = True; zombie_game.turrets.append(AutoTurret(TRIPLE_MATCH_WIDTH + 50, SCREEN_HEIGHT // 2 - 25))
-                    if custom_bullet_button.is_clicked(event.pos) and game_settings["bullet_storage"] >= game_settings['shop_costs']['custom_bullet'] and custom_bullet_cooldown == 0: selecting_custom_bullet_row = True
-                    if shuffle_button.is_clicked(event.pos) and game_settings["bullet_storage"] >= game_settings['shop_costs']['shuffle'] and shuffle_cooldown == 0:
-                        game_settings["bullet_storage"] -= game_settings['shop_costs']['shuffle']; shuffle_cooldown = 30 * 60; triple_match.initialize_grid()
-                    result = triple_match.handle_click(event.pos)
-                    if result:
-                        matches_made += result.get('matches_made', 0)
-                        game_settings["bullet_storage"] = min(game_settings["bullet_storage"] + result.get('ammo', 0), 50)
-                        for _ in range(result.get('bullets', 0)): zombie_game.shoot_projectile()
-        game_state = zombie_game.update()
-        if game_state == GameState.GAME_OVER: return GameState.GAME_OVER, level_to_play
-        if zombie_game.is_level_complete(matches_made):
-            elapsed_time = (pygame.time.get_ticks() - start_time) // 1000
-            return GameState.LEVEL_COMPLETE, level_to_play, elapsed_time, zombie_game.zombies_killed, matches_made
-        screen.fill(LIGHT_GREEN)
-        triple_match.draw(screen)
-        zombie_game.draw(screen)
-        user_text = font_small.render(f"用户: {username}", True, BLACK); screen.blit(user_text, (20, 20))
-        level_text = font_small.render(f"关卡: {level_to_play}", True, BLACK); screen.blit(level_text, (20, 50))
-        lives_text = font_small.render(f"生命: {zombie_game.lives}", True, BLACK); screen.blit(lives_text, (20, 80))
-        level_type = level_data.get('type', 'score')
-        if level_type == 'score': objective_text = f"得分: {zombie_game.score}/{level_data['target']}"
-        elif level_type == 'kill': objective_text = f"击杀: {zombie_game.zombies_killed}/{level_data['target']}"
-        elif level_type == 'match': objective_text = f"三消: {matches_made}/{level_data['target']}"
-        score_text = font_small.render(objective_text, True, BLACK); screen.blit(score_text, (20, 110))
-        storage_text = font_small.render(f"备弹: {game_settings['bullet_storage']}", True, BLACK); screen.blit(storage_text, (20, 140))
-        if not is_match_level:
-            buy_life_button.draw(screen)
-            if life_purchase_cooldown > 0:
-                cooldown_text = font_small.render(f"冷却: {life_purchase_cooldown // 60}s", True, RED)
-                screen.blit(cooldown_text, (buy_life_button.rect.right + 5, buy_life_button.rect.y + 10))
-            if lives_purchased >= 3:
-                limit_text = font_small.render("已达上限", True, RED)
-                screen.blit(limit_text, (buy_life_button.rect.right + 5, buy_life_button.rect.y + 10))
-            buy_turret_button.color = GRAY if turret_purchased else BLUE; buy_turret_button.draw(screen)
-        shuffle_button.draw(screen)
-        if shuffle_cooldown > 0:
-            cooldown_text = font_small.render(f"冷却: {shuffle_cooldown // 60}s", True, RED)
-            screen.blit(cooldown_text, (shuffle_button.rect.right + 5, shuffle_button.rect.y + 10))
-        custom_bullet_button.draw(screen)
-        if custom_bullet_cooldown > 0:
-            cooldown_text = font_small.render(f"冷却: {custom_bullet_cooldown // 60}s", True, RED)
-            screen.blit(cooldown_text, (custom_bullet_button.rect.right + 5, custom_bullet_button.rect.y + 10))
-        back_button.draw(screen)
-        if selecting_custom_bullet_row:
-            select_text = font_medium.render("点击僵尸区域选择发射行", True, RED)
-            screen.blit(select_text, (TRIPLE_MATCH_WIDTH + 50, 10))
-        pygame.display.flip()
-        clock.tick(60)
+                        if buy_life_button.is_clicked(event.pos): session.buy_life()
+                        elif buy_turret_button.is_clicked(event.pos): session.buy_turret()
+                    if custom_bullet_button.is_clicked(event.pos) and session.can_fire_custom_bullet(): selecting_custom_bullet_row = True
+                    if shuffle_button.is_clicked(event.pos): session.shuffle()
+                    profiler.mark("events"); session.click(event.pos); profiler.mark("match")
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_h: session.triple_match.show_hint()
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_b: bot = None if bot else MatchBot(game_settings["bot_depth"], game_settings["bot_budget_ms"])
+            if event.type == pygame.VIDEOEXPOSE: renderer.invalidate()
+        profiler.mark("events")
+        for _ in range(timestep.advance()):
+            if bot: bot(session)
+            game_state = session.tick()
+            if game_state == GameState.GAME_OVER: finish_run('game_over'); return GameState.GAME_OVER, level_to_play
+            if game_state == GameState.LEVEL_COMPLETE:
+                elapsed_time = finish_run('complete')
+                return GameState.LEVEL_COMPLETE, level_to_play, elapsed_time, zombie_game.zombies_killed, session.matches_made
+        profiler.mark("update")
+        renderer.render(screen, (bot is not None, zombie_game.lives, zombie_game.score, zombie_game.zombies_killed, session.matches_made, session.bullet_storage, session.lives_purchased,
+                session.turret_purchased, cooldown_signature(session.life_purchase_cooldown), cooldown_signature(session.shuffle_cooldown),
+                cooldown_signature(session.custom_bullet_cooldown), selecting_custom_bullet_row), interpolation_alpha(timestep))
+        clock.tick(game_settings["fps"])
 
 def battle_mode_game_loop(username, level_to_play, endless=False):
     level_data = BATTLE_LEVELS[level_to_play - 1] if not endless else {"type": "kill", "target": float('inf'), "zombies": float('inf'), "spawn_rate": 120}
-    triple_match = TripleMatchGame(mode='battle')
-    zombie_game = ZombieGame(level_data)
-    zombie_game.lives = 15 # Battle mode has more lives
+    session = GameSession('battle', level_data, endless=endless, lives=15, record=True) # Battle mode has more lives
+    triple_match = session.triple_match; zombie_game = session.zombie_game
     clock = pygame.time.Clock()
-    start_time = pygame.time.get_ticks(); matches_made = 0
-    shuffle_cooldown = 0
-    game_settings["bullet_storage"] = 0 # Reset for battle mode
+    start_time = pygame.time.get_ticks()
     
     back_button = Button(SCREEN_WIDTH - 160, 10, 150, 40, "返回菜单", LIGHT_BLUE)
     shuffle_button = Button(20, 170, 200, 40, f"洗牌(15)", BLUE)
 
-    while True:
-        if shuffle_cooldown > 0: shuffle_cooldown -= 1
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT: return GameState.QUIT, level_to_play
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                if back_button.is_clicked(event.pos): return GameState.MAIN_MENU, level_to_play
-                if shuffle_button.is_clicked(event.pos) and game_settings["bullet_storage"] >= 15 and shuffle_cooldown == 0:
-                    game_settings["bullet_storage"] -= 15; shuffle_cooldown = 30 * 60; triple_match.initialize_grid()
-                result = triple_match.handle_click(event.pos)
-                if result and 'projectiles' in result:
-                    matches_made += result.get('matches_made', 0)
-                    game_settings["bullet_storage"] = min(game_settings["bullet_storage"] + result.get('ammo', 0), 50)
-                    if sounds['eliminate']: sounds['eliminate'].play()
-                    for p_info in result['projectiles']:
-                        grid_r, grid_c = p_info['pos']
-                        element_type = p_info['type']
-                        start_x = grid_c * triple_match.cell_size + triple_match.cell_size / 2
-                        start_y = (SCREEN_HEIGHT - TRIPLE_MATCH_HEIGHT) + grid_r * triple_match.cell_size + triple_match.cell_size / 2
-                        # Find which zombie row this corresponds to
-                        target_y = min(zombie_game.zombie_rows, key=lambda r: abs(r - start_y))
-                        # Create projectile starting from the right edge of the match grid, aligned with the row
-                        proj = Projectile(TRIPLE_MATCH_WIDTH, target_y, image=elements[element_type])
-                        zombie_game.projectiles.append(proj)
-        game_state = zombie_game.update()
-        if game_state == GameState.GAME_OVER: return GameState.GAME_OVER, level_to_play
-        if not endless and zombie_game.is_level_complete():
-            elapsed_time = (pygame.time.get_ticks() - start_time) // 1000
-            return GameState.LEVEL_COMPLETE, level_to_play, elapsed_time, zombie_game.zombies_killed, matches_made
-        screen.fill(LIGHT_GREEN)
-        triple_match.draw(screen)
-        zombie_game.draw(screen)
-        user_text = font_small.render(f"用户: {username}", True, BLACK); screen.blit(user_text, (20, 20))
-        mode_text = font_small.render("模式: 战斗", True, BLACK); screen.blit(mode_text, (20, 50))
-        lives_text = font_small.render(f"生命: {zombie_game.lives}", True, BLACK); screen.blit(lives_text, (20, 80))
+    bot = None
+    def draw_hud(surface):
+        user_text = text_cache.render(font_small, f"用户: {username}", True, BLACK); surface.blit(user_text, (20, 20))
+        if bot: surface.blit(text_cache.render(font_small, "机器人代打中（B键关闭）", True, RED), (250, 20))
+        mode_text = text_cache.render(font_small, "模式: 战斗", True, BLACK); surface.blit(mode_text, (20, 50))
+        lives_text = text_cache.render(font_small, f"生命: {zombie_game.lives}", True, BLACK); surface.blit(lives_text, (20, 80))
         if endless: objective_text = f"击杀: {zombie_game.zombies_killed}"
         else: objective_text = f"击杀: {zombie_game.zombies_killed}/{level_data['target']}"
-        score_text = font_small.render(objective_text, True, BLACK); screen.blit(score_text, (20, 110))
+        score_text = text_cache.render(font_small, objective_text, True, BLACK); surface.blit(score_text, (20, 110))
         # No bullet storage in this mode, but we need it for shuffle
-        storage_text = font_small.render(f"备弹: {game_settings['bullet_storage']}", True, BLACK); screen.blit(storage_text, (20, 140))
-        shuffle_button.draw(screen)
-        if shuffle_cooldown > 0:
-            cooldown_text = font_small.render(f"冷却: {shuffle_cooldown // 60}s", True, RED)
-            screen.blit(cooldown_text, (shuffle_button.rect.right + 5, shuffle_button.rect.y + 10))
-        back_button.draw(screen)
-        pygame.display.flip()
-        clock.tick(60)
+        storage_text = text_cache.render(font_small, f"备弹: {session.bullet_storage}", True, BLACK); surface.blit(storage_text, (20, 140))
+        shuffle_button.draw(surface)
+        if session.shuffle_cooldown > 0:
+            cooldown_text = text_cache.render(font_small, f"冷却: {session.shuffle_cooldown // TICK_RATE}s", True, RED)
+            surface.blit(cooldown_text, (shuffle_button.rect.right + 5, shuffle_button.rect.y + 10))
+        back_button.draw(surface)
+    def finish_run(outcome):
+        elapsed_time = (pygame.time.get_ticks() - start_time) // 1000
+        record_run(username, session, None if endless else level_to_play, outcome, elapsed_time); save_replay(session, None if endless else level_to_play, outcome)
+        return elapsed_time
+    renderer = LayeredRenderer(triple_match, zombie_game, draw_hud); timestep = FixedTimestep()
+    while True:
+        profiler.begin("battle", zombie_game)
+        for event in pygame.event.get():
+            if profiler.handle_event(event): continue
+            if event.type == pygame.QUIT: finish_run('abandoned'); return GameState.QUIT, level_to_play
+            if event.type == pygame.MOUSEBUTTONDOWN:
+                if back_button.is_clicked(event.pos): finish_run('abandoned'); return GameState.MAIN_MENU, level_to_play
+                if shuffle_button.is_clicked(event.pos): session.shuffle()
+                profiler.mark("events"); session.click(event.pos); profiler.mark("match")
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_h: session.triple_match.show_hint()
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_b: bot = None if bot else MatchBot(game_settings["bot_depth"], game_settings["bot_budget_ms"])
+            if event.type == pygame.VIDEOEXPOSE: renderer.invalidate()
+        profiler.mark("events")
+        for _ in range(timestep.advance()):
+            if bot: bot(session)
+            game_state = session.tick()
+            if game_state == GameState.GAME_OVER: finish_run('game_over'); return GameState.GAME_OVER, level_to_play
+            if game_state == GameState.LEVEL_COMPLETE:
+                elapsed_time = finish_run('complete')
+                return GameState.LEVEL_COMPLETE, level_to_play, elapsed_time, zombie_game.zombies_killed, session.matches_made
+        profiler.mark("update")
+        renderer.render(screen, (bot is not None, zombie_game.lives, zombie_game.zombies_killed, session.bullet_storage, cooldown_signature(session.shuffle_cooldown)), interpolation_alpha(timestep))
+        clock.tick(game_settings["fps"])
 
 def all_levels_complete_screen():
     back_button = Button(SCREEN_WIDTH // 2 - 100, SCREEN_HEIGHT - 200, 200, 50, "返回菜单", GREEN)
+    dirty = True
     while True:
-        for event in pygame.event.get():
+        profiler.begin("all_levels_complete")
+        for event in wait_for_events(0 if dirty else None):
+            if profiler.handle_event(event): dirty = True; continue
             if event.type == pygame.QUIT: return
+            if event.type == pygame.VIDEOEXPOSE: dirty = True
             if event.type == pygame.MOUSEBUTTONDOWN:
                 if back_button.is_clicked(event.pos): return
+        profiler.mark("events")
+        if not (dirty or profiler.overlay): continue
+        dirty = False
         screen.fill(WHITE)
-        title_text = font_large.render("恭喜！你已通关所有冒险关卡！", True, GREEN)
+        title_text = text_cache.render(font_large, "恭喜！你已通关所有冒险关卡！", True, GREEN)
         screen.blit(title_text, (SCREEN_WIDTH // 2 - title_text.get_width() // 2, 200))
         back_button.draw(screen)
-        pygame.display.flip()
+        present()
 
 def endless_game_loop(username, initial_lives=15, initial_score=0):
-    game_settings["bullet_storage"] = 0
-    triple_match = TripleMatchGame()
     endless_level_data = {"zombies": float('inf'), "spawn_rate": 180}
-    zombie_game = ZombieGame(endless_level_data)
-    zombie_game.lives = initial_lives; zombie_game.score = initial_score
+    session = GameSession('classic', endless_level_data, endless=True, lives=initial_lives, score=initial_score, record=True)
+    triple_match = session.triple_match; zombie_game = session.zombie_game
     clock = pygame.time.Clock()
     back_button = Button(SCREEN_WIDTH - 160, 10, 150, 40, "返回菜单", LIGHT_BLUE)
     buy_life_button = Button(20, 170, 200, 40, f"买命({game_settings['shop_costs']['life']})", BLUE)
     custom_bullet_button = Button(20, 220, 200, 40, f"自定义({game_settings['shop_costs']['custom_bullet']})", BLUE)
     buy_turret_button = Button(20, 270, 200, 40, f"炮台({game_settings['shop_costs']['turret']})", BLUE)
     shuffle_button = Button(20, 320, 200, 40, f"洗牌({game_settings['shop_costs']['shuffle']})", BLUE)
-    selecting_custom_bullet_row = False; turret_purchased = False; spawn_rate_timer = 0
-    custom_bullet_cooldown = 0; lives_purchased = 0; life_purchase_cooldown = 0; shuffle_cooldown = 0
+    selecting_custom_bullet_row = False
+    bot = None
+    def draw_hud(surface):
+        user_text = text_cache.render(font_small, f"用户: {username}", True, BLACK); surface.blit(user_text, (20, 20))
+        if bot: surface.blit(text_cache.render(font_small, "机器人代打中（B键关闭）", True, RED), (250, 20))
+        mode_text = text_cache.render(font_small, "模式: 无尽", True, BLACK); surface.blit(mode_text, (20, 50))
+        lives_text = text_cache.render(font_small, f"生命: {zombie_game.lives}", True, BLACK); surface.blit(lives_text, (20, 80))
+        score_text = text_cache.render(font_small, f"得分: {zombie_game.score}", True, BLACK); surface.blit(score_text, (20, 110))
+        storage_text = text_cache.render(font_small, f"备弹: {session.bullet_storage}", True, BLACK); surface.blit(storage_text, (20, 140))
+        buy_life_button.draw(surface)
+        if session.life_purchase_cooldown > 0:
+            cooldown_text = text_cache.render(font_small, f"冷却: {session.life_purchase_cooldown // TICK_RATE}s", True, RED)
+            surface.blit(cooldown_text, (buy_life_button.rect.right + 5, buy_life_button.rect.y + 10))
+        if session.lives_purchased >= 3:
+            limit_text = text_cache.render(font_small, "已达上限", True, RED)
+            surface.blit(limit_text, (buy_life_button.rect.right + 5, buy_life_button.rect.y + 10))
+        custom_bullet_button.draw(surface)
+        if session.custom_bullet_cooldown > 0:
+            cooldown_text = text_cache.render(font_small, f"冷却: {session.custom_bullet_cooldown // TICK_RATE}s", True, RED)
+            surface.blit(cooldown_text, (custom_bullet_button.rect.right + 5, custom_bullet_button.rect.y + 10))
+        buy_turret_button.color = GRAY if session.turret_purchased else BLUE; buy_turret_button.draw(surface)
+        shuffle_button.draw(surface)
+        if session.shuffle_cooldown > 0:
+            cooldown_text = text_cache.render(font_small, f"冷却: {session.shuffle_cooldown // TICK_RATE}s", True, RED)
+            surface.blit(cooldown_text, (shuffle_button.rect.right + 5, shuffle_button.rect.y + 10))
+        back_button.draw(surface)
+        if selecting_custom_bullet_row:
+            select_text = text_cache.render(font_medium, "点击僵尸区域选择发射行", True, RED)
+            surface.blit(select_text, (TRIPLE_MATCH_WIDTH + 50, 10))
+    def finish_run(outcome):
+        # 复活后接着玩是新的一局，分数从复活前累计
+        record_run(username, session, None, outcome); save_replay(session, None, outcome)
+    renderer = LayeredRenderer(triple_match, zombie_game, draw_hud); timestep = FixedTimestep()
     while True:
-        if custom_bullet_cooldown > 0: custom_bullet_cooldown -= 1
-        if life_purchase_cooldown > 0: life_purchase_cooldown -= 1
-        if shuffle_cooldown > 0: shuffle_cooldown -= 1
+        profiler.begin("endless", zombie_game)
         for event in pygame.event.get():
-            if event.type == pygame.QUIT: return GameState.QUIT, zombie_game.score
+            if profiler.handle_event(event): continue
+            if event.type == pygame.QUIT: finish_run('abandoned'); return GameState.QUIT, zombie_game.score
             if event.type == pygame.MOUSEBUTTONDOWN:
-                if back_button.is_clicked(event.pos): return GameState.MAIN_MENU, zombie_game.score
+                if back_button.is_clicked(event.pos): finish_run('abandoned'); return GameState.MAIN_MENU, zombie_game.score
                 if selecting_custom_bullet_row:
-                    if event.pos[0] > TRIPLE_MATCH_WIDTH:
-                        zombie_game.shoot_custom_projectile(event.pos[1]); game_settings["bullet_storage"] -= game_settings['shop_costs']['custom_bullet']; custom_bullet_cooldown = 45 * 60; selecting_custom_bullet_row = False
-                    else: selecting_custom_bullet_row = False
+                    if event.pos[0] > TRIPLE_MATCH_WIDTH: session.fire_custom_bullet(event.pos[1])
+                    selecting_custom_bullet_row = False
                 else:
-                    if buy_life_button.is_clicked(event.pos) and game_settings["bullet_storage"] >= game_settings['shop_costs']['life'] and lives_purchased < 3 and life_purchase_cooldown == 0:
-                        game_settings["bullet_storage"] -= game_settings['shop_costs']['life']; zombie_game.lives += 1; lives_purchased += 1; life_purchase_cooldown = 60 * 60
-                    elif custom_bullet_button.is_clicked(event.pos) and game_settings["bullet_storage"] >= game_settings['shop_costs']['custom_bullet'] and custom_bullet_cooldown == 0: selecting_custom_bullet_row = True
-                    elif buy_turret_button.is_clicked(event.pos) and not turret_purchased and game_settings["bullet_storage"] >= game_settings['shop_costs']['turret']:
-                        game_settings["bullet_storage"] -= game_settings['shop_costs']['turret']; turret_purchased = True; zombie_game.turrets.append(AutoTurret(TRIPLE_MATCH_WIDTH + 50, SCREEN_HEIGHT // 2 - 25))
-                    elif shuffle_button.is_clicked(event.pos) and game_settings["bullet_storage"] >= game_settings['shop_costs']['shuffle'] and shuffle_cooldown == 0:
-                        game_settings["bullet_storage"] -= game_settings['shop_costs']['shuffle']; shuffle_cooldown = 30 * 60; triple_match.initialize_grid()
-                    else:
-                        result = triple_match.handle_click(event.pos)
-                        if result:
-                            game_settings["bullet_storage"] = min(game_settings["bullet_storage"] + result.get('ammo', 0), 50)
-                            for _ in range(result.get('bullets', 0)): zombie_game.shoot_projectile()
-        spawn_rate_timer += 1
-        if spawn_rate_timer > 600 and zombie_game.level_data["spawn_rate"] > 45:
-            zombie_game.level_data["spawn_rate"] = max(45, zombie_game.level_data["spawn_rate"] - 5); spawn_rate_timer = 0
-        game_status = zombie_game.update()
-        if game_status == GameState.GAME_OVER: return GameState.ENDLESS_GAMEOVER, zombie_game.score
-        screen.fill(LIGHT_GREEN)
-        triple_match.draw(screen)
-        zombie_game.draw(screen)
-        user_text = font_small.render(f"用户: {username}", True, BLACK); screen.blit(user_text, (20, 20))
-        mode_text = font_small.render("模式: 无尽", True, BLACK); screen.blit(mode_text, (20, 50))
-        lives_text = font_small.render(f"生命: {zombie_game.lives}", True, BLACK); screen.blit(lives_text, (20, 80))
-        score_text = font_small.render(f"得分: {zombie_game.score}", True, BLACK); screen.blit(score_text, (20, 110))
-        storage_text = font_small.render(f"备弹: {game_settings['bullet_storage']}", True, BLACK); screen.blit(storage_text, (20, 140))
-        buy_life_button.draw(screen)
-        if life_purchase_cooldown > 0:
-            cooldown_text = font_small.render(f"冷却: {life_purchase_cooldown // 60}s", True, RED)
-            screen.blit(cooldown_text, (buy_life_button.rect.right + 5, buy_life_button.rect.y + 10))
-        if lives_purchased >= 3:
-            limit_text = font_small.render("已达上限", True, RED)
-            screen.blit(limit_text, (buy_life_button.rect.right + 5, buy_life_button.rect.y + 10))
-        custom_bullet_button.draw(screen)
-        if custom_bullet_cooldown > 0:
-            cooldown_text = font_small.render(f"冷却: {custom_bullet_cooldown // 60}s", True, RED)
-            screen.blit(cooldown_text, (custom_bullet_button.rect.right + 5, custom_bullet_button.rect.y + 10))
-        buy_turret_button.color = GRAY if turret_purchased else BLUE; buy_turret_button.draw(screen)
-        shuffle_button.draw(screen)
-        if shuffle_cooldown > 0:
-            cooldown_text = font_small.render(f"冷却: {shuffle_cooldown // 60}s", True, RED)
-            screen.blit(cooldown_text, (shuffle_button.rect.right + 5, shuffle_button.rect.y + 10))
-        back_button.draw(screen)
-        if selecting_custom_bullet_row:
-            select_text = font_medium.render("点击僵尸区域选择发射行", True, RED)
-            screen.blit(select_text, (TRIPLE_MATCH_WIDTH + 50, 10))
-        pygame.display.flip()
-        clock.tick(60)
+                    if buy_life_button.is_clicked(event.pos): session.buy_life()
+                    elif custom_bullet_button.is_clicked(event.pos):
+                        if session.can_fire_custom_bullet(): selecting_custom_bullet_row = True
+                    elif buy_turret_button.is_clicked(event.pos): session.buy_turret()
+                    elif shuffle_button.is_clicked(event.pos): session.shuffle()
+                    else: profiler.mark("events"); session.click(event.pos); profiler.mark("match")
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_h: session.triple_match.show_hint()
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_b: bot = None if bot else MatchBot(game_settings["bot_depth"], game_settings["bot_budget_ms"])
+            if event.type == pygame.VIDEOEXPOSE: renderer.invalidate()
+        profiler.mark("events")
+        for _ in range(timestep.advance()):
+            if bot: bot(session)
+            if session.tick() == GameState.GAME_OVER: finish_run('game_over'); return GameState.ENDLESS_GAMEOVER, zombie_game.score
+        profiler.mark("update")
+        renderer.render(screen, (bot is not None, zombie_game.lives, zombie_game.score, session.bullet_storage, session.lives_purchased, session.turret_purchased,
+                cooldown_signature(session.life_purchase_cooldown), cooldown_signature(session.shuffle_cooldown),
+                cooldown_signature(session.custom_bullet_cooldown), selecting_custom_bullet_row), interpolation_alpha(timestep))
+        clock.tick(game_settings["fps"])
+
+def transcoded_video_path(video_path):
+    """ 视频转码缓存的路径：屏幕分辨率、MJPG编码的AVI """
+    name = os.path.splitext(os.path.basename(video_path))[0]
+    return os.path.join(game_settings["video_cache_dir"], f"{name}_{SCREEN_WIDTH}x{SCREEN_HEIGHT}.avi")
+
+def cached_video(video_path):
+    """ 转码缓存存在且不比原视频旧时返回缓存路径，否则返回原路径 """
+    cache_path = transcoded_video_path(video_path)
+    try:
+        if os.path.getmtime(cache_path) >= os.path.getmtime(video_path): return cache_path
+    except OSError: pass
+    return video_path
+
+def transcode_video(video_path):
+    """ 把视频缩放到屏幕分辨率并重新编码成MJPG（逐帧独立压缩，解码便宜），先写临时文件再替换，播放时不会读到半个文件。
+    打不开视频或编码器、一帧都没写出、或者写出的帧比视频记录的帧数少一成以上时删掉临时文件返回None，不留缓存 """
+    cache_path = transcoded_video_path(video_path)
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    temp_path = cache_path + ".part.avi"
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened(): capture.release(); return None
+    fps = capture.get(cv2.CAP_PROP_FPS); expected = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    writer = cv2.VideoWriter(temp_path, cv2.VideoWriter_fourcc(*"MJPG"), fps if fps > 0 else 30.0, (SCREEN_WIDTH, SCREEN_HEIGHT))
+    written = 0
+    try:
+        while writer.isOpened():
+            ret, frame = capture.read()
+            if not ret: break
+            writer.write(cv2.resize(frame, (SCREEN_WIDTH, SCREEN_HEIGHT), interpolation=cv2.INTER_AREA)); written += 1
+    finally:
+        capture.release(); writer.release()
+    if written == 0 or written < expected * 0.9:
+        try: os.remove(temp_path)
+        except OSError: pass
+        return None
+    os.replace(temp_path, cache_path)
+    return cache_path
+
+_transcode_thread = None
+
+def prepare_video(video_path):
+    """ 需要时在后台线程转码一次；转码还没完成时播放照常使用原视频 """
+    global _transcode_thread
+    if not game_settings["video_transcode"] or not os.path.exists(video_path) or cached_video(video_path) != video_path: return
+    if _transcode_thread and _transcode_thread.is_alive(): return
+    def run():
+        if not load_opencv(): return
+        try:
+            if transcode_video(video_path) is None: print(f"视频转码失败，继续使用原视频: {video_path}")
+        except Exception as e: print(f"视频转码失败: {e}")
+    _transcode_thread = threading.Thread(target=run, name="video-transcode", daemon=True)
+    _transcode_thread.start()
 
 def play_video_screen(video_path, audio_path):
+    video_path = cached_video(video_path)
     # 优先使用OpenCV播放视频
-    if OPENCV_AVAILABLE:
+    if load_opencv():
         return play_video_with_opencv(video_path, audio_path)
-    elif MOVIEPY_AVAILABLE:
+    elif load_moviepy():
         return play_video_with_moviepy(video_path)
     else:
         print("未安装视频播放库。请运行 'pip install opencv-python' 或 'pip install moviepy' 进行安装。")
         return True
 
+# 视频解码线程：读帧和缩放都在后台做（OpenCV这几步会释放GIL），帧直接写进预先分配的环形缓冲，
+# 每块缓冲上事先包好一个BGR格式的Surface（frombuffer不拷贝像素），队列里只传显示时间戳和缓冲编号，
+# 播放过程中不再为每帧分配数组或Surface。主线程只负责按时钟取帧显示和处理输入
+class VideoDecoder:
+    def __init__(self, capture, size, max_frames=8):
+        self.capture = capture
+        self.size = size
+        load_numpy()
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if fps > 0 else 30.0  # 读不到帧率时按30fps
+        # 同时在用的缓冲最多是队列里的max_frames块，加上正在写、待显示、正在显示的各一块；
+        # 空闲的缓冲编号放在free_slots里，主线程显示完或丢掉一帧后用release()交还
+        self.buffers = [np.empty((size[1], size[0], 3), np.uint8) for _ in range(max_frames + 3)]
+        self.free_slots = queue.Queue()
+        for slot in range(len(self.buffers)): self.free_slots.put(slot)
+        self.surfaces = [pygame.image.frombuffer(buffer, size, "BGR") for buffer in self.buffers]
+        self.raw = None
+        self.frames = queue.Queue(max_frames)
+        self.clock = 0.0  # 主线程每轮写入当前播放时间，落后超过一帧的帧只 grab 不转换
+        self.skipped = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="video-decoder", daemon=True)
+    def start(self):
+        self.thread.start()
+        return self
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try: self.frames.put(item, timeout=0.1); return
+            except queue.Full: continue
+    def _take_slot(self):
+        while not self.stopped.is_set():
+            try: return self.free_slots.get(timeout=0.1)
+            except queue.Empty: continue
+        return None
+    def release(self, slot):
+        self.free_slots.put(slot)
+    def _run(self):
+        index = 0
+        while not self.stopped.is_set():
+            if index / self.fps < self.clock - 1 / self.fps:
+                if not self.capture.grab(): break
+                self.skipped += 1; index += 1
+                continue
+            slot = self._take_slot()
+            if slot is None: break
+            ret, self.raw = self.capture.read(self.raw)
+            if not ret: self.release(slot); break
+            # 转码缓存已经是屏幕分辨率，直接拷进缓冲；否则缩放结果直接写进缓冲
+            if self.raw.shape == self.buffers[slot].shape: self.buffers[slot][...] = self.raw
+            else: cv2.resize(self.raw, self.size, dst=self.buffers[slot])
+            self._put((index / self.fps, slot)); index += 1
+        self._put(None)  # 结束标记
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.capture.release()
+
 def play_video_with_opencv(video_path, audio_path):
-    """使用OpenCV播放视频并播放对应的音频"""
+    """使用OpenCV播放视频并播放对应的音频；画面按配音的播放进度显示，赶不上的帧直接丢掉"""
     revived = False
     skip_input = ""
+    decoder = None
     
     try:
-        # 停止背景音乐
-        pygame.mixer.music.stop()
-        
-        # 开始播放指定的音频文件
-        if os.path.exists(audio_path):
-            pygame.mixer.music.load(audio_path)
-            pygame.mixer.music.set_volume(game_settings["music_volume"])
-            pygame.mixer.music.play()
-        
-        # 打开视频文件
-        cap = cv2.VideoCapture(video_path)
-        
-        # 获取视频的帧率
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        delay = int(1000 / fps) if fps > 0 else 33  # 默认约30fps
+        # 视频配音换下背景音乐流式播放，看完视频后背景音乐从原来的位置继续；没有配音时只暂停背景音乐
+        if os.path.exists(audio_path): audio.play_track(audio_path)
+        else: audio.pause_music()
+        clock_start = time.perf_counter()
         
-        # 获取视频的总帧数
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        decoder = VideoDecoder(cv2.VideoCapture(video_path), (SCREEN_WIDTH, SCREEN_HEIGHT)).start()
+        clock = pygame.time.Clock()
+        next_frame = None; decoded_all = False; now = shown_until = 0.0; dropped = 0
         
-        frame_count = 0
-        
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            frame_count += 1
-            
-            # 调整帧大小以适应屏幕
-            frame = cv2.resize(frame, (SCREEN_WIDTH, SCREEN_HEIGHT))
-            
-            # 将BGR格式转换为RGB格式
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            
-            # 转换为Pygame Surface
-            frame_surface = pygame.surfarray.make_surface(frame_rgb.swapaxes(0, 1))
-            
-            # 在屏幕上绘制帧
-            screen.blit(frame_surface, (0, 0))
-            pygame.display.flip()
-            
-            # 处理事件
+        # 解码完、队列取空并且最后一帧显示满一帧的时长后结束
+        while not (decoded_all and next_frame is None and now >= shown_until):
+            # 每轮都处理输入，跳过口令不用等下一帧
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
-                    revived = False
-                    break
+                    return False  # 用户关闭窗口，未复活
                 if event.type == pygame.KEYDOWN:
                     char = pygame.key.name(event.key).lower()
                     if len(char) == 1:
@@ -944,90 +2507,105 @@ def play_video_with_opencv(video_path, audio_path):
                             revived = True
                         if len(skip_input) > 10:
                             skip_input = skip_input[-10:]
-            
-            if not revived:
-                # 控制播放速度
-                pygame.time.delay(delay)
-            else:
+            if revived:
                 break
+            
+            # 以配音播放进度为准（配音缺失或已放完时用墙钟），取出所有已到时间的帧，只显示最新的一帧
+            now = audio.track_time()
+            if now is None: now = time.perf_counter() - clock_start
+            decoder.clock = now
+            due = None
+            while not decoded_all:
+                if next_frame is None:
+                    try: next_frame = decoder.frames.get_nowait()
+                    except queue.Empty: break
+                    if next_frame is None: decoded_all = True; break
+                if next_frame[0] > now: break
+                if due is not None: decoder.release(due[1]); dropped += 1
+                due = next_frame; next_frame = None
+            if due is not None:
+                screen.blit(decoder.surfaces[due[1]], (0, 0))
+                pygame.display.flip()
+                decoder.release(due[1])  # 画面已经拷到屏幕上，缓冲可以交还给解码线程
+                shown_until = due[0] + 1 / decoder.fps
+            clock.tick(120)
         
-        # 释放视频捕获对象
-        cap.release()
-        
-        # 如果不是用户主动关闭，则视为复活
-        if not revived:
-            revived = True
+        # 视频正常播放结束或被跳过，都视为复活
+        revived = True
+        if dropped or decoder.skipped: print(f"视频播放丢弃了 {dropped + decoder.skipped} 帧")
             
     except Exception as e:
         print(f"使用 OpenCV 播放视频失败: {e}")
         revived = True  # 如果播放失败，也算作复活，避免卡住玩家
     finally:
-        # 停止当前音频
-        pygame.mixer.music.stop()
-        
-        # 恢复背景音乐
-        try:
-            pygame.mixer.music.load(resource_path('ogg/bjyy.mp3'))
-            pygame.mixer.music.set_volume(game_settings["music_volume"])
-            pygame.mixer.music.play(-1)
-        except Exception as e:
-            print(f"无法重新加载背景音乐: {e}")
+        if decoder: decoder.stop()
+        # 停止视频配音，恢复背景音乐
+        if audio.track_playing: audio.end_track()
+        else: audio.resume_music()
     
     return revived
 
 # 保留原有的实现作为备选方案
 def play_video_with_moviepy(video_path):
     """使用moviepy播放视频（原有实现）"""
-    if not MOVIEPY_AVAILABLE:
+    if not load_moviepy():
         print("MoviePy 未安装，跳过视频播放。请运行 'pip install moviepy' 进行安装。")
         return True
+    load_numpy()
 
     revived = False
     skip_input = ""
     clip = None
+    mixer_reset = False
     
     try:
-        # 停止背景音乐
-        pygame.mixer.music.stop()
+        # 暂停背景音乐
+        audio.pause_music()
 
         clip = VideoFileClip(video_path)
         
         # 播放视频音频
         if clip.audio:
+            mixer_reset = True  # preview会退出并重新初始化混音器
             clip.audio.preview(fps=22050)
 
         start_time = pygame.time.get_ticks()
-        duration_ms = clip.duration * 1000
+        fps = clip.fps or 30
+        # 缩放结果写进同一个Surface（第一帧时按帧的像素格式创建），不为每帧新建
+        scaled_surface = None; dropped = False
         
-        # 视频播放循环
-        while (pygame.time.get_ticks() - start_time) < duration_ms:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    if clip: clip.close()
-                    return False # 用户关闭窗口，未复活
-                if event.type == pygame.KEYDOWN:
-                    char = pygame.key.name(event.key).lower()
-                    if len(char) == 1:
-                        skip_input += char
-                        if skip_input.endswith("iamsb"):
-                            revived = True
-                        if len(skip_input) > 10:
-                            skip_input = skip_input[-10:]
+        # 视频播放循环：顺序解码每一帧（不再按时间seek），落后超过一帧的帧不上传不缩放（但不连续丢两帧），提前的帧等到时间再显示
+        for index, frame in enumerate(clip.iter_frames(fps=fps, dtype="uint8")):
+            frame_ms = index * 1000 / fps
+            while True:
+                for event in pygame.event.get():
+                    if event.type == pygame.QUIT:
+                        return False # 用户关闭窗口，未复活
+                    if event.type == pygame.KEYDOWN:
+                        char = pygame.key.name(event.key).lower()
+                        if len(char) == 1:
+                            skip_input += char
+                            if skip_input.endswith("iamsb"):
+                                revived = True
+                            if len(skip_input) > 10:
+                                skip_input = skip_input[-10:]
+                if revived or pygame.time.get_ticks() - start_time >= frame_ms: break
+                pygame.time.wait(5)
             
             if revived:
                 break
-
-            # 获取当前时间的视频帧
-            current_time_sec = (pygame.time.get_ticks() - start_time) / 1000.0
-            if current_time_sec > clip.duration:
-                break
-                
-            frame = clip.get_frame(current_time_sec)
+            if not dropped and pygame.time.get_ticks() - start_time > frame_ms + 1000 / fps:
+                dropped = True
+                continue
+            dropped = False
             
-            # 转换帧为Pygame Surface并显示
-            frame_surface = pygame.surfarray.make_surface(frame.swapaxes(0, 1))
-            scaled_surface = pygame.transform.scale(frame_surface, (SCREEN_WIDTH, SCREEN_HEIGHT))
-            screen.blit(scaled_surface, (0, 0))
+            # frombuffer直接引用解码出的像素，不拷贝
+            frame = np.ascontiguousarray(frame)
+            frame_surface = pygame.image.frombuffer(frame, (frame.shape[1], frame.shape[0]), "RGB")
+            if frame_surface.get_size() == (SCREEN_WIDTH, SCREEN_HEIGHT): screen.blit(frame_surface, (0, 0))
+            else:
+                if scaled_surface is None: scaled_surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), 0, frame_surface)
+                screen.blit(pygame.transform.scale(frame_surface, (SCREEN_WIDTH, SCREEN_HEIGHT), scaled_surface), (0, 0))
             pygame.display.flip()
 
         # 视频正常播放结束或被跳过，都视为复活
@@ -1044,43 +2622,106 @@ def play_video_with_moviepy(video_path):
                 clip.audio.close()
             clip.close()
         
-        # 恢复背景音乐
-        try:
-            pygame.mixer.music.load(resource_path('ogg/bjyy.mp3'))
-            pygame.mixer.music.set_volume(game_settings["music_volume"])
-            pygame.mixer.music.play(-1)
-        except Exception as e:
-            print(f"无法重新加载背景音乐: {e}")
+        # 恢复背景音乐；混音器被preview重新初始化过时，原来的音乐和通道池都已失效，重建通道池并从头播放
+        if not mixer_reset: audio.resume_music()
+        elif pygame.mixer.get_init():
+            audio.setup(); audio.music_paused = False
+            play_background_music()
     
     return revived
 
 
+RUN_OUTCOME_NAMES = {'complete': "通关", 'game_over': "失败", 'abandoned': "退出", 'migrated': "旧记录"}
+
+def leaderboard_screen(username):
+    """ 排行榜：查询在历史记录的后台线程里执行，结果出来之前显示"加载中" """
+    def endless_rows(rows): return [f"{i}. {name}    {best}" for i, (name, best) in enumerate(rows, 1)]
+    def level_time_rows(rows): return [f"第{level}关    {name}    {seconds}秒" for level, name, seconds in rows]
+    def recent_rows(rows):
+        lines = []
+        for mode, level, endless, outcome, score, elapsed_time, played_at in rows:
+            where = "无尽" if endless else f"第{level}关"
+            lines.append(f"{time.strftime('%m-%d %H:%M', time.localtime(played_at))}  {'战斗' if mode == 'battle' else '经典'}{where}  {RUN_OUTCOME_NAMES.get(outcome, outcome)}  得分{score}")
+        return lines
+    tabs = [("无尽排行", lambda: run_history.top_endless_scores('classic', 20), endless_rows),
+            ("战斗无尽", lambda: run_history.top_endless_scores('battle', 20), endless_rows),
+            ("关卡最快", lambda: run_history.best_level_times('classic'), level_time_rows),
+            ("我的记录", lambda: run_history.recent_runs(username, 20), recent_rows)]
+    tab_buttons = [Button(130 + i * 240, 120, 220, 50, title, LIGHT_BLUE) for i, (title, _, _) in enumerate(tabs)]
+    back_button = Button(SCREEN_WIDTH // 2 - 100, SCREEN_HEIGHT - 90, 200, 50, "返回菜单", GREEN)
+    current_tab = 0; future = None; lines = None; dirty = True
+    while True:
+        if run_history and future is None: future = tabs[current_tab][1](); lines = None
+        if future is not None and lines is None and future.done():
+            try: lines = tabs[current_tab][2](future.result())
+            except Exception as e: lines = [f"读取记录失败: {e}"]
+            dirty = True
+        profiler.begin("leaderboard")
+        # 查询还没返回时每50毫秒醒一次看结果，之后只等输入
+        for event in wait_for_events(0 if dirty else 0.05 if future is not None and lines is None else None):
+            if profiler.handle_event(event): dirty = True; continue
+            if event.type == pygame.QUIT: return GameState.QUIT
+            if event.type == pygame.VIDEOEXPOSE: dirty = True
+            if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                if back_button.is_clicked(event.pos): return GameState.MAIN_MENU
+                for i, button in enumerate(tab_buttons):
+                    if button.is_clicked(event.pos) and i != current_tab: current_tab = i; future = None; dirty = True
+        profiler.mark("events")
+        if not (dirty or profiler.overlay): continue
+        dirty = False
+        screen.fill(WHITE)
+        title_text = text_cache.render(font_large, "排行榜", True, BLACK)
+        screen.blit(title_text, (SCREEN_WIDTH // 2 - title_text.get_width() // 2, 40))
+        for i, button in enumerate(tab_buttons):
+            button.color = GREEN if i == current_tab else LIGHT_BLUE; button.draw(screen)
+        if not run_history: message = "未启用历史记录"
+        elif lines is None: message = "加载中..."
+        elif not lines: message = "暂无记录"
+        else: message = None
+        if message:
+            message_text = text_cache.render(font_medium, message, True, GRAY)
+            screen.blit(message_text, (SCREEN_WIDTH // 2 - message_text.get_width() // 2, 300))
+        else:
+            # 每列最多12行，超过时分成两列
+            for i, line in enumerate(lines[:24]):
+                line_text = text_cache.render(font_small, line, True, BLACK)
+                screen.blit(line_text, (130 + (i // 12) * 500, 200 + (i % 12) * 38))
+        back_button.draw(screen)
+        present()
+
 def level_complete_screen(level, elapsed_time=0, zombies_killed=0, matches_made=0):
     continue_button = Button(SCREEN_WIDTH // 2 - 100, SCREEN_HEIGHT - 200, 200, 50, "继续", GREEN)
+    dirty = True
     while True:
-        for event in pygame.event.get():
+        profiler.begin("level_complete")
+        for event in wait_for_events(0 if dirty else None):
+            if profiler.handle_event(event): dirty = True; continue
             if event.type == pygame.QUIT: return GameState.QUIT
+            if event.type == pygame.VIDEOEXPOSE: dirty = True
             if event.type == pygame.MOUSEBUTTONDOWN:
                 if continue_button.is_clicked(event.pos): return GameState.PLAYING
+        profiler.mark("events")
+        if not (dirty or profiler.overlay): continue
+        dirty = False
         screen.fill(WHITE)
-        title_text = font_large.render(f"关卡 {level} 完成!", True, GREEN)
+        title_text = text_cache.render(font_large, f"关卡 {level} 完成!", True, GREEN)
         screen.blit(title_text, (SCREEN_WIDTH // 2 - title_text.get_width() // 2, 100))
-        time_text = font_medium.render(f"用时: {elapsed_time} 秒", True, BLACK)
+        time_text = text_cache.render(font_medium, f"用时: {elapsed_time} 秒", True, BLACK)
         screen.blit(time_text, (SCREEN_WIDTH // 2 - time_text.get_width() // 2, 200))
-        zombies_text = font_medium.render(f"击败僵尸: {zombies_killed} 个", True, BLACK)
+        zombies_text = text_cache.render(font_medium, f"击败僵尸: {zombies_killed} 个", True, BLACK)
         screen.blit(zombies_text, (SCREEN_WIDTH // 2 - zombies_text.get_width() // 2, 250))
-        matches_text = font_medium.render(f"完成三消: {matches_made} 次", True, BLACK)
+        matches_text = text_cache.render(font_medium, f"完成三消: {matches_made} 次", True, BLACK)
         screen.blit(matches_text, (SCREEN_WIDTH // 2 - matches_text.get_width() // 2, 300))
         continue_button.draw(screen)
-        pygame.display.flip()
+        present()
 
 def main():
-    pygame.mixer.init()
-    try:
-        pygame.mixer.music.load(resource_path('ogg/bjyy.mp3'))
-        pygame.mixer.music.set_volume(game_settings["music_volume"])
-        pygame.mixer.music.play(-1)
-    except pygame.error as e: print(f"加载背景音乐失败: {e}")
+    global asset_loader
+    startup_timer.mark("import")
+    init_display(preload=False)
+    pygame.mixer.init(); audio.setup()
+    asset_loader = startup_assets().start()
+    open_run_history()
     game_state = GameState.SPLASH_SCREEN
     username = None; max_unlocked_level = 1; selected_level = 1
     endless_lives = 15; endless_score = 0; level_stats = {}
@@ -1089,28 +2730,26 @@ def main():
             game_state = splash_screen()
         elif game_state == GameState.VERSION_INFO:
             game_state = version_info_screen()
+            # 资源全部就绪后才进入账号选择和游戏
+            if game_state != GameState.QUIT and not loading_screen(): game_state = GameState.QUIT
         elif game_state == GameState.ACCOUNT_SELECTION:
             username, game_state = account_selection_screen()
-            if username:
-                user_data = load_user_data()
-                max_unlocked_level = user_data.get(username, {}).get("level", 1)
+            if username: max_unlocked_level = profile_store.get(username).get("level", 1)
         elif game_state == GameState.MAIN_MENU:
-            menu_result = main_menu_screen(username, max_unlocked_level)
-            if isinstance(menu_result, tuple):
-                game_state, max_unlocked_level, _ = menu_result
-            else:
-                game_state = menu_result
+            game_state, max_unlocked_level, _ = menu_scenes.run(GameState.MAIN_MENU, username=username, current_level=max_unlocked_level)
             if game_state == GameState.ENDLESS_PLAYING:
                 endless_lives = 15
         elif game_state == GameState.CLASSIC_MODE_SELECTION:
-            game_state, _ = classic_mode_selection_screen(max_unlocked_level)
+            game_state, _ = menu_scenes.run(game_state, current_level=max_unlocked_level)
         elif game_state == GameState.BATTLE_MODE_SELECTION:
-            game_state, _ = battle_mode_selection_screen(max_unlocked_level)
+            game_state, _ = menu_scenes.run(game_state, current_level=max_unlocked_level)
+        elif game_state == GameState.LEADERBOARD:
+            game_state = leaderboard_screen(username)
         elif game_state == GameState.LEVEL_SELECTION:
-            game_state, selected_level = level_selection_screen(max_unlocked_level, levels_data=LEVELS, mode_title="选择关卡", back_state=GameState.CLASSIC_MODE_SELECTION)
+            game_state, selected_level = menu_scenes.run(game_state, max_unlocked_level=max_unlocked_level)
         elif game_state == GameState.BATTLE_LEVEL_SELECTION:
             # Battle mode has progressive level unlocking
-            game_state, selected_level = level_selection_screen(max_unlocked_level, levels_data=BATTLE_LEVELS, mode_title="选择战斗关卡", back_state=GameState.BATTLE_MODE_SELECTION)
+            game_state, selected_level = menu_scenes.run(game_state, max_unlocked_level=max_unlocked_level)
         elif game_state == GameState.PLAYING:
             result = game_loop(username, selected_level)
             if len(result) > 2:
@@ -1126,6 +2765,7 @@ def main():
         elif game_state == GameState.BATTLE_MODE_ENDLESS_PLAYING:
             game_state, _ = battle_mode_game_loop(username, 1, endless=True)
         elif game_state == GameState.ENDLESS_PLAYING:
+            prepare_video(resource_path('ogg/deee.mp4'))
             game_state, endless_score = endless_game_loop(username, endless_lives, endless_score)
         elif game_state == GameState.ENDLESS_GAMEOVER:
             video_p = resource_path('ogg/deee.mp4'); audio_p = resource_path('ogg/deee.mp3')
@@ -1135,9 +2775,7 @@ def main():
         elif game_state == GameState.LEVEL_COMPLETE:
             if selected_level == max_unlocked_level and max_unlocked_level < len(LEVELS):
                 max_unlocked_level += 1
-                user_data = load_user_data()
-                user_data[username]["level"] = max_unlocked_level
-                save_user_data(user_data)
+                profile_store.update(username, level=max_unlocked_level)
             if selected_level >= len(LEVELS):
                 all_levels_complete_screen(); game_state = GameState.MAIN_MENU
             else:
@@ -1145,19 +2783,47 @@ def main():
                 if game_state == GameState.PLAYING: selected_level += 1
                 else: game_state = GameState.MAIN_MENU
         elif game_state == GameState.GAME_OVER:
-            user_data = load_user_data()
-            if username in user_data:
-                best_score = user_data[username].get("best_score", 0)
-                if endless_score > best_score: user_data[username]["best_score"] = endless_score; save_user_data(user_data)
+            if username in profile_store.users():
+                best_score = profile_store.get(username).get("best_score", 0)
+                if endless_score > best_score: profile_store.update(username, best_score=endless_score)
             endless_score = 0
             screen.fill(BLACK)
-            lose_text = font_large.render("游戏结束", True, RED)
+            lose_text = text_cache.render(font_large, "游戏结束", True, RED)
             screen.blit(lose_text, (SCREEN_WIDTH//2 - lose_text.get_width()//2, SCREEN_HEIGHT//2 - 50))
             pygame.display.flip()
             pygame.time.wait(2000)
             game_state = GameState.MAIN_MENU
+    profile_store.flush()
+    if run_history: run_history.close()
     pygame.quit()
     sys.exit()
 
 if __name__ == "__main__":
-    main()
+    if "--headless" in sys.argv:
+        import argparse
+        parser = argparse.ArgumentParser(description="无界面模拟一局游戏")
+        def grid_size_arg(text):
+            value = int(text)
+            if not 3 <= value <= MAX_GRID_SIZE: raise argparse.ArgumentTypeError(f"盘面边长必须在3到{MAX_GRID_SIZE}之间")
+            return value
+        parser.add_argument("--headless", action="store_true")
+        parser.add_argument("--mode", choices=["classic", "battle"], default="classic")
+        parser.add_argument("--level", type=int, default=1)
+        parser.add_argument("--endless", action="store_true")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--ticks", type=int, default=100000)
+        parser.add_argument("--entity-store", choices=["objects", "array"], default="objects")
+        parser.add_argument("--grid-size", type=grid_size_arg, metavar="N", help=f"三消盘面边长（默认8，3到{MAX_GRID_SIZE}）")
+        parser.add_argument("--tile-types", type=int, choices=range(3, MAX_TILE_TYPES + 1), metavar="N", help=f"元素种类数（默认3，3到{MAX_TILE_TYPES}）")
+        parser.add_argument("--replay", help="重放录像文件（replays/*.json），忽略其他参数")
+        parser.add_argument("--bot", action="store_true", help="用搜索走法的机器人代替随机交换")
+        parser.add_argument("--bot-depth", type=int, default=2, help="机器人向后看的步数")
+        parser.add_argument("--bot-budget-ms", type=float, default=0, help="机器人每步的思考时间上限（毫秒），0为不限时（结果可复现）")
+        parser.add_argument("--bot-interval", type=int, default=30, help="机器人每隔多少模拟步走一步")
+        args = parser.parse_args()
+        game_settings["entity_store"] = args.entity_store
+        if args.replay: sys.exit(0 if run_replay(args.replay)[1] else 1)
+        bot = MatchBot(args.bot_depth, args.bot_budget_ms, args.bot_interval) if args.bot else None
+        run_headless(args.mode, args.level, args.endless, args.seed, args.ticks, grid_size=args.grid_size, tile_types=args.tile_types, bot=bot)
+    else:
+        main()
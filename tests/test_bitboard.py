@@ -0,0 +1,66 @@
+""" 位棋盘与列表盘面的差分测试：同一种子、同样大小和种类数的 BitboardMatchGame 和 TripleMatchGame
+执行同样的点击和洗牌，盘面、消除结果、可走交换的索引都必须一致；移位重建的交换索引必须与逐个 would_match 的结果一致 """
+import os
+import sys
+import random
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import integrated_game as game
+
+BOARDS = [(8, 3), (12, 5), (20, 7), (5, 9), (30, 4)]
+SEEDS = range(8)
+CLICKS = 150
+
+
+def make_pair(seed, grid_size, num_types, mode):
+    return [cls(mode=mode, rng=random.Random(seed), grid_size=grid_size, num_types=num_types) for cls in (game.TripleMatchGame, game.BitboardMatchGame)]
+
+
+def normalized(result):
+    # 战斗模式的元素子弹列表顺序取决于三连格子的枚举顺序，比较时排序
+    if result and 'projectiles' in result: return {**result, 'projectiles': sorted(result['projectiles'])}
+    return result
+
+
+def assert_same_board(board, bitboard):
+    assert bitboard.grid == board.grid
+    assert bitboard.valid_moves == board.valid_moves
+    masks = bitboard.masks; bitboard.rebuild_masks()
+    assert masks == bitboard.masks
+
+
+@pytest.mark.parametrize("mode", ["classic", "battle"])
+@pytest.mark.parametrize("grid_size,num_types", BOARDS, ids=[f"{n}x{n}_{t}" for n, t in BOARDS])
+@pytest.mark.parametrize("seed", SEEDS)
+def test_bitboard_equals_list_board(seed, grid_size, num_types, mode):
+    """ 一半点击走提示的交换（触发消除、下落、连锁和死局洗牌），一半随机点击；偶尔整盘洗牌 """
+    board, bitboard = make_pair(seed, grid_size, num_types, mode); rng = random.Random(seed + 4000)
+    assert_same_board(board, bitboard)
+    for _ in range(CLICKS):
+        if rng.random() < 0.05:
+            board.initialize_grid(); bitboard.initialize_grid()
+        elif rng.random() < 0.5 and board.hint():
+            r1, c1, r2, c2 = board.hint()
+            assert normalized(bitboard.click_cell(r1, c1)) == normalized(board.click_cell(r1, c1))
+            assert normalized(bitboard.click_cell(r2, c2)) == normalized(board.click_cell(r2, c2))
+        else:
+            row, col = rng.randrange(grid_size + 1), rng.randrange(grid_size)
+            assert normalized(bitboard.click_cell(row, col)) == normalized(board.click_cell(row, col))
+        assert_same_board(board, bitboard)
+        assert bitboard.deadlock_reshuffles == board.deadlock_reshuffles
+
+
+@pytest.mark.parametrize("grid_size,num_types", BOARDS + [(64, 6)], ids=[f"{n}x{n}_{t}" for n, t in BOARDS + [(64, 6)]])
+@pytest.mark.parametrize("seed", SEEDS)
+def test_shift_rebuild_equals_would_match(seed, grid_size, num_types):
+    """ 在新生成的盘面上，移位算出的交换索引与逐个交换调用 would_match 的结果相同 """
+    bitboard = game.BitboardMatchGame(rng=random.Random(seed), grid_size=grid_size, num_types=num_types)
+    for _ in range(3):
+        bitboard.generate_grid()
+        bitboard.rebuild_moves(); shifted = bitboard.valid_moves
+        game.TripleMatchGame.rebuild_moves(bitboard)
+        assert shifted == bitboard.valid_moves
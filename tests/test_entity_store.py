@@ -0,0 +1,54 @@
+""" 数组实体存储与对象列表的差分测试：ArrayZombieGame 和 ZombieGame 用同样的种子出怪，
+发射同样的子弹（包括战斗模式宽度不同的元素子弹和炮台），每一帧的状态都必须一致 """
+import os
+import sys
+import random
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import integrated_game as game
+
+pytest.importorskip("numpy")
+
+SEEDS = range(20)
+TICKS = 1500
+
+
+@pytest.fixture(scope="module", autouse=True)
+def elements():
+    game.headless_init()
+
+
+def make_games(seed):
+    level_data = {"zombies": float('inf'), "spawn_rate": 1 + seed % 15}
+    games = [cls(dict(level_data), rng=random.Random(seed), shot_rng=random.Random(seed + 1)) for cls in (game.ZombieGame, game.ArrayZombieGame)]
+    for zombie_game in games:
+        zombie_game.lives = 200
+        if seed % 3 == 0: zombie_game.turrets.append(game.AutoTurret(game.TRIPLE_MATCH_WIDTH + 50, game.SCREEN_HEIGHT // 2 - 25))
+    return games
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_array_store_equals_object_store(seed):
+    objects, arrays = make_games(seed); rng = random.Random(seed + 3000)
+    tiles = game.tile_surfaces(3, game.TRIPLE_MATCH_WIDTH // 8)
+    for tick in range(TICKS):
+        for _ in range(rng.choice((0, 0, 1, 2, 3))):
+            shot = rng.random()
+            if shot < 0.5:
+                for zombie_game in (objects, arrays): zombie_game.shoot_projectile()
+            elif shot < 0.75:
+                y_pos = rng.randrange(game.SCREEN_HEIGHT)
+                for zombie_game in (objects, arrays): zombie_game.shoot_custom_projectile(y_pos)
+            else:
+                row_y = rng.choice(objects.zombie_rows); image = rng.choice(tiles)
+                for zombie_game in (objects, arrays): zombie_game.add_projectile(game.projectile_pool.acquire(game.TRIPLE_MATCH_WIDTH, row_y, image))
+        status = objects.update()
+        assert arrays.update() == status, tick
+        assert (objects.lives, objects.score, objects.zombies_killed) == (arrays.lives, arrays.score, arrays.zombies_killed), tick
+        if status == game.GameState.GAME_OVER: return
+        assert objects.snapshot() == arrays.snapshot(), tick
+        assert (objects.zombie_count(), objects.projectile_count()) == (arrays.zombie_count(), arrays.projectile_count()), tick
@@ -0,0 +1,59 @@
+""" 增量三消检测与整盘扫描的差分测试：随机种子盘面上随机交换，
+find_matches_at 必须与 find_matches 结果相同，would_match 必须与"交换后整盘扫描"结果相同 """
+import os
+import sys
+import random
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import integrated_game as game
+
+ENGINES = [
+    ("list", lambda seed: game.TripleMatchGame(rng=random.Random(seed))),
+    ("bitboard", lambda seed: game.BitboardMatchGame(rng=random.Random(seed), grid_size=12, num_types=5)),
+]
+SEEDS = range(40)
+SWAPS_PER_BOARD = 60
+
+
+def random_swap(rng, size):
+    r, c = rng.randrange(size), rng.randrange(size - 1)
+    return (r, c, r, c + 1) if rng.random() < 0.5 else (c, r, c + 1, r)
+
+
+@pytest.mark.parametrize("name,make", ENGINES, ids=[name for name, _ in ENGINES])
+@pytest.mark.parametrize("seed", SEEDS)
+def test_find_matches_at_equals_full_scan(name, make, seed):
+    """ 交换后只查两格、下落后只查变动格子，与整盘扫描一致；连锁消除的每一轮都检查 """
+    triple_match = make(seed); rng = random.Random(seed + 1000)
+    assert triple_match.find_matches() == []
+    for _ in range(SWAPS_PER_BOARD):
+        r1, c1, r2, c2 = random_swap(rng, triple_match.grid_size)
+        triple_match.swap_elements(r1, c1, r2, c2)
+        matches = triple_match.find_matches_at([(r1, c1), (r2, c2)])
+        assert sorted(matches) == sorted(triple_match.find_matches())
+        if not matches: triple_match.swap_elements(r1, c1, r2, c2); continue
+        while matches:
+            triple_match.remove_matches(matches)
+            changed = triple_match.apply_gravity()
+            matches = triple_match.find_matches_at(changed)
+            assert sorted(matches) == sorted(triple_match.find_matches())
+
+
+@pytest.mark.parametrize("name,make", ENGINES, ids=[name for name, _ in ENGINES])
+@pytest.mark.parametrize("seed", SEEDS)
+def test_would_match_equals_swap_and_full_scan(name, make, seed):
+    """ 每个盘面上所有相邻交换都比较一次，并确认 would_match 不改动盘面 """
+    triple_match = make(seed); size = triple_match.grid_size
+    swaps = [(r, c, r, c + 1) for r in range(size) for c in range(size - 1)] + [(r, c, r + 1, c) for r in range(size - 1) for c in range(size)]
+    before = [row[:] for row in triple_match.grid]
+    for r1, c1, r2, c2 in swaps:
+        predicted = triple_match.would_match(r1, c1, r2, c2)
+        assert triple_match.grid == before
+        triple_match.swap_elements(r1, c1, r2, c2)
+        actual = bool(triple_match.find_matches())
+        triple_match.swap_elements(r1, c1, r2, c2)
+        assert predicted == actual, (r1, c1, r2, c2)
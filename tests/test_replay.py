@@ -0,0 +1,81 @@
+""" 录像往返测试：录下一局随机操作（点击、商店、洗牌、自定义子弹），经过JSON序列化后无界面重放，
+结束状态的摘要必须与录像里的一致；改动输入或种子后摘要必须不同 """
+import os
+import sys
+import json
+import random
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import integrated_game as game
+
+SEEDS = range(6)
+MAX_TICKS = 4000
+CASES = [("classic", 3, False, None), ("classic", 12, False, None), ("battle", 4, False, None), ("classic", None, True, "array"), ("battle", None, True, None)]
+
+
+@pytest.fixture(scope="module", autouse=True)
+def elements():
+    game.headless_init()
+
+
+def level_data_for(mode, level, endless):
+    if endless: return {"type": "kill", "target": float('inf'), "zombies": float('inf'), "spawn_rate": 120} if mode == 'battle' else {"zombies": float('inf'), "spawn_rate": 180}
+    return dict((game.BATTLE_LEVELS if mode == 'battle' else game.LEVELS)[level - 1])
+
+
+def record_session(mode, level, endless, seed):
+    """ 像界面循环那样每一帧先处理操作再推进模拟，返回录像（经过JSON往返，与写进文件再读回相同） """
+    session = game.GameSession(mode, level_data_for(mode, level, endless), endless=endless, seed=seed, lives=15 if (mode == 'battle' or endless) else None, record=True)
+    rng = random.Random(seed + 5000); status = game.GameState.PLAYING; size = session.triple_match.grid_size
+    while session.ticks < MAX_TICKS and status == game.GameState.PLAYING:
+        if session.ticks % 3 == 0:
+            action = rng.random()
+            if action < 0.6: session.click_cell(rng.randrange(size), rng.randrange(size))
+            elif action < 0.8: session.click((rng.randrange(game.SCREEN_WIDTH), rng.randrange(game.SCREEN_HEIGHT)))
+            elif action < 0.85: session.buy_life()
+            elif action < 0.9: session.buy_turret()
+            elif action < 0.95: session.shuffle()
+            elif session.can_fire_custom_bullet(): session.fire_custom_bullet(rng.randrange(game.SCREEN_HEIGHT))
+        status = session.tick()
+    return json.loads(json.dumps(game.session_replay(session, level, status.name))), status
+
+
+@pytest.mark.parametrize("mode,level,endless,entity_store", CASES, ids=[f"{m}_{'endless' if e else l}_{s or 'objects'}" for m, l, e, s in CASES])
+@pytest.mark.parametrize("seed", SEEDS)
+def test_replay_reproduces_digest(seed, mode, level, endless, entity_store, monkeypatch):
+    if entity_store == "array": pytest.importorskip("numpy")
+    monkeypatch.setitem(game.game_settings, "entity_store", entity_store or "objects")
+    replay, status = record_session(mode, level, endless, seed)
+    assert replay['inputs']
+    # 重放时用录像里的设置，而不是当前设置
+    monkeypatch.setitem(game.game_settings, "entity_store", "objects")
+    session, replayed_status = game.replay_session(replay)
+    assert replayed_status == status
+    assert session.ticks == replay['ticks']
+    assert session.digest() == replay['digest']
+    assert game.game_settings["entity_store"] == "objects"
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_changed_replay_changes_digest(seed):
+    """ 去掉所有盘面点击（不再有消除）或换一个种子后，重放出来的状态必须和录像不同 """
+    replay, _ = record_session("classic", 3, False, seed)
+    assert game.replay_session(replay)[0].matches_made > 0
+    no_clicks = dict(replay, inputs=[entry for entry in replay['inputs'] if entry[1] not in ('click', 'click_cell')])
+    assert game.replay_session(no_clicks)[0].digest() != replay['digest']
+    assert game.replay_session(dict(replay, seed=seed + 1))[0].digest() != replay['digest']
+
+
+def test_saved_replay_file(tmp_path, monkeypatch):
+    """ save_replay 写出的文件用命令行入口 run_replay 重放，状态一致 """
+    monkeypatch.setitem(game.game_settings, "replay_dir", str(tmp_path))
+    session = game.GameSession("classic", level_data_for("classic", 5, False), seed=7, record=True)
+    status = game.run_simulation(session, 2000, game.random_swap_player(7, interval=5))
+    path = game.save_replay(session, 5, status.name)
+    assert path and os.path.dirname(path) == str(tmp_path)
+    _, matched = game.run_replay(path)
+    assert matched